@@ -1,47 +1,48 @@
 # Import necessary
-from classes import Game, DatabaseHandler
+from classes import Game, get_db_handler
 import functions
 import random
+import sys
 import leagues
 import sites
 from datetime import date, timedelta
-import configparser
 
 # Database setup
-config = configparser.ConfigParser()
-config.read("config.ini")
-API_KEY = config["credentials"]["api_key"]
-DEFAULT_FROM = config["credentials"]["default_from"]
-
 db_file = "officiating.db"
-db_handler = DatabaseHandler(db_file)
 
-random_date = date.today() + timedelta(days=random.randint(1, 120))
-random_site = random.choice(list(sites.ballfields.keys()))
-random_league = random.choice(list(leagues.game_rates.keys()))
 
-# Instance of the Game class
-game = Game(
-    date=random_date.strftime("%y%m%d"),
-    site=random_site,
-    league=random_league,
-    # assignor=None,  # Get assignor from leagues
-    # game_fee=None, # Get game fee from leagues
-    # fee_paid=False, # default=False
-    # is_volunteer=False, # default=False
-    db_handler=db_handler,
-)
+def random_game():
+    """Build a Game for a random site and league; only called when a game is added."""
+    random_date = date.today() + timedelta(days=random.randint(1, 120))
+    random_site = random.choice(list(sites.ballfields.keys()))
+    random_league = random.choice(list(leagues.game_rates.keys()))
+
+    # Instance of the Game class
+    return Game(
+        date=random_date.strftime("%Y-%m-%d"),
+        site=random_site,
+        league=random_league,
+        # assignor=None,  # Get assignor from leagues
+        # game_fee=None, # Get game fee from leagues
+        # fee_paid=False, # default=False
+        # is_volunteer=False, # default=False
+        db_handler=get_db_handler(db_file),
+    )
 
 
 def main_menu():
     menu_options = {
-        "a": lambda: functions.add_game_to_db(db_file, game),
+        "a": lambda: functions.add_game_to_db(db_file, random_game()),
+        "i": lambda: functions.import_schedule_file(db_file),
         "u": lambda: functions.update_game_by_id(db_file),
         "r": lambda: functions.delete_game(db_file),
         "v": lambda: functions.review_unpaid_games(db_file),
-        "b": lambda: functions.bulk_update_games_paid_status(DatabaseHandler(db_file)),
+        "b": lambda: functions.bulk_update_games_paid_status(get_db_handler(db_file)),
         "g": lambda: functions.review_all_games(db_file),
         "s": lambda: functions.display_season_summary(db_file),
+        "t": lambda: functions.display_trip_plans(db_file),
+        "e": lambda: functions.display_season_analytics(db_file),
+        "h": lambda: functions.display_season_history(db_file),
         "d": lambda: functions.database_operations_submenu(),
         "x": lambda: functions.exit_application(),
     }
@@ -50,12 +51,16 @@ def main_menu():
         print()
         print(" Umpiring Revenue and Travel Tracker ".center(45, "*"))
         print("[A]dd Game")
+        print("[I]mport Schedule")
         print("[U]pdate Game")
         print("[R]emove Game")
         print("[V]iew Unpaid Games")
         print("[B]ulk Paid Games")
         print("[G]ame Ledger")
         print("[S]eason Summary")
+        print("[T]rip Mileage")
+        print("R[e]venue and Payment Reports")
+        print("[H]istory Across Seasons")
         print("[D]atabase Ops")
         print("E[x]it\n")
         choice = input("Enter your choice: ").lower()
@@ -70,4 +75,11 @@ def main_menu():
 
 
 if __name__ == "__main__":
+    # With arguments, run them as non-interactive commands (see cli.py); otherwise show the menu
+    if len(sys.argv) > 1:
+        import cli
+
+        sys.exit(cli.main())
+    # Bring a database from an older version up to the schema the menus expect
+    get_db_handler(db_file).initialize_database()
     main_menu()
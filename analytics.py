@@ -0,0 +1,243 @@
+"""Columnar season analytics: revenue, mileage and payment lag reports over NumPy arrays.
+
+A season's games are read once into a SeasonFrame of parallel arrays, with league,
+assignor and site held as integer codes into sorted label lists. Every report is a
+group-by over those codes computed with np.bincount, so answering another question
+costs a few milliseconds per million games instead of another SQL query. Loading is
+bounded by fetching the rows from SQLite, and happens once per frame.
+"""
+
+from dataclasses import dataclass
+from datetime import date
+import math
+
+import numpy as np
+
+from classes import DEFAULT_MILEAGE_RATE, season_bounds
+
+CATEGORIES = ("league", "assignor", "site")
+GROUP_KEYS = (*CATEGORIES, "month")
+LOAD_COLUMNS = (
+    "date, league, assignor, site, COALESCE(game_fee, 0), fee_paid, is_volunteer, COALESCE(mileage, 0), paid_on"
+)
+LOAD_BATCH_SIZE = 100_000
+
+
+def encode(values, index):
+    """Codes for `values` in `index` ({label: code}), adding labels not seen before."""
+    for value in dict.fromkeys(values):
+        index.setdefault(value, len(index))
+    return np.fromiter(map(index.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+def to_days(values):
+    """ISO date strings (or None) as datetime64[D], NaT for None."""
+    days = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+    # Converting None to NaT one value at a time is far slower than parsing the dates
+    present = np.not_equal(values, None)
+    days[present] = values[present].astype("datetime64[D]")
+    return days
+
+
+def sorted_codes(codes, index):
+    """Renumber codes so they follow label order; returns (codes, labels)."""
+    labels = sorted(index)
+    remap = np.empty(len(labels), dtype=np.int32)
+    remap[[index[label] for label in labels]] = np.arange(len(labels), dtype=np.int32)
+    return remap[codes], labels
+
+
+def group_order(groups, values, n_groups):
+    """Sort integer `values` by (group, value); returns (sorted values, start and count of each group).
+
+    Both are folded into one int64 key so a single sort replaces a two-key lexsort.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    if not len(values):
+        return values, np.cumsum(counts) - counts, counts
+    low = values.min()
+    span = int(values.max() - low) + 1
+    keys = np.sort(groups.astype(np.int64) * span + (values - low))
+    return keys % span + low, np.cumsum(counts) - counts, counts
+
+
+def rows_from_columns(by, keys, columns):
+    """One dict per group from its key labels and per-group arrays; NaN becomes None."""
+    names = (*by, *columns)
+    values = [[None if math.isnan(value) else value for value in column.tolist()] for column in columns.values()]
+    return [dict(zip(names, (*key, *row))) for key, row in zip(keys, zip(*values))]
+
+
+@dataclass
+class SeasonFrame:
+    """One row per game held as parallel arrays; `labels[category][code]` names a code."""
+
+    dates: np.ndarray  # datetime64[D]
+    fees: np.ndarray
+    mileage: np.ndarray
+    paid: np.ndarray
+    volunteer: np.ndarray
+    paid_on: np.ndarray  # datetime64[D], NaT when never stamped
+    codes: dict
+    labels: dict
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def load(cls, conn, season=None):
+        """Read the games of one season (or every game) in a single query."""
+        sql, params = f"SELECT {LOAD_COLUMNS} FROM game_details", ()
+        if season is not None:
+            sql, params = sql + " WHERE date >= ? AND date < ?", season_bounds(season)
+        cursor = conn.execute(sql, params)
+        try:
+            return cls.from_batches(iter(lambda: cursor.fetchmany(LOAD_BATCH_SIZE), []))
+        finally:
+            cursor.close()
+
+    @classmethod
+    def from_batches(cls, batches):
+        """Build a frame from batches of LOAD_COLUMNS rows, converting one batch at a time."""
+        indexes = {category: {} for category in CATEGORIES}
+        parts = {name: [] for name in ("dates", "fees", "mileage", "paid", "volunteer", "paid_on", *CATEGORIES)}
+        for batch in batches:
+            block = np.array(batch, dtype=object).reshape(-1, 9)
+            dates = to_days(block[:, 0])
+            # Games without a date cannot be placed in a season or month
+            dated = ~np.isnat(dates)
+            block = block[dated]
+            parts["dates"].append(dates[dated])
+            for column, category in enumerate(CATEGORIES, start=1):
+                values = ["" if value is None else value for value in block[:, column].tolist()]
+                parts[category].append(encode(values, indexes[category]))
+            parts["fees"].append(block[:, 4].astype(np.float64))
+            parts["paid"].append(block[:, 5].astype(bool))
+            parts["volunteer"].append(block[:, 6].astype(bool))
+            parts["mileage"].append(block[:, 7].astype(np.float64))
+            parts["paid_on"].append(to_days(block[:, 8]))
+
+        empty = {
+            "dates": "datetime64[D]",
+            "paid_on": "datetime64[D]",
+            "fees": np.float64,
+            "mileage": np.float64,
+            "paid": bool,
+            "volunteer": bool,
+        }
+        columns = {
+            name: np.concatenate(arrays) if arrays else np.empty(0, dtype=empty.get(name, np.int32))
+            for name, arrays in parts.items()
+        }
+        codes, labels = {}, {}
+        for category in CATEGORIES:
+            codes[category], labels[category] = sorted_codes(columns.pop(category), indexes[category])
+        return cls(**columns, codes=codes, labels=labels)
+
+    def key(self, name):
+        """(codes, labels) for a group key: a category, or "month" as YYYY-MM."""
+        if name in CATEGORIES:
+            return self.codes[name], self.labels[name]
+        if name != "month":
+            raise ValueError(f"Unknown group key {name!r}; expected one of {', '.join(GROUP_KEYS)}")
+        months = self.dates.astype("datetime64[M]")
+        if not len(months):
+            return np.zeros(0, dtype=np.int64), []
+        first = months.min()
+        span = np.arange(first, months.max() + 1)
+        return (months - first).astype(np.int64), [str(month) for month in span]
+
+    def group(self, by):
+        """Group games by one or more keys, e.g. ("assignor", "month").
+
+        Returns (group number of each game, label tuple of each group), with the groups
+        in label order and only combinations that have games.
+        """
+        by = (by,) if isinstance(by, str) else tuple(by)
+        if not by:
+            return np.zeros(len(self), dtype=np.intp), [()]
+        codes, labels = zip(*(self.key(name) for name in by))
+        if not len(self):
+            return np.zeros(0, dtype=np.intp), []
+        shape = [len(names) for names in labels]
+        flat = np.ravel_multi_index(codes, shape)
+        if math.prod(shape) <= 4 * len(flat):
+            # Few possible combinations: number the ones present with a bincount, no sort
+            present = np.bincount(flat, minlength=math.prod(shape)) > 0
+            groups = np.flatnonzero(present)
+            inverse = (np.cumsum(present) - 1)[flat]
+        else:
+            groups, inverse = np.unique(flat, return_inverse=True)
+        indices = np.unravel_index(groups, shape)
+        keys = zip(*([names[i] for i in positions.tolist()] for names, positions in zip(labels, indices)))
+        return inverse.ravel(), list(keys)
+
+    def totals(self, by="league", mileage_rate=DEFAULT_MILEAGE_RATE):
+        """Games, fees, mileage, reimbursement and revenue per mile for each group."""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        inverse, keys = self.group(by)
+
+        def total(weights=None):
+            return np.bincount(inverse, weights, minlength=len(keys))
+
+        fees, paid, mileage = total(self.fees), total(np.where(self.paid, self.fees, 0.0)), total(self.mileage)
+        per_mile = np.divide(fees, mileage, out=np.full(len(keys), np.nan), where=mileage > 0)
+        columns = {
+            "games": total().astype(np.int64),
+            "volunteer": total(self.volunteer.astype(np.float64)).astype(np.int64),
+            "fees": fees.round(2),
+            "owed": (fees - paid).round(2),
+            "paid": paid.round(2),
+            "mileage": mileage.round(1),
+            "reimbursement": (mileage * mileage_rate).round(2),
+            "revenue_per_mile": per_mile.round(2),
+        }
+        return rows_from_columns(by, keys, columns)
+
+    def payment_lag(self, by="assignor", as_of=None):
+        """Days from game to payment for each group, and what is still outstanding.
+
+        Lag covers paid games with a paid_on date. Outstanding counts unpaid games played
+        on or before `as_of` (default today), with the age of the oldest in days.
+        """
+        by = (by,) if isinstance(by, str) else tuple(by)
+        as_of = np.datetime64(as_of or date.today(), "D")
+        inverse, keys = self.group(by)
+        n_groups = len(keys)
+
+        stamped = self.paid & ~np.isnat(self.paid_on)
+        lags = (self.paid_on[stamped] - self.dates[stamped]).astype(np.int64)
+        sorted_lags, starts, counts = group_order(inverse[stamped], lags, n_groups)
+        has_lag = counts > 0
+        mean = np.full(n_groups, np.nan)
+        mean[has_lag] = np.bincount(inverse[stamped], lags, minlength=n_groups)[has_lag] / counts[has_lag]
+        # Middle one or two values of each group's sorted lags
+        median = np.full(n_groups, np.nan)
+        median[has_lag] = (
+            sorted_lags[starts[has_lag] + (counts[has_lag] - 1) // 2]
+            + sorted_lags[starts[has_lag] + counts[has_lag] // 2]
+        ) / 2
+        longest = np.full(n_groups, np.nan)
+        longest[has_lag] = sorted_lags[starts[has_lag] + counts[has_lag] - 1]
+
+        due = ~self.paid & (self.dates <= as_of)
+        due_days = self.dates[due].astype(np.int64)
+        sorted_days, due_starts, due_counts = group_order(inverse[due], due_days, n_groups)
+        oldest = np.full(n_groups, np.nan)
+        oldest[due_counts > 0] = as_of.astype(np.int64) - sorted_days[due_starts[due_counts > 0]]
+
+        columns = {
+            "paid_games": counts,
+            "mean_lag_days": mean.round(1),
+            "median_lag_days": median,
+            "max_lag_days": longest,
+            "outstanding": due_counts,
+            "outstanding_fees": np.bincount(inverse[due], self.fees[due], minlength=n_groups).round(2),
+            "oldest_unpaid_days": oldest,
+        }
+        rows = rows_from_columns(by, keys, columns)
+        for row in rows:
+            for name in ("max_lag_days", "oldest_unpaid_days"):
+                if row[name] is not None:
+                    row[name] = int(row[name])
+        return rows
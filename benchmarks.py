@@ -0,0 +1,225 @@
+"""Performance benchmarks for the database and reporting paths.
+
+Seeds throwaway databases of the requested sizes, times each operation and writes the
+results as JSON. A saved result file can be used as a baseline for later runs:
+
+    python benchmarks.py --sizes 1000 100000 1000000 --output baseline.json
+    python benchmarks.py --sizes 1000 100000 --compare baseline.json --threshold 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import functions
+import leagues
+import sites
+from classes import (
+    INSERT_GAME_IDS_SQL,
+    UPSERT_SITE_MILEAGE_SQL,
+    ConnectionManager,
+    DatabaseHandler,
+    Game,
+    GameBatch,
+    lookup_ids,
+)
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_THRESHOLD = 0.25
+SEASON = 2026
+
+
+def seed_database(db_file, n_games, seed=0):
+    """Create a migrated database holding `n_games` games spread over three seasons."""
+    handler = DatabaseHandler(db_file)
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler.initialize_database()
+    rng = random.Random(seed)
+    site_names = list(sites.ballfields)
+    league_names = list(leagues.game_rates)
+    first_day = date(SEASON - 2, 1, 1)
+
+    with handler.writer() as conn:
+        conn.executemany(UPSERT_SITE_MILEAGE_SQL, ((name, round(rng.uniform(1, 60), 1)) for name in site_names))
+        site_ids = lookup_ids(conn, "sites", site_names)
+        league_ids = lookup_ids(conn, "leagues", [league.upper() for league in league_names])
+        assignor_ids = lookup_ids(conn, "assignors", [*leagues.game_assignors.values(), "TBD"])
+
+        def rows():
+            for _ in range(n_games):
+                league = rng.choice(league_names)
+                yield (
+                    (first_day + timedelta(days=rng.randrange(3 * 365))).isoformat(),
+                    site_ids[rng.choice(site_names)],
+                    league_ids[league.upper()],
+                    assignor_ids[leagues.game_assignors.get(league, "TBD")],
+                    leagues.game_rates[league],
+                    rng.random() < 0.7,
+                    False,
+                    round(rng.uniform(1, 60), 1),
+                )
+
+        conn.executemany(INSERT_GAME_IDS_SQL, rows())
+    handler.mileage_cache.invalidate()
+    return handler
+
+
+def timed(operation, repeat=3):
+    """Best wall-clock time of `repeat` runs, with the operation's printing suppressed."""
+    best = float("inf")
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            operation()
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(db_file, n_games, repeat=3):
+    """Seed a database of `n_games` and return {benchmark name: seconds}."""
+    seed_start = time.perf_counter()
+    handler = seed_database(db_file, n_games)
+    results = {"seed": time.perf_counter() - seed_start}
+
+    site_name = next(iter(sites.ballfields))
+    league = next(iter(leagues.game_rates))
+    game = Game(site=site_name, league=league, db_handler=handler, date=f"{SEASON}-06-01")
+    unpaid_ids = handler.fetch_unpaid_game_ids()[:1000]
+
+    def add_games():
+        for _ in range(100):
+            functions.add_game_to_db(db_file, game)
+
+    def add_games_write_behind():
+        pool = ConnectionManager.for_file(db_file)
+        pool.write_behind = True
+        try:
+            for _ in range(100):
+                pool.submit(game.insert)
+            pool.flush()
+        finally:
+            pool.write_behind = False
+
+    paid_status = [True]
+
+    def bulk_update():
+        # Alternate so every run really flips the 1k games
+        handler.bulk_update_games_paid_status(unpaid_ids, paid_status[0])
+        paid_status[0] = not paid_status[0]
+
+    def bulk_update_where():
+        handler.update_paid_status_where(paid_status[0], league=league, season=SEASON)
+        paid_status[0] = not paid_status[0]
+
+    def ledger_page(last_page):
+        with handler.connection() as conn:
+            rows = functions.iter_ledger_page(conn, SEASON, backwards=last_page)
+            field_names = ["ID", "Date", "League", "Paid", "Miles"]
+            for line in functions.render_fixed_width(field_names, [7, 10, 10, 4, 7], rows):
+                print(line)
+
+    def season_analytics():
+        import analytics
+
+        with handler.connection() as conn:
+            frame = analytics.SeasonFrame.load(conn, SEASON)
+        frame.totals(("league", "month"))
+        frame.payment_lag("assignor")
+
+    def build_game_batch():
+        batch = GameBatch()
+        for day in range(10_000):
+            batch.append(site_name, league, f"{SEASON}-06-{day % 28 + 1:02d}")
+        for _row in batch.resolve(handler).rows():
+            pass
+
+    def mileage_lookups():
+        for _ in range(10_000):
+            handler.get_site_mileage(site_name)
+
+    results["add_game_to_db_x100"] = timed(add_games, repeat)
+    results["add_game_write_behind_x100"] = timed(add_games_write_behind, repeat)
+    results["bulk_update_games_paid_status_1k"] = timed(bulk_update, repeat)
+    results["update_paid_status_where_league"] = timed(bulk_update_where, repeat)
+    results["display_season_summary"] = timed(lambda: functions.display_season_summary(db_file), repeat)
+    results["season_analytics"] = timed(season_analytics, repeat)
+    results["review_all_games_first_page"] = timed(lambda: ledger_page(False), repeat)
+    results["review_all_games_last_page"] = timed(lambda: ledger_page(True), repeat)
+    results["fetch_unpaid_game_ids"] = timed(handler.fetch_unpaid_game_ids, repeat)
+    results["game_batch_build_10k"] = timed(build_game_batch, repeat)
+    results["site_mileage_lookup_x10k"] = timed(mileage_lookups, repeat)
+    ConnectionManager.for_file(db_file).close()
+    return results
+
+
+def run_suite(sizes, repeat=3, workdir=None):
+    """Run the benchmarks for every size and return a JSON-serializable result document."""
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for n_games in sizes:
+            db_file = os.path.join(tmp, f"bench_{n_games}.db")
+            report["results"][str(n_games)] = run_benchmarks(db_file, n_games, repeat)
+    return report
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Return (size, benchmark, baseline seconds, current seconds) for every regression.
+
+    A regression is a benchmark more than `threshold` (a fraction) slower than baseline.
+    Sizes or benchmarks missing from either side are ignored.
+    """
+    regressions = []
+    for size, results in current["results"].items():
+        for name, seconds in results.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before and seconds > before * (1 + threshold):
+                regressions.append((size, name, before, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark database and reporting paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="number of games to seed")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the best is kept")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a saved result file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown fraction")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.sizes, args.repeat)
+    for size, results in report["results"].items():
+        print(f"{size} games")
+        for name, seconds in results.items():
+            print(f"  {name:<36} {seconds * 1000:10.2f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for size, name, before, after in regressions:
+            print(f"REGRESSION {size} {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,63 +1,280 @@
+from array import array
 import configparser
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dataclasses import dataclass, field, InitVar
-from datetime import datetime
+from datetime import date, datetime
+import functools
+import json
 import sqlite3
 from sqlite3 import Error
+import threading
+import time
+from typing import ClassVar
 
 import sites
 import leagues
-import googlemaps
-
-config = configparser.ConfigParser()
-config.read("config.ini")
-api_key = config["credentials"]["api_key"]
-default_from = config["credentials"]["default_from"]
+import concurrency
+import writebehind
+from distances import (
+    MAX_DESTINATIONS_PER_REQUEST,
+    NO_ROUTE_STATUSES,
+    chunked,
+    request_errors,
+    resolve_distances_concurrently,
+)
+import geodesic
+import migrations
+from metrics import metrics
 
 db_file = "officiating.db"
 
+# Game dates are stored as ISO text so season filters are plain range predicates an index can serve
+DATE_FORMAT = "%Y-%m-%d"
+INPUT_DATE_FORMATS = (DATE_FORMAT, "%m/%d/%Y", "%Y%m%d", "%y%m%d")
+
+# IRS standard business mileage rate for 2025, in dollars per mile
+DEFAULT_MILEAGE_RATE = 0.70
+
+# Routes to fields rarely change, but roads do over a season or two
+DEFAULT_DISTANCE_CACHE_TTL_DAYS = 365
+DEFAULT_DISTANCE_CACHE_MAX_ENTRIES = 50_000
+
+# Names go through the game_details view, which stores their lookup ids on games
+INSERT_GAME_SQL = """ INSERT INTO game_details(date, site, league, assignor, game_fee, fee_paid, is_volunteer,
+                      mileage) VALUES(?,?,UPPER(?),?,?,?,?,?) """
+INSERT_GAME_IDS_SQL = """ INSERT INTO games(date, site_id, league_id, assignor_id, game_fee, fee_paid, is_volunteer,
+                          mileage) VALUES(?,?,?,?,?,?,?,?) """
+# Lookup tables of the names games refer to by id, in games column order
+LOOKUP_TABLES = ("sites", "leagues", "assignors")
+LOOKUP_BATCH_SIZE = 500
+
+UPSERT_SITE_MILEAGE_SQL = (
+    "INSERT INTO sites (name, mileage) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET mileage = excluded.mileage"
+)
+
+
+# Config, API clients and handlers are created on first use so that importing this module
+# (e.g. from a script that only reads the ledger) never touches config.ini or the network.
+@functools.cache
+def get_config():
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    return config
+
+
+@functools.cache
+def configure_metrics():
+    """Apply [metrics] enabled and sample_rate from config.ini, once per process."""
+    config = get_config()
+    metrics.configure(
+        enabled=config.getboolean("metrics", "enabled", fallback=None),
+        sample_rate=config.getfloat("metrics", "sample_rate", fallback=None),
+    )
+
+
+# A missing setting raises configparser.NoSectionError or NoOptionError
+def get_api_key():
+    return get_config().get("credentials", "api_key")
+
+
+def get_default_from():
+    return get_config().get("credentials", "default_from")
+
+
+def get_road_factor():
+    """Driving-to-straight-line distance ratio used for offline estimates ([distances] road_factor)."""
+    return get_config().getfloat("distances", "road_factor", fallback=geodesic.DEFAULT_ROAD_FACTOR)
+
+
+def get_mileage_rate():
+    """Mileage reimbursement in dollars per mile for analytics reports ([analytics] mileage_rate)."""
+    return get_config().getfloat("analytics", "mileage_rate", fallback=DEFAULT_MILEAGE_RATE)
+
+
+def get_journal_mode():
+    """SQLite journal mode for every connection ([database] journal_mode); WAL unless configured."""
+    return get_config().get("database", "journal_mode", fallback=concurrency.DEFAULT_JOURNAL_MODE)
+
+
+def get_busy_timeout():
+    """Seconds to wait for another process's lock before giving up ([database] busy_timeout)."""
+    return get_config().getfloat("database", "busy_timeout", fallback=concurrency.DEFAULT_BUSY_TIMEOUT)
+
+
+def get_write_behind():
+    """Whether writes are queued and group-committed in the background ([database] write_behind)."""
+    return get_config().getboolean("database", "write_behind", fallback=False)
+
+
+def get_write_behind_batch():
+    """Most writes committed together ([database] write_behind_batch)."""
+    return get_config().getint("database", "write_behind_batch", fallback=writebehind.DEFAULT_MAX_BATCH)
+
+
+def get_write_behind_delay():
+    """Seconds a write waits for others to share its commit ([database] write_behind_delay_ms)."""
+    delay_ms = get_config().getfloat("database", "write_behind_delay_ms", fallback=None)
+    return writebehind.DEFAULT_MAX_DELAY if delay_ms is None else delay_ms / 1000
+
+
+def get_distance_cache_ttl():
+    """Seconds a cached distance is used before it is fetched again ([distances] cache_ttl_days; 0 never)."""
+    return get_config().getfloat("distances", "cache_ttl_days", fallback=DEFAULT_DISTANCE_CACHE_TTL_DAYS) * 86400
+
+
+def get_distance_cache_max_entries():
+    """Most distances kept in the cache ([distances] cache_max_entries; 0 for no limit)."""
+    return get_config().getint("distances", "cache_max_entries", fallback=DEFAULT_DISTANCE_CACHE_MAX_ENTRIES)
+
+
+def get_origin_coordinates():
+    """(latitude, longitude) of default_from from [distances], or None if not configured."""
+    latitude = get_config().getfloat("distances", "origin_latitude", fallback=None)
+    longitude = get_config().getfloat("distances", "origin_longitude", fallback=None)
+    if latitude is None or longitude is None:
+        return None
+    return latitude, longitude
+
+
+def get_gmaps_client(api_key=None):
+    """Build a Google Maps client, importing googlemaps only when a distance is needed."""
+    import googlemaps
 
-@dataclass
+    return metrics.instrument_client(googlemaps.Client(key=api_key or get_api_key()))
+
+
+@functools.cache
+def get_db_handler(db_file=db_file):
+    """Return the shared DatabaseHandler for a database file."""
+    return DatabaseHandler(db_file)
+
+
+def __getattr__(name):
+    # Lazily provide the module attributes that used to be built at import time
+    lazy_attributes = {
+        "config": get_config,
+        "api_key": get_api_key,
+        "default_from": get_default_from,
+        "db_handler": get_db_handler,
+    }
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def normalize_date(value):
+    """Return a game date as YYYY-MM-DD, accepting the legacy yymmdd/yyyymmdd forms."""
+    if isinstance(value, (date, datetime)):
+        return value.strftime(DATE_FORMAT)
+    value = str(value).strip()
+    for date_format in INPUT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date '{value}'")
+
+
+def season_bounds(season):
+    """Return the half-open [start, end) date range of a season (calendar year)."""
+    season = int(season)
+    return f"{season:04d}-01-01", f"{season + 1:04d}-01-01"
+
+
+def lookup_ids(conn, table, names):
+    """Return {name: id} from a lookup table (sites, leagues or assignors), adding the names it lacks.
+
+    Each distinct name is looked up once; empty names and None have no id.
+    """
+    names = [name for name in dict.fromkeys(names) if name]
+    conn.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", ((name,) for name in names))
+    ids = {}
+    for start in range(0, len(names), LOOKUP_BATCH_SIZE):
+        chunk = names[start : start + LOOKUP_BATCH_SIZE]
+        ids.update(conn.execute(f"SELECT name, id FROM {table} WHERE name IN ({', '.join('?' * len(chunk))})", chunk))
+    return ids
+
+
+@dataclass(slots=True)
 class Game:
     site: str
     league: str
-    db_handler: InitVar["DatabaseHandler"]
-    date: str = field(default_factory=lambda: datetime.now().strftime("%Y%m%d"))
+    # Without a handler nothing is looked up or fetched; mileage is then 0 unless given
+    db_handler: InitVar["DatabaseHandler | None"] = None
+    date: str = field(default_factory=lambda: datetime.now().strftime(DATE_FORMAT))
     assignor: str = field(init=False)
     game_fee: int = field(init=False)
     fee_paid: bool = False
     is_volunteer: bool = False
-    mileage: float = field(init=False)
+    mileage: float | None = None
+    # Where the official drives from; None means default_from in config.ini
+    origin: InitVar[str | None] = None
 
     @staticmethod
-    def calculate_distance_for_site(api_key, default_from, site_name, site_dict):
-        gmaps = googlemaps.Client(key=api_key)
+    def calculate_distance_for_site(api_key, default_from, site_name, site_dict, db_handler=None, estimate=True):
+        """Driving miles from default_from to a site, through the distance cache.
+
+        A site without a route is 0.0, and one without an address is None. If the
+        Distance Matrix API cannot be reached the mileage is estimated from stored
+        coordinates instead, or with estimate=False None is returned, so callers can keep
+        estimates apart from measured distances.
+        """
         address = site_dict.get(site_name)
         if not address:
-            return "Site address not found"
-
-        distance_result = gmaps.distance_matrix(default_from, address, mode="driving")
-        if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-            distance_text = distance_result["rows"][0]["elements"][0]["distance"]["text"]
-            if "km" in distance_text:
-                distance_km = float(distance_text.split()[0].replace(",", ""))
-                distance_miles = round(distance_km * 0.621371, 1)
-                return distance_miles
-            else:
-                # Assuming the distance is in miles if "km" is not in distance_text
-                return float(distance_text.split()[0])
-        else:
+            print(f"Site address not found for {site_name}.")
+            return None
+        db_handler = db_handler or DatabaseHandler(db_file, api_key=api_key)
+
+        try:
+            # A single interactive lookup falls back to an estimate rather than retrying
+            distances, errors = db_handler.distance_cache.resolve(
+                db_handler.gmaps, default_from, {site_name: address}, max_retries=0
+            )
+        except ValueError as e:
+            # googlemaps.Client rejects a missing or malformed API key
+            distances, errors = {}, {site_name: f"{type(e).__name__}: {e}"}
+        if site_name in distances:
+            return distances[site_name]
+        if errors.get(site_name) in NO_ROUTE_STATUSES:
             return 0.0
+        if not estimate:
+            return None
+        print(f"Distance Matrix unavailable ({errors.get(site_name)}); estimating mileage for {site_name}.")
+        return db_handler.estimate_site_mileages(default_from).get(site_name, 0.0)
 
-    def __post_init__(self, db_handler):
+    def __post_init__(self, db_handler, origin):
+        self.date = normalize_date(self.date)
         self.assignor = self.get_assignor_from_league(self.league)
         self.game_fee = self.get_game_fee_from_league(self.league)
         # self.mileage = self.get_site_mileage_from_db(db_handler, self.site)
+        if self.mileage is not None:
+            return
+        if db_handler is None:
+            self.mileage = 0.0
+            return
+
+        if origin is not None:
+            address = sites.ballfields.get(self.site)
+            distances = db_handler.site_mileages_from(origin, {self.site: address}) if address else {}
+            self.mileage = distances.get(self.site, 0.0)
+            return
 
         # Check if mileage is already in the database
         mileage = self.get_site_mileage_from_db(db_handler, self.site)
         if not mileage:
-            mileage = Game.calculate_distance_for_site(api_key, default_from, self.site, sites.ballfields)
-            db_handler.update_or_add_site(self.site, mileage)
+            default_from = get_default_from()
+            mileage = Game.calculate_distance_for_site(
+                db_handler.api_key, default_from, self.site, sites.ballfields, db_handler, estimate=False
+            )
+            if mileage is None and not sites.ballfields.get(self.site):
+                mileage = 0.0
+            elif mileage is None:
+                # The estimate is for this game only; storing it would stop the site being fetched again
+                print(f"Distance Matrix unavailable; estimating mileage for {self.site}.")
+                mileage = db_handler.estimate_site_mileages(default_from).get(self.site, 0.0)
+            else:
+                db_handler.update_or_add_site(self.site, mileage)
         self.mileage = mileage
 
     @staticmethod
@@ -75,237 +292,939 @@ class Game:
         league_assignors = leagues.game_assignors
         return league_assignors.get(league, "TBD")
 
+    def as_row(self):
+        """Parameters for INSERT_GAME_SQL."""
+        return (
+            self.date,
+            self.site,
+            self.league,
+            self.assignor,
+            self.game_fee,
+            self.fee_paid,
+            self.is_volunteer,
+            self.mileage,
+        )
 
-class DatabaseHandler:
-    # def __init__(self, db_file):
-    #     self.db_file = db_file
+    def insert(self, conn):
+        """Insert the game, adding its site, league and assignor to the lookup tables if new; returns its id."""
+        names = (self.site, self.league.upper(), self.assignor)
+        ids = [lookup_ids(conn, table, [name]).get(name) for table, name in zip(LOOKUP_TABLES, names)]
+        row = (self.date, *ids, self.game_fee, self.fee_paid, self.is_volunteer, self.mileage)
+        return conn.execute(INSERT_GAME_IDS_SQL, row).lastrowid
+
+
+class GameBatch:
+    """Games held column by column, for building and inserting many at once.
+
+    Each distinct site and league is stored once and referenced by an integer code from
+    parallel arrays, so appending a game allocates no per-game object. resolve() looks up
+    assignor and fee once per league and mileage once per site, and rows() hands the games
+    straight to executemany.
+    """
+
+    __slots__ = (
+        "_codes",
+        "_normalized",
+        "assignors",
+        "dates",
+        "fee_paid",
+        "game_fees",
+        "is_volunteer",
+        "league_codes",
+        "leagues",
+        "mileages",
+        "site_codes",
+        "sites",
+    )
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.dates = []
+        self.site_codes = array("I")
+        self.league_codes = array("I")
+        self.fee_paid = array("b")
+        self.is_volunteer = array("b")
+        # Distinct sites and leagues by code, and the per-code values resolve() fills in
+        self.sites, self.leagues = [], []
+        self.assignors, self.game_fees, self.mileages = [], [], []
+        self._codes = ({}, {})
+        # Schedules repeat a handful of dates, and strptime dominates appending
+        self._normalized = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    @staticmethod
+    def _code(codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def append(self, site, league, date=None, fee_paid=False, is_volunteer=False):
+        """Add one game without any lookups; raises ValueError for an unrecognized date."""
+        # Normalized first, so a bad date leaves the columns unchanged
+        if not date:
+            game_date = datetime.now().strftime(DATE_FORMAT)
+        elif (game_date := self._normalized.get(date)) is None:
+            game_date = self._normalized[date] = normalize_date(date)
+        site_codes, league_codes = self._codes
+        self.dates.append(game_date)
+        self.site_codes.append(self._code(site_codes, self.sites, site))
+        self.league_codes.append(self._code(league_codes, self.leagues, league))
+        self.fee_paid.append(bool(fee_paid))
+        self.is_volunteer.append(bool(is_volunteer))
+
+    def resolve(self, db_handler=None, fetch_missing=False, origin=None):
+        """Fill in assignor and fee per league and mileage per site; returns the batch.
 
-    def __init__(self, db_file, api_key=api_key):
+        Mileage comes from the site mileage cache, or is 0 without a db_handler. With
+        fetch_missing, every site still lacking a mileage is requested together through
+        db_handler.resolve_site_mileages. Like Game, an `origin` other than default_from
+        takes every site's mileage from that origin through the distance cache, and
+        nothing is stored in the sites table.
+        """
+        self.assignors = [Game.get_assignor_from_league(league) for league in self.leagues]
+        self.game_fees = [Game.get_game_fee_from_league(league) for league in self.leagues]
+        if db_handler is None:
+            self.mileages = [0.0] * len(self.sites)
+            return self
+        if origin is not None:
+            addresses = {site: sites.ballfields[site] for site in self.sites if sites.ballfields.get(site)}
+            distances = db_handler.site_mileages_from(origin, addresses)
+            self.mileages = [distances.get(site, 0.0) for site in self.sites]
+            return self
+        mileages = [db_handler.get_site_mileage(site) or 0.0 for site in self.sites]
+        if fetch_missing:
+            missing = {
+                site: sites.ballfields[site]
+                for site, mileage in zip(self.sites, mileages)
+                if not mileage and site in sites.ballfields
+            }
+            if missing:
+                resolved = db_handler.resolve_site_mileages(get_default_from(), missing)
+                mileages = [resolved.get(site, mileage) for site, mileage in zip(self.sites, mileages)]
+        self.mileages = mileages
+        return self
+
+    def _check_resolved(self):
+        if len(self.mileages) != len(self.sites) or len(self.assignors) != len(self.leagues):
+            raise ValueError("GameBatch.resolve() must be called after the last append.")
+
+    def _rows(self, site_values, league_values, assignor_values):
+        """Yield one row per game, with the site, league and assignor taken from per-code lists."""
+        game_fees, mileages = self.game_fees, self.mileages
+        for game_date, site, league, fee_paid, is_volunteer in zip(
+            self.dates, self.site_codes, self.league_codes, self.fee_paid, self.is_volunteer
+        ):
+            yield (
+                game_date,
+                site_values[site],
+                league_values[league],
+                assignor_values[league],
+                game_fees[league],
+                fee_paid,
+                is_volunteer,
+                mileages[site],
+            )
+
+    def rows(self):
+        """Return an iterator of INSERT_GAME_SQL parameters for every game; call resolve() first."""
+        self._check_resolved()
+        return self._rows(self.sites, self.leagues, self.assignors)
+
+    def games(self):
+        """Yield each row as a Game, built without any I/O."""
+        for game_date, site, league, _assignor, _fee, fee_paid, is_volunteer, mileage in self.rows():
+            yield Game(
+                site, league, date=game_date, fee_paid=bool(fee_paid), is_volunteer=bool(is_volunteer), mileage=mileage
+            )
+
+    def insert(self, conn):
+        """Insert every game with one executemany; returns the number inserted.
+
+        Sites, leagues and assignors are stored as lookup ids, looked up (or added) once
+        per distinct name.
+        """
+        self._check_resolved()
+        leagues = [league.upper() for league in self.leagues]
+        site_ids = lookup_ids(conn, "sites", self.sites)
+        league_ids = lookup_ids(conn, "leagues", leagues)
+        assignor_ids = lookup_ids(conn, "assignors", self.assignors)
+        conn.executemany(
+            INSERT_GAME_IDS_SQL,
+            self._rows(
+                [site_ids.get(site) for site in self.sites],
+                [league_ids.get(league) for league in leagues],
+                [assignor_ids.get(assignor) for assignor in self.assignors],
+            ),
+        )
+        return len(self)
+
+
+def set_paid_status_by_ids(conn, game_ids, paid_status):
+    """Set the paid status of the games with these ids; returns the number changed."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_game_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.bulk_game_ids")
+    try:
+        # One JSON array parameter loads the IDs far faster than a row per ID
+        conn.execute(
+            "INSERT OR IGNORE INTO temp.bulk_game_ids (id) SELECT value FROM json_each(?)",
+            (json.dumps(game_ids),),
+        )
+    except sqlite3.OperationalError:
+        # SQLite built without JSON support
+        conn.executemany("INSERT OR IGNORE INTO temp.bulk_game_ids (id) VALUES (?)", ((i,) for i in game_ids))
+    updated = migrations.set_fee_paid(conn, paid_status, "id IN (SELECT id FROM temp.bulk_game_ids)")
+    conn.execute("DELETE FROM temp.bulk_game_ids")
+    return updated
+
+
+class ConnectionManager:
+    """Long-lived SQLite connections for one database file, reused per thread.
+
+    Every DatabaseHandler method and functions.py helper borrows its connection from here,
+    so a thread opens a database once and all call sites share that connection's
+    prepared statement cache. Reads use connection() and writes use writer(), or submit()
+    where the caller can let the write be queued behind others (see writebehind.py).
+    """
+
+    _managers: ClassVar[dict[str, "ConnectionManager"]] = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(
+        self,
+        db_file,
+        cached_statements=256,
+        cache_size_kib=65536,
+        journal_mode=None,
+        busy_timeout=None,
+        write_behind=None,
+    ):
         self.db_file = db_file
-        self.api_key = api_key
-        self.gmaps = googlemaps.Client(key=self.api_key)
+        self.cached_statements = cached_statements
+        # Page cache per connection; bulk updates touch index pages all over the table
+        self.cache_size_kib = cache_size_kib
+        # None reads [database] in config.ini when the first connection is opened
+        self.journal_mode = journal_mode
+        self.busy_timeout = busy_timeout
+        self.write_behind = write_behind
+        self._write_behind_queue = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, db_file):
+        """Return the process-wide manager for a database file."""
+        with cls._managers_lock:
+            manager = cls._managers.get(db_file)
+            if manager is None:
+                manager = cls._managers[db_file] = cls(db_file)
+            return manager
+
+    @classmethod
+    def close_all(cls):
+        """Close every pooled connection of every manager."""
+        with cls._managers_lock:
+            managers = list(cls._managers.values())
+        for manager in managers:
+            manager.close()
+
+    def get(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection is only used by the thread that opened it; check_same_thread is
+            # relaxed so close() can run from whichever thread shuts the application down.
+            configure_metrics()
+            start = time.perf_counter()
+            conn = sqlite3.connect(
+                self.db_file,
+                cached_statements=self.cached_statements,
+                check_same_thread=False,
+                factory=metrics.connection_factory(),
+            )
+            conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+            concurrency.configure_connection(
+                conn,
+                self.journal_mode or get_journal_mode(),
+                get_busy_timeout() if self.busy_timeout is None else self.busy_timeout,
+            )
+            metrics.record_connection(self.db_file, time.perf_counter() - start)
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.writing = False
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Yield this thread's connection as a unit of work.
+
+        The outermost block commits on success and rolls back on error; nested blocks
+        join the enclosing transaction.
+        """
+        conn = self.get()
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            if self._local.depth == 1:
+                conn.rollback()
+            raise
+        else:
+            if self._local.depth == 1:
+                conn.commit()
+        finally:
+            self._local.depth -= 1
+            if not self._local.depth and self._local.writing:
+                self._local.writing = False
+                self._write_lock.release()
+
+    @contextmanager
+    def writer(self):
+        """Yield this thread's connection inside a write transaction; every write goes through here.
+
+        Writers in this process take turns on one lock, and the transaction opens with
+        BEGIN IMMEDIATE, so writers in other processes are waited for before anything is
+        read rather than failing part way through. Inside an open transaction it joins
+        that one, like connection(). Nested in a connection() block, the lock is held until
+        that outer block has committed.
+        """
+        conn = self.get()
+        if self._local.writing:
+            with self.connection() as conn:
+                yield conn
+            return
+        # Released by connection() once the outermost block has committed or rolled back
+        self._write_lock.acquire()
+        self._local.writing = True
+        with self.connection() as conn:
+            if not conn.in_transaction:
+                concurrency.begin_immediate(conn)
+            yield conn
+
+    def submit(self, operation, *args):
+        """Run operation(conn, *args) as a write and return a Future of its result.
+
+        With write-behind on, the write is queued and the Future resolves once the
+        background thread has committed it; otherwise it runs in writer() now and the
+        Future is already done, holding the result or the sqlite3.Error it raised.
+        """
+        if self.write_behind is None:
+            self.write_behind = get_write_behind()
+        if self.write_behind:
+            return self._start_write_behind().submit(operation, *args)
+        future = Future()
+        try:
+            with self.writer() as conn:
+                future.set_result(operation(conn, *args))
+        except sqlite3.Error as e:
+            future.set_exception(e)
+        return future
+
+    def _start_write_behind(self):
+        with self._lock:
+            if self._write_behind_queue is None:
+                self._write_behind_queue = writebehind.WriteBehindQueue(
+                    self, get_write_behind_batch(), get_write_behind_delay()
+                )
+            return self._write_behind_queue
+
+    def flush(self):
+        """Wait until every write queued for write-behind has been committed."""
+        if self._write_behind_queue is not None:
+            self._write_behind_queue.flush()
+
+    def close(self):
+        """Commit any queued writes, then close all connections opened by this manager."""
+        with self._lock:
+            write_behind_queue, self._write_behind_queue = self._write_behind_queue, None
+        if write_behind_queue is not None:
+            write_behind_queue.close()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class SiteMileageCache:
+    """Process-wide map of site name to mileage, loaded in bulk from the sites table.
+
+    Writes made through DatabaseHandler update the cache directly. Changes committed by
+    other connections or processes are detected with `PRAGMA data_version`, checked at
+    most once per `check_interval` seconds so bulk lookups stay free of database reads.
+    """
+
+    _caches: ClassVar[dict[str, "SiteMileageCache"]] = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, pool, check_interval=1.0):
+        self.pool = pool
+        self.check_interval = check_interval
+        self._mileage = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, db_file):
+        """Return the process-wide cache for a database file."""
+        with cls._caches_lock:
+            cache = cls._caches.get(db_file)
+            if cache is None:
+                cache = cls._caches[db_file] = cls(ConnectionManager.for_file(db_file))
+            return cache
+
+    @staticmethod
+    def _data_version(conn):
+        # data_version is per connection, so remember which connection it was read from
+        return id(conn), conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self):
+        """(Re)load every site's mileage in a single query; returns {site: mileage}."""
+        conn = self.pool.get()
+        with self._lock:
+            self._mileage = mileage = dict(conn.execute("SELECT name, mileage FROM sites").fetchall())
+            self._version = self._data_version(conn)
+            self._checked_at = time.monotonic()
+        return mileage
+
+    def _validate(self):
+        """Return the current {site: mileage}, reloading it if it was invalidated or changed."""
+        # A snapshot, so an invalidate() from another thread cannot pull it out from under the caller
+        with self._lock:
+            mileage = self._mileage
+        if mileage is None:
+            return self.load()
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return mileage
+        self._checked_at = now
+        if self._data_version(self.pool.get()) != self._version:
+            return self.load()
+        return mileage
+
+    def get(self, site_name):
+        """Return the cached mileage for a site, or None if the site is unknown."""
+        return self._validate().get(site_name)
+
+    def update(self, mileages):
+        """Record {site: mileage} values just written to the sites table."""
+        with self._lock:
+            if self._mileage is not None:
+                self._mileage.update(mileages)
+
+    def invalidate(self):
+        """Forget everything; the next lookup reloads from the database."""
+        with self._lock:
+            self._mileage = None
+
+
+class DistanceCache:
+    """Driving distances keyed by (origin, destination address, mode), stored in the distances table.
+
+    Every Distance Matrix lookup goes through resolve(): it reads every requested pair in a
+    few indexed queries and only the pairs missing from the table are sent to the API,
+    batched and concurrently. Moving house or driving from work just adds rows for the new
+    origin. Entries older than `ttl` seconds are fetched again, and once the table holds
+    more than `max_entries` the oldest measurements are evicted; hits and misses are
+    counted in metrics.
+    """
+
+    # Keeps each IN (...) list well under SQLite's bound-parameter limit
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, pool, ttl=None, max_entries=None):
+        self.pool = pool
+        # None reads [distances] in config.ini on first use; 0 turns either limit off
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get_many(self, origin, destinations, mode="driving"):
+        """Return {address: miles} for the pairs among `destinations` cached within the TTL."""
+        if self.ttl is None:
+            self.ttl = get_distance_cache_ttl()
+        # datetime('now', NULL) is NULL, so without a TTL every entry is fresh
+        oldest = f"-{int(self.ttl)} seconds" if self.ttl else None
+        destinations = set(destinations)
+        found, expired = {}, 0
+        with self.pool.connection() as conn:
+            for addresses in chunked(destinations, self.LOOKUP_CHUNK_SIZE):
+                placeholders = ",".join("?" * len(addresses))
+                for destination, miles, fresh in conn.execute(
+                    f"SELECT destination, miles, fetched_at >= COALESCE(datetime('now', ?), '') FROM distances "
+                    f"WHERE origin = ? AND mode = ? AND destination IN ({placeholders})",
+                    (oldest, origin, mode, *addresses),
+                ):
+                    if fresh:
+                        found[destination] = miles
+                    else:
+                        expired += 1
+        metrics.record_distance_cache(hits=len(found), misses=len(destinations) - len(found), expired=expired)
+        return found
+
+    def put_many(self, origin, miles_by_address, mode="driving"):
+        """Store {address: miles} measured from `origin`, replacing older measurements."""
+        if self.max_entries is None:
+            self.max_entries = get_distance_cache_max_entries()
+        with self.pool.writer() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO distances (origin, destination, mode, miles, fetched_at) "
+                "VALUES (?, ?, ?, ?, datetime('now'))",
+                ((origin, address, mode, miles) for address, miles in miles_by_address.items()),
+            )
+            if not self.max_entries:
+                return
+            # Counted on the narrow fetched_at index; the eviction walks it oldest first
+            excess = conn.execute("SELECT COUNT(1) FROM distances").fetchone()[0] - int(self.max_entries)
+            if excess > 0:
+                evicted = conn.execute(
+                    """
+                    DELETE FROM distances WHERE (origin, destination, mode) IN (
+                        SELECT origin, destination, mode FROM distances ORDER BY fetched_at LIMIT ?
+                    )
+                    """,
+                    (excess,),
+                ).rowcount
+                metrics.record_distance_cache(evicted=evicted)
+
+    def resolve(self, gmaps, origin, destinations, mode="driving", **resolver_options):
+        """Resolve {key: address} to ({key: miles}, {key: error}), fetching only uncached pairs.
+
+        `resolver_options` are passed on to distances.resolve_distances_concurrently.
+        """
+        cached = self.get_many(origin, destinations.values(), mode)
+        missing = {address: address for address in destinations.values() if address not in cached}
+        errors_by_address = {}
+        if missing:
+            fetched, errors_by_address = resolve_distances_concurrently(
+                gmaps, origin, missing, mode=mode, **resolver_options
+            )
+            self.put_many(origin, fetched, mode)
+            cached.update(fetched)
+        distances = {key: cached[address] for key, address in destinations.items() if address in cached}
+        errors = {
+            key: errors_by_address[address] for key, address in destinations.items() if address in errors_by_address
+        }
+        return distances, errors
+
+
+class DatabaseHandler:
+    def __init__(self, db_file, api_key=None, gmaps=None):
+        self.db_file = db_file
+        self._api_key = api_key
+        self.pool = ConnectionManager.for_file(db_file)
+        self.mileage_cache = SiteMileageCache.for_file(db_file)
+        # Any client with a googlemaps-compatible distance_matrix method (e.g. an offline fake)
+        configure_metrics()
+        self._gmaps = metrics.instrument_client(gmaps)
+        self._origin_coordinates = {}
+        self.distance_cache = DistanceCache(self.pool)
+
+    @property
+    def api_key(self):
+        if self._api_key is None:
+            self._api_key = get_api_key()
+        return self._api_key
+
+    @property
+    def gmaps(self):
+        """Google Maps client, built on first use."""
+        if self._gmaps is None:
+            self._gmaps = get_gmaps_client(self.api_key)
+        return self._gmaps
 
     def create_connection(self):
-        """Create a database connection to a SQLite database"""
+        """Return the pooled connection to the SQLite database for this thread"""
         try:
-            conn = sqlite3.connect(self.db_file)
-            return conn
+            return self.pool.get()
         except Error as e:
             print(e)
         return None
 
-    def initialize_database(self):
-        """Initialize the database with the required tables"""
-        conn = self.create_connection()
-        if conn is not None:
-            self.create_games_table(conn)
-            self.create_relation_tables(conn)
-            conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+    def connection(self):
+        """Context manager yielding the pooled connection, committing or rolling back on exit"""
+        return self.pool.connection()
+
+    def writer(self):
+        """Like connection(), but inside a write transaction taken up front; use it for every write"""
+        return self.pool.writer()
+
+    def submit(self, operation, *args):
+        """Run operation(conn, *args) as a write, queued when write-behind is on; returns a Future"""
+        return self.pool.submit(operation, *args)
+
+    def flush(self):
+        """Wait for every queued write to be committed"""
+        self.pool.flush()
+
+    def initialize_database(self, raise_errors=False):
+        """Initialize the database with the required tables, migrating it to the latest schema.
+
+        Run whenever the application opens a database; an up-to-date one costs a single
+        PRAGMA user_version read.
+        """
+        self.migrate(raise_errors=raise_errors)
+
+    def schema_version(self):
+        """Return the schema version recorded in PRAGMA user_version"""
+        return migrations.schema_version(self.pool.get())
+
+    def migrate(self, target=migrations.LATEST_VERSION, raise_errors=False):
+        """Apply pending schema migrations in place, each in its own transaction.
 
-    def create_games_table(self, conn):
+        A database error is printed and [] returned, or raised with raise_errors.
+        """
+        try:
+            if self.schema_version() >= target:
+                return []
+            applied = migrations.migrate(self.pool.get(), target, transaction=self.writer)
+            if applied:
+                self.mileage_cache.invalidate()
+                print(f"Applied migrations {applied}; schema is at version {self.schema_version()}")
+            return applied
+        except Error as e:
+            if raise_errors:
+                raise
+            print(f"An error occurred while migrating the database: {e}")
+        return []
+
+    def create_games_table(self, conn=None):
         """Create a table in the SQLite database"""
         try:
-            c = conn.cursor()
-            c.execute(
+            with self.writer() as pooled:
+                c = (conn or pooled).cursor()
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS games (
+                        id INTEGER PRIMARY KEY,
+                        date TEXT,
+                        site TEXT,
+                        league TEXT,
+                        assignor TEXT,
+                        game_fee INTEGER,
+                        fee_paid BOOLEAN,
+                        is_volunteer BOOLEAN,
+                        mileage FLOAT
+                    );
                 """
-                CREATE TABLE IF NOT EXISTS games (
-                    id INTEGER PRIMARY KEY,
-                    date TEXT,
-                    site TEXT,
-                    league TEXT,
-                    assignor TEXT,
-                    game_fee INTEGER,
-                    fee_paid BOOLEAN,
-                    is_volunteer BOOLEAN,
-                    mileage FLOAT
-                );
-            """
-            )
+                )
             print("Table created successfully")
         except Error as e:
             print(e)
 
+    def create_indexes(self, conn=None):
+        """Create the indexes behind the season, unpaid and league/assignor report queries"""
+        try:
+            with self.writer() as pooled:
+                migrations.create_games_indexes(conn or pooled)
+        except Error as e:
+            print(e)
+
+    def normalize_game_dates(self, conn=None):
+        """Rewrite legacy yymmdd and yyyymmdd game dates as YYYY-MM-DD"""
+        try:
+            with self.writer() as pooled:
+                (conn or pooled).execute(migrations.NORMALIZE_DATES_SQL)
+        except Error as e:
+            print(e)
+
     def create_sites_table(self):
-        conn = self.create_connection()
-        if conn is not None:
-            try:
+        try:
+            with self.writer() as conn:
                 c = conn.cursor()
                 c.execute(
                     """
                     CREATE TABLE IF NOT EXISTS sites (
                         id INTEGER PRIMARY KEY,
                         name TEXT NOT NULL UNIQUE,
-                        mileage FLOAT DEFAULT 0
+                        mileage REAL DEFAULT 0
                     )
                 """
                 )
-                conn.commit()
-                print("Table created successfully")
-            except Error as e:
-                print(e)
-            finally:
-                conn.close()
-        else:
-            print("Error! Cannot create the database connection.")
+            print("Table created successfully")
+        except Error as e:
+            print(e)
 
-    def create_relation_tables(self, conn):
+    def create_relation_tables(self, conn=None):
         """Create or update relation tables in the SQLite database to include mileage in sites"""
         try:
-            c = conn.cursor()
-            c.executescript(
+            with self.writer() as pooled:
+                c = (conn or pooled).cursor()
+                # Separate statements: executescript() would commit the writer's transaction first
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS sites (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL UNIQUE,
+                        mileage REAL DEFAULT 0
+                    )
                 """
-                CREATE TABLE IF NOT EXISTS sites (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE,
-                    mileage INTEGER DEFAULT 0.0
-                );
-                CREATE TABLE IF NOT EXISTS leagues (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT UNIQUE
-                );
-                CREATE TABLE IF NOT EXISTS assignors (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT UNIQUE
-                );
-            """
-            )
+                )
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS leagues (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT UNIQUE
+                    )
+                """
+                )
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS assignors (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT UNIQUE
+                    )
+                """
+                )
             print("Relation tables created or updated successfully")
         except sqlite3.Error as e:
             print(e)
+        self.sync_lookup_tables()
+
+    def sync_lookup_tables(self, site_dict=None, raise_errors=False):
+        """Add every site in sites.py and league and assignor in leagues.py to the lookup tables.
+
+        Names already present keep their ids. Returns the number of names added; a database
+        error is printed and 0 returned, or raised with raise_errors.
+        """
+        site_dict = sites.ballfields if site_dict is None else site_dict
+        names = {
+            "sites": list(site_dict),
+            "leagues": [league.upper() for league in leagues.game_rates],
+            "assignors": list(leagues.game_assignors.values()),
+        }
+        added = 0
+        try:
+            with self.writer() as conn:
+                before = conn.total_changes
+                for table, table_names in names.items():
+                    lookup_ids(conn, table, table_names)
+                added = conn.total_changes - before
+            if added:
+                print(f"{added} sites, leagues and assignors added to the lookup tables.")
+        except sqlite3.Error as e:
+            if raise_errors:
+                raise
+            print(f"An error occurred while syncing the lookup tables: {e}")
+        return added
 
     def drop_tables(self):
         """Drop tables from the database"""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
+        try:
+            with self.writer() as conn:
                 c = conn.cursor()
+                c.execute("DROP VIEW IF EXISTS game_details")
+                c.execute("DROP VIEW IF EXISTS season_summary_details")
                 c.execute("DROP TABLE IF EXISTS games")
                 c.execute("DROP TABLE IF EXISTS sites")
                 c.execute("DROP TABLE IF EXISTS leagues")
                 c.execute("DROP TABLE IF EXISTS assignors")
-                conn.commit()
-                print("Tables dropped successfully")
-            except sqlite3.Error as e:
-                print(f"An error occurred while dropping tables: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+                c.execute("DROP TABLE IF EXISTS season_summary")
+                # The distances table is kept: it only holds API results that are costly to re-fetch.
+                # So is the partitions table, since the archive files it lists are not deleted.
+                c.execute("PRAGMA user_version = 0")
+            self.mileage_cache.invalidate()
+            print("Tables dropped successfully")
+        except sqlite3.Error as e:
+            print(f"An error occurred while dropping tables: {e}")
 
     def rebuild_database(self):
-        """Drops all tables and recreates them with the updated structure"""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
-                c = conn.cursor()
+        """Drops all tables and recreates them at the latest schema version"""
+        self.drop_tables()
+        if self.migrate():
+            print("Database rebuilt successfully")
 
-                # Drop existing tables
-                c.execute("DROP TABLE IF EXISTS games")
-                c.execute("DROP TABLE IF EXISTS sites")
-                c.execute("DROP TABLE IF EXISTS leagues")
-                c.execute("DROP TABLE IF EXISTS assignors")
-                # Recreate table with the updated schema
+    def archive_season(self, season, path=None, vacuum=False, raise_errors=False):
+        """Move a closed season's games to their own database file; returns the games moved.
 
-                self.create_games_table(conn)
-                self.create_relation_tables(conn)
+        With vacuum, the main file is compacted afterwards so it really shrinks. An error
+        is printed and 0 returned, or raised with raise_errors.
+        """
+        import partitions
 
-                conn.commit()
-                print("Database rebuilt successfully")
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+        try:
+            conn = self.pool.get()
+            moved = partitions.archive_season(conn, season, path, transaction=self.writer)
+            print(f"{moved} games archived to {partitions.archived_seasons(conn)[int(season)]}")
+            if vacuum:
+                conn.execute("VACUUM")
+            return moved
+        except (ValueError, OSError, Error) as e:
+            if raise_errors:
+                raise
+            print(f"An error occurred while archiving season {season}: {e}")
+        return 0
+
+    def rebuild_season_summary(self):
+        """Recompute the season summary rollup from the games table"""
+        try:
+            with self.writer() as conn:
+                migrations.rebuild_season_summary(conn)
+            print("Season summary rebuilt successfully")
+        except sqlite3.Error as e:
+            print(f"An error occurred while rebuilding the season summary: {e}")
+
+    def verify_season_summary(self, tolerance=0.01):
+        """Diff the trigger-maintained rollup against one rebuilt from scratch.
+
+        Returns a list of ((season, league, assignor), expected, actual) mismatches, where
+        expected and actual are (games, owed, paid, mileage) tuples.
+        """
+        mismatches = []
+        try:
+            with self.connection() as conn:
+                expected = {row[:3]: row[3:] for row in conn.execute(migrations.SEASON_SUMMARY_FROM_GAMES_SQL)}
+                actual = {
+                    row[:3]: row[3:]
+                    for row in conn.execute(
+                        "SELECT season, league_id, assignor_id, games, owed, paid, mileage FROM season_summary"
+                    )
+                }
+                league_names = dict(conn.execute("SELECT id, name FROM leagues"))
+                assignor_names = dict(conn.execute("SELECT id, name FROM assignors"))
+            empty = (0, 0, 0, 0.0)
+            for season, league_id, assignor_id in sorted(expected.keys() | actual.keys()):
+                key = (season, league_id, assignor_id)
+                expected_totals, actual_totals = expected.get(key, empty), actual.get(key, empty)
+                if any(abs(e - a) > tolerance for e, a in zip(expected_totals, actual_totals)):
+                    names = (season, league_names.get(league_id, ""), assignor_names.get(assignor_id, ""))
+                    mismatches.append((names, expected_totals, actual_totals))
+        except sqlite3.Error as e:
+            print(f"An error occurred while verifying the season summary: {e}")
+        return mismatches
 
     def fetch_unpaid_game_ids(self):
         """Fetch IDs of unpaid games."""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
+        try:
+            with self.connection() as conn:
                 cur = conn.cursor()
-                cur.execute("SELECT id FROM games WHERE fee_paid = 0")
+                cur.execute("SELECT id FROM games WHERE fee_paid = 0 ORDER BY id")
                 unpaid_games = cur.fetchall()
                 return [game[0] for game in unpaid_games]  # Return a list of IDs
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
         return []
 
-    def bulk_update_games_paid_status(self, game_ids, paid_status):
-        """Bulk update the paid status of multiple games."""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
-                cur = conn.cursor()
-                # Prepare the SQL query to update the fee_paid status
-                # sql = "UPDATE games SET fee_paid = ? WHERE id IN ({seq})".format(seq=",".join(["?"] * len(game_ids)))
-                sql = f"UPDATE games SET fee_paid = ? WHERE id IN ({','.join(['?'] * len(game_ids))})"
-                # Execute the query with paid_status and the list of game_ids
-                cur.execute(sql, [int(paid_status)] + game_ids)
-                conn.commit()
-                print(f"{cur.rowcount} games have been updated.")
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+    def bulk_update_games_paid_status(self, game_ids, paid_status, wait=True, raise_errors=False):
+        """Bulk update the paid status of any number of games in one transaction.
 
-    def populate_site_distances(self, default_from=default_from, site_dict=sites.ballfields):
-        conn = self.create_connection()
-        if conn is not None:
-            try:
-                for site_name, address in site_dict.items():
-                    distance_result = self.gmaps.distance_matrix(default_from, address, mode="driving")
-                    if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-                        distance_text = distance_result["rows"][0]["elements"][0]["distance"]["text"]
-                        distance_km = float(distance_text.split()[0].replace(",", ""))
-                        if "km" in distance_text:
-                            distance_miles = round(distance_km * 0.621371, 1)
-                        else:
-                            distance_miles = distance_km
-                        with conn:
-                            conn.execute(
-                                "INSERT OR REPLACE INTO sites (name, mileage) VALUES (?, ?)",
-                                (site_name, distance_miles),
-                            )
-                    else:
-                        print(f"Distance not found for site: {site_name}")
-                conn.commit()
-            except Error as e:
-                print(e)
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+        The IDs are loaded into a temporary table and joined, so the statement never runs
+        into SQLite's bound-parameter limit. Returns the number of games changed, or with
+        wait=False a Future of it, which stays pending while write-behind holds the update.
+        A database error is printed and 0 returned, or raised with raise_errors.
+        """
+        game_ids = [int(game_id) for game_id in game_ids]
+        future = self.submit(set_paid_status_by_ids, game_ids, paid_status)
+        if not wait:
+            return future
+        updated = 0
+        try:
+            updated = future.result()
+            print(f"{updated} games have been updated.")
+        except sqlite3.Error as e:
+            if raise_errors:
+                raise
+            print(f"An error occurred: {e}")
+        return updated
+
+    def update_paid_status_where(
+        self, paid_status, assignor=None, league=None, before=None, season=None, raise_errors=False
+    ):
+        """Set the paid status of every game matching all the given filters in one statement.
+
+        e.g. update_paid_status_where(True, assignor="Smith", before="2026-06-01") marks
+        Smith's games before June 1st as paid. `before` is exclusive. Returns the number of
+        games changed; a database error is printed and 0 returned, or raised with raise_errors.
+        """
+        clauses, params = [], []
+        if assignor is not None:
+            clauses.append("assignor_id = (SELECT id FROM assignors WHERE name = ?)")
+            params.append(assignor)
+        if league is not None:
+            clauses.append("league_id = (SELECT id FROM leagues WHERE name = ?)")
+            params.append(league.upper())
+        if before is not None:
+            clauses.append("date < ?")
+            params.append(normalize_date(before))
+        if season is not None:
+            clauses.append("date >= ? AND date < ?")
+            params.extend(season_bounds(season))
+        updated = 0
+        try:
+            with self.writer() as conn:
+                updated = migrations.set_fee_paid(conn, paid_status, " AND ".join(clauses) or "1", params)
+            print(f"{updated} games have been updated.")
+        except sqlite3.Error as e:
+            if raise_errors:
+                raise
+            print(f"An error occurred: {e}")
+        return updated
+
+    def populate_site_distances(self, default_from=None, site_dict=None, batch_size=MAX_DESTINATIONS_PER_REQUEST):
+        """Resolve mileage for every site in batched API requests and store it in one transaction."""
+        default_from = default_from or get_default_from()
+        site_dict = sites.ballfields if site_dict is None else site_dict
+        try:
+            self.resolve_site_mileages(default_from, site_dict, batch_size=batch_size)
+        except Error as e:
+            print(e)
+
+    def resolve_site_mileages(self, default_from, site_dict, **resolver_options):
+        """Resolve {name: address} from default_from and store every mileage found in the sites table.
+
+        Pairs already in the distance cache are not requested again.
+        `resolver_options` are passed on to distances.resolve_distances_concurrently. Sites
+        that could not be resolved are reported and left unchanged. Returns {name: miles}.
+        """
+        distances, errors = self.distance_cache.resolve(self.gmaps, default_from, site_dict, **resolver_options)
+        for site_name, error in errors.items():
+            print(f"Distance not found for site: {site_name} ({error})")
+        self.save_site_mileages(distances)
+        return distances
+
+    def site_mileages_from(self, origin, site_dict=None, mode="driving"):
+        """Return {name: miles} from any origin, fetching only pairs not already cached."""
+        site_dict = sites.ballfields if site_dict is None else site_dict
+        distances, errors = self.distance_cache.resolve(self.gmaps, origin, site_dict, mode=mode)
+        for site_name, error in errors.items():
+            print(f"Distance not found for site: {site_name} ({error})")
+        return distances
+
+    def save_site_mileages(self, mileages):
+        """Insert or update {name: miles} in a single transaction."""
+        if not mileages:
+            return
+        with self.writer() as conn:
+            conn.executemany(UPSERT_SITE_MILEAGE_SQL, mileages.items())
+        self.mileage_cache.update(mileages)
+
+    def fetch_sites_with_zero_mileage(self, site_dict=None):
+        """Return {name: address} for known sites whose stored mileage is missing or zero."""
+        site_dict = sites.ballfields if site_dict is None else site_dict
+        return {name: address for name, address in site_dict.items() if not self.get_site_mileage(name)}
 
     def get_site_mileage(self, site_name):
-        conn = self.create_connection()
+        """Return a site's mileage from the in-memory cache, or None if the site is unknown."""
         mileage = None
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT mileage FROM sites WHERE name = ?", (site_name,))
-                result = cursor.fetchone()
-                if result:
-                    mileage = result[0]
-            except Error as e:
-                print(e)
-            finally:
-                conn.close()
+        try:
+            mileage = self.mileage_cache.get(site_name)
+        except Error as e:
+            print(e)
         return mileage
 
     def update_or_add_site(self, site_name, mileage):
         """Update mileage for an existing site or add a new site with its mileage."""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
+        try:
+            with self.writer() as conn:
                 cursor = conn.cursor()
                 # Check if the site already exists
                 cursor.execute("SELECT id FROM sites WHERE name = ?", (site_name,))
@@ -316,89 +1235,125 @@ class DatabaseHandler:
                 else:
                     # Insert a new site with mileage
                     cursor.execute("INSERT INTO sites (name, mileage) VALUES (?, ?)", (site_name, mileage))
-                conn.commit()
-                print(f"Site '{site_name}' updated/added successfully.")
-            except sqlite3.Error as e:
-                print(f"An error occurred while updating/adding the site: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+            self.mileage_cache.update({site_name: mileage})
+            print(f"Site '{site_name}' updated/added successfully.")
+        except sqlite3.Error as e:
+            print(f"An error occurred while updating/adding the site: {e}")
 
     def list_sites(self):
         """List all sites and their mileages from the sites table."""
-        conn = self.create_connection()
-        if conn is not None:
-            try:
+        try:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT name, mileage FROM sites ORDER BY name")
                 sites = cursor.fetchall()
-                for site in sites:
-                    print(f"Site: {site[0]}, Mileage: {site[1]}")
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+            for site in sites:
+                print(f"Site: {site[0]}, Mileage: {site[1]}")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+
+    def add_new_sites_mileages(self, sites, default_from, batch_size=MAX_DESTINATIONS_PER_REQUEST):
+        """Adds mileages for sites that are not in the sites table yet or have no mileage there.
+
+        Sites can be in the table without a mileage, added as a lookup row when a game
+        named them.
+        """
+        new_sites = self.fetch_sites_with_zero_mileage(sites)
+        if not new_sites:
+            return
+        try:
+            # Calculate mileage for all new sites concurrently, in as few requests as possible
+            distances = self.resolve_site_mileages(default_from, new_sites, batch_size=batch_size)
+            for site_name, distance_miles in distances.items():
+                print(f"Added new site: {site_name} with mileage: {distance_miles} miles.")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
 
-    def add_new_sites_mileages(self, sites, default_from):
-        """Adds mileages for new sites to the database that do not exist in the sites table."""
-        existing_sites = self.fetch_existing_sites()
-        conn = self.create_connection()
-        if conn is not None:
+    def fetch_site_coordinates(self):
+        """Return {name: (latitude, longitude)} for every site that has been geocoded."""
+        coordinates = {}
+        try:
+            with self.connection() as conn:
+                rows = conn.execute(
+                    "SELECT name, latitude, longitude FROM sites WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+                ).fetchall()
+            coordinates = {name: (latitude, longitude) for name, latitude, longitude in rows}
+        except sqlite3.Error as e:
+            print(f"An error occurred while fetching site coordinates: {e}")
+        return coordinates
+
+    def geocode_sites(self, site_dict=None):
+        """Geocode every site in `site_dict` that has no stored coordinates yet, in one transaction."""
+        site_dict = sites.ballfields if site_dict is None else site_dict
+        known = self.fetch_site_coordinates()
+        rows = []
+        for site_name, address in site_dict.items():
+            if site_name in known:
+                continue
             try:
-                cursor = conn.cursor()
-                for site_name, address in sites.items():
-                    if site_name not in existing_sites:
-                        # Calculate mileage since it's a new site
-                        distance_result = self.gmaps.distance_matrix(default_from, address, mode="driving")
-                        if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-                            distance_text = distance_result["rows"][0]["elements"][0]["distance"]["text"]
-                            if "km" in distance_text:
-                                distance_km = float(distance_text.split()[0].replace(",", ""))
-                                distance_miles = round(distance_km * 0.621371, 1)
-                            else:
-                                distance_miles = float(distance_text.split()[0])
-                            cursor.execute(
-                                "INSERT INTO sites (name, mileage) VALUES (?, ?)", (site_name, distance_miles)
-                            )
-                            print(f"Added new site: {site_name} with mileage: {distance_miles} miles.")
-                        else:
-                            print(f"Distance not found for site: {site_name}")
-                conn.commit()
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
-            finally:
-                conn.close()
-        else:
-            print("Error! cannot create the database connection.")
+                location = geodesic.geocode(self.gmaps, address)
+            except request_errors() as e:
+                print(f"Could not geocode {site_name}: {e}")
+                continue
+            if location is None:
+                print(f"Could not geocode {site_name}: address not found")
+            else:
+                rows.append((site_name, *location))
+        try:
+            with self.writer() as conn:
+                conn.executemany(
+                    "INSERT INTO sites (name, latitude, longitude) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET latitude = excluded.latitude, longitude = excluded.longitude",
+                    rows,
+                )
+            self.mileage_cache.invalidate()
+            print(f"{len(rows)} sites geocoded.")
+        except sqlite3.Error as e:
+            print(f"An error occurred while saving site coordinates: {e}")
+        return len(rows)
+
+    def origin_coordinates(self, default_from=None):
+        """Coordinates of the trip origin: configured, or geocoded once per address."""
+        configured = get_origin_coordinates()
+        if configured is not None and default_from in (None, get_default_from()):
+            return configured
+        default_from = default_from or get_default_from()
+        if default_from not in self._origin_coordinates:
+            self._origin_coordinates[default_from] = geodesic.geocode(self.gmaps, default_from)
+        return self._origin_coordinates[default_from]
+
+    def estimate_site_mileages(self, default_from=None, road_factor=None):
+        """Estimate driving miles to every geocoded site without calling the Distance Matrix API."""
+        try:
+            origin = self.origin_coordinates(default_from)
+        except request_errors() as e:
+            print(f"Origin coordinates unavailable: {e}")
+            return {}
+        if origin is None:
+            return {}
+        index = geodesic.CoordinateIndex(self.fetch_site_coordinates())
+        return index.estimate(origin, get_road_factor() if road_factor is None else road_factor)
 
     def fetch_existing_sites(self):
         """Fetches existing site names from the database."""
-        conn = self.create_connection()
         sites = set()
-        if conn is not None:
-            try:
+        try:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT name FROM sites")
                 sites = {row[0] for row in cursor.fetchall()}
-            except sqlite3.Error as e:
-                print(f"An error occurred while fetching existing sites: {e}")
-            finally:
-                conn.close()
+        except sqlite3.Error as e:
+            print(f"An error occurred while fetching existing sites: {e}")
         return sites
 
 
-db_handler = DatabaseHandler(db_file)
-
 # Call API to populate sites milage in database
-# db_handler.populate_site_distances()
+# get_db_handler().populate_site_distances()
 
 # List all sites
-# print(db_handler.list_sites())
+# print(get_db_handler().list_sites())
 
 # # Update mileage for an existing site or add a new site
 # site_name = "Central Park"
 # mileage = 12.5  # Example mileage
-# db_handler.update_or_add_site(site_name, mileage)
+# get_db_handler().update_or_add_site(site_name, mileage)
@@ -0,0 +1,358 @@
+"""Non-interactive command line for scripting imports, reconciliation and reports.
+
+    python . import schedule.csv
+    python . --format ndjson ledger --season 2026 --unpaid
+    python . mark-paid --assignor Smith --before 2026-06-01
+    python . batch nightly.txt          # one command per line, "-" reads stdin
+
+Every command calls the same logic as the menus without prompting. Results go to stdout
+as text, JSON or NDJSON (one object per line); progress messages from the shared logic go
+to stderr so piped output stays clean. A batch runs all its commands in one process over
+the same pooled connections, so each command costs no startup or connection setup.
+"""
+
+import argparse
+import configparser
+import contextlib
+import json
+import shlex
+import sqlite3
+import sys
+
+from classes import Game, db_file as DEFAULT_DB_FILE, get_db_handler, get_mileage_rate, normalize_date, season_bounds
+import functions
+import importer
+import leagues
+import migrations
+import partitions
+import sites
+
+FORMATS = ("text", "json", "ndjson")
+LEDGER_FIELDS = ("id", "date", "site", "league", "assignor", "game_fee", "fee_paid", "is_volunteer", "mileage")
+LEDGER_BATCH_SIZE = 500
+REPORT_GROUP_KEYS = ("league", "assignor", "site", "month")
+
+
+class CommandError(Exception):
+    """A command could not be carried out; reported without a traceback."""
+
+
+def open_input(path):
+    """Open a file for reading, with "-" meaning stdin (which is left open afterwards)."""
+    return contextlib.nullcontext(sys.stdin) if path == "-" else open(path)
+
+
+def emit(result, output_format, out=None):
+    """Write one command's result: a dict, optionally holding an iterable of records under "rows".
+
+    Rows are streamed as they are produced for NDJSON output.
+    """
+    out = out or sys.stdout
+    rows = result.pop("rows", None)
+    if output_format == "ndjson":
+        if rows is None:
+            out.write(json.dumps(result, default=str) + "\n")
+        for row in rows or ():
+            out.write(json.dumps(row, default=str) + "\n")
+    elif output_format == "json":
+        if rows is not None:
+            result["rows"] = list(rows)
+        out.write(json.dumps(result, default=str) + "\n")
+    else:
+        out.write(" ".join(f"{key}={value}" for key, value in result.items()) + "\n")
+        rows = list(rows or ())
+        if rows:
+            field_names = list(rows[0])
+            widths = [max(len(name), *(len(str(row[name])) for row in rows)) for name in field_names]
+            values = ([row[name] for name in field_names] for row in rows)
+            for line in functions.render_fixed_width(field_names, widths, values):
+                out.write(line.rstrip() + "\n")
+
+
+def cmd_add(args):
+    if args.site not in sites.ballfields:
+        raise CommandError(f"{args.site} not recognized.")
+    if args.league not in leagues.game_rates:
+        raise CommandError(f"{args.league} not recognized")
+    handler = get_db_handler(args.db)
+    optional = {"date": args.date} if args.date else {}
+    game = Game(
+        site=args.site,
+        league=args.league,
+        db_handler=handler,
+        fee_paid=args.paid,
+        is_volunteer=args.volunteer,
+        origin=args.origin,
+        **optional,
+    )
+    with handler.writer() as conn:
+        game_id = game.insert(conn)
+    return {"command": "add", "id": game_id, **dict(zip(LEDGER_FIELDS[1:], game.as_row()))}
+
+
+def cmd_import(args):
+    try:
+        report = importer.import_schedule(args.db, args.path, chunk_size=args.chunk_size)
+    except OSError as e:
+        raise CommandError(f"Could not read {args.path}: {e}")
+    return {
+        "command": "import",
+        "path": args.path,
+        "inserted": report.inserted,
+        "rows": [{"line": line, "error": message} for line, message in report.errors],
+    }
+
+
+def read_game_ids(args):
+    game_ids = list(args.ids)
+    if args.ids_file:
+        with open_input(args.ids_file) as stream:
+            game_ids.extend(int(token) for line in stream for token in line.replace(",", " ").split())
+    return game_ids
+
+
+def cmd_mark_paid(args):
+    handler = get_db_handler(args.db)
+    paid_status = not args.unpaid
+    filters = {"assignor": args.assignor, "league": args.league, "before": args.before, "season": args.season}
+    game_ids = read_game_ids(args)
+    if game_ids:
+        updated = handler.bulk_update_games_paid_status(game_ids, paid_status, raise_errors=True)
+    elif any(value is not None for value in filters.values()):
+        updated = handler.update_paid_status_where(paid_status, raise_errors=True, **filters)
+    else:
+        raise CommandError("Give game IDs or at least one of --assignor, --league, --before, --season.")
+    return {"command": "mark-paid", "paid": paid_status, "updated": updated}
+
+
+def iter_ledger(conn, season, unpaid_only=False):
+    """Stream a whole season of games in (date, id) order, one keyset page at a time."""
+    cursor = None
+    sql = functions.ledger_page_sql(", ".join(LEDGER_FIELDS), unpaid_only)
+    season_start, season_end = season_bounds(season)
+    while True:
+        cursor_date, cursor_id = cursor or (season_start, 0)
+        rows = conn.execute(sql, (cursor_date, season_end, cursor_date, cursor_id, LEDGER_BATCH_SIZE)).fetchall()
+        for row in rows:
+            yield dict(zip(LEDGER_FIELDS, row))
+        if len(rows) < LEDGER_BATCH_SIZE:
+            return
+        cursor = (rows[-1][1], rows[-1][0])
+
+
+def cmd_ledger(args):
+    # Read outside a transaction so the rows can stream straight to the output
+    conn = get_db_handler(args.db).create_connection()
+    return {"command": "ledger", "season": args.season, "rows": iter_ledger(conn, args.season, args.unpaid)}
+
+
+def cmd_summary(args):
+    handler = get_db_handler(args.db)
+    conn = handler.create_connection()
+    if args.season in partitions.archived_seasons(conn):
+        # A closed season's rollup rows live in its archive file
+        summary = [row[1:] for row in partitions.season_history(conn, [args.season])]
+    else:
+        with handler.connection():
+            summary = conn.execute(functions.SEASON_SUMMARY_SQL, (args.season,)).fetchall()
+    rows = [dict(zip(("league", "games", "owed", "paid", "mileage"), row)) for row in summary]
+    return {"command": "summary", "season": args.season, "rows": rows}
+
+
+def cmd_history(args):
+    conn = get_db_handler(args.db).create_connection()
+    history = partitions.season_history(conn, args.season)
+    rows = [dict(zip(("season", "league", "games", "owed", "paid", "mileage"), row)) for row in history]
+    return {"command": "history", "rows": rows}
+
+
+def cmd_archive(args):
+    handler = get_db_handler(args.db)
+    moved = handler.archive_season(args.season, args.path, args.vacuum, raise_errors=True)
+    path = partitions.archived_seasons(handler.create_connection())[args.season]
+    return {"command": "archive", "season": args.season, "moved": moved, "path": path}
+
+
+def cmd_sites(args):
+    with get_db_handler(args.db).connection() as conn:
+        site_rows = conn.execute("SELECT name, mileage FROM sites ORDER BY name").fetchall()
+    return {"command": "sites", "rows": [{"name": name, "mileage": mileage} for name, mileage in site_rows]}
+
+
+def cmd_sync(args):
+    added = get_db_handler(args.db).sync_lookup_tables(raise_errors=True)
+    return {"command": "sync", "added": added}
+
+
+def cmd_migrate(args):
+    handler = get_db_handler(args.db)
+    applied = handler.migrate(args.target, raise_errors=True)
+    return {"command": "migrate", "applied": applied, "version": handler.schema_version()}
+
+
+def cmd_report(args):
+    import analytics
+
+    with get_db_handler(args.db).connection() as conn:
+        frame = analytics.SeasonFrame.load(conn, args.season)
+    if args.kind == "lag":
+        rows = frame.payment_lag(args.by or ("assignor",), as_of=args.as_of)
+    else:
+        mileage_rate = get_mileage_rate() if args.rate is None else args.rate
+        rows = frame.totals(args.by or ("league",), mileage_rate=mileage_rate)
+    return {"command": "report", "kind": args.kind, "season": args.season, "games": len(frame), "rows": rows}
+
+
+def cmd_export(args):
+    import export
+
+    filters = {"season": args.season, "league": args.league, "assignor": args.assignor, "before": args.before}
+    if args.paid or args.unpaid:
+        filters["paid"] = args.paid
+    # Read outside a transaction; the pooled connection is shared with other commands
+    conn = get_db_handler(args.db).create_connection()
+    # "-" writes the export itself to the real stdout rather than the redirected messages
+    with contextlib.redirect_stdout(args.stdout) if args.path == "-" else contextlib.nullcontext():
+        written = export.export_table(
+            conn, args.table, args.path, args.export_format, True if args.gzip else None, **filters
+        )
+    if args.path == "-":
+        # The export itself went to stdout
+        print(f"{written} rows exported from {args.table}.", file=sys.stderr)
+        return None
+    return {"command": "export", "table": args.table, "path": args.path, "rows_written": written}
+
+
+def cmd_batch(args):
+    """Run every command line of a file (or stdin) in this process; returns the failure count."""
+    failures = 0
+    with open_input(args.file) as stream:
+        for line in stream:
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            if argv[0] == "batch":
+                raise CommandError("Batches cannot be nested.")
+            failures += run(argv, defaults=args) != 0
+    return failures
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python .", description="Officiating revenue and travel tracker.")
+    parser.add_argument("--db", default=DEFAULT_DB_FILE, help="SQLite database file")
+    parser.add_argument("--format", choices=FORMATS, default="text", help="output format")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add one game")
+    add.add_argument("--site", required=True)
+    add.add_argument("--league", required=True)
+    add.add_argument("--date", help="game date, YYYY-MM-DD (default today)")
+    add.add_argument("--paid", action="store_true")
+    add.add_argument("--volunteer", action="store_true")
+    add.add_argument("--origin", help="address driven from, if not default_from")
+    add.set_defaults(handler=cmd_add)
+
+    schedule = commands.add_parser("import", help="import a CSV or iCalendar schedule")
+    schedule.add_argument("path")
+    schedule.add_argument("--chunk-size", type=int, default=500)
+    schedule.set_defaults(handler=cmd_import)
+
+    mark_paid = commands.add_parser("mark-paid", help="mark games paid by ID or by filter")
+    mark_paid.add_argument("ids", nargs="*", type=int, help="game IDs")
+    mark_paid.add_argument("--ids-file", help="file of game IDs, '-' for stdin")
+    mark_paid.add_argument("--assignor")
+    mark_paid.add_argument("--league")
+    mark_paid.add_argument("--before", type=normalize_date, help="only games before this date")
+    mark_paid.add_argument("--season", type=int)
+    mark_paid.add_argument("--unpaid", action="store_true", help="mark as unpaid instead")
+    mark_paid.set_defaults(handler=cmd_mark_paid)
+
+    ledger = commands.add_parser("ledger", help="list a season's games")
+    ledger.add_argument("--season", type=int, default=functions.CURRENT_SEASON)
+    ledger.add_argument("--unpaid", action="store_true", help="only unpaid games")
+    ledger.set_defaults(handler=cmd_ledger)
+
+    summary = commands.add_parser("summary", help="season totals by league")
+    summary.add_argument("--season", type=int, default=functions.CURRENT_SEASON)
+    summary.set_defaults(handler=cmd_summary)
+
+    history = commands.add_parser("history", help="totals by season and league, including archived seasons")
+    history.add_argument("--season", type=int, nargs="+", help="only these seasons")
+    history.set_defaults(handler=cmd_history)
+
+    archive = commands.add_parser("archive", help="move a closed season to its own database file")
+    archive.add_argument("season", type=int)
+    archive.add_argument("--path", help="archive file (default: <db>_<season>.db next to the database)")
+    archive.add_argument("--vacuum", action="store_true", help="compact the main database afterwards")
+    archive.set_defaults(handler=cmd_archive)
+
+    commands.add_parser("sites", help="list sites and mileage").set_defaults(handler=cmd_sites)
+    sync = commands.add_parser("sync", help="add the sites, leagues and assignors in sites.py and leagues.py")
+    sync.set_defaults(handler=cmd_sync)
+
+    migrate = commands.add_parser("migrate", help="migrate the schema in place")
+    migrate.add_argument("--target", type=int, default=migrations.LATEST_VERSION)
+    migrate.set_defaults(handler=cmd_migrate)
+
+    report = commands.add_parser("report", help="revenue, mileage and payment lag by league, assignor, site or month")
+    report.add_argument("kind", choices=("totals", "lag"))
+    report.add_argument("--by", nargs="+", choices=REPORT_GROUP_KEYS, help="default: league, or assignor for lag")
+    report.add_argument("--season", type=int, default=functions.CURRENT_SEASON)
+    report.add_argument("--rate", type=float, help="mileage reimbursement per mile (default from config.ini)")
+    report.add_argument("--as-of", type=normalize_date, help="date outstanding games are aged to (default today)")
+    report.set_defaults(handler=cmd_report)
+
+    export = commands.add_parser("export", help="stream games or sites to CSV or NDJSON")
+    export.add_argument("table", choices=("games", "sites"))
+    export.add_argument("path", help="output file; .gz compresses, '-' writes to stdout")
+    export.add_argument("--as", dest="export_format", choices=("csv", "ndjson"), help="default: from the file name")
+    export.add_argument("--gzip", action="store_true", help="compress even without a .gz name")
+    export.add_argument("--season", type=int)
+    export.add_argument("--league")
+    export.add_argument("--assignor")
+    export.add_argument("--before", type=normalize_date)
+    paid_filter = export.add_mutually_exclusive_group()
+    paid_filter.add_argument("--paid", action="store_true", help="only paid games")
+    paid_filter.add_argument("--unpaid", action="store_true", help="only unpaid games")
+    export.set_defaults(handler=cmd_export)
+
+    batch = commands.add_parser("batch", help="run one command per line from a file ('-' for stdin)")
+    batch.add_argument("file")
+    batch.set_defaults(handler=cmd_batch)
+    return parser
+
+
+def run(argv, defaults=None):
+    """Parse and run one command line; returns a process exit status."""
+    parser = build_parser()
+    if defaults is not None:
+        # Commands in a batch inherit the batch's --db and --format unless they set their own
+        parser.set_defaults(db=defaults.db, format=defaults.format)
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        # None is a clean exit, as for --help
+        return 0 if e.code is None else e.code
+    out = args.stdout = sys.stdout
+    try:
+        if args.command == "batch":
+            return 1 if args.handler(args) else 0
+        # Messages printed by the shared logic go to stderr; stdout carries only results
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.command != "migrate":
+                # Upgrade an older database first; a current one costs one PRAGMA read
+                get_db_handler(args.db).initialize_database(raise_errors=True)
+            result = args.handler(args)
+        if result is not None:
+            emit(result, args.format, out)
+    except configparser.Error as e:
+        print(f"{args.command}: config.ini: {e.message}", file=sys.stderr)
+        return 1
+    except (CommandError, ValueError, OSError, sqlite3.Error) as e:
+        print(f"{args.command}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    return run(sys.argv[1:] if argv is None else argv)
@@ -0,0 +1,77 @@
+"""Busy handling for several processes sharing one database file.
+
+The menu, import scripts and report jobs may all open officiating.db at once. Connections
+use WAL journaling so readers and the writer never block each other, wait out a busy
+database for up to the busy timeout, and start every write with BEGIN IMMEDIATE. That
+takes the write lock before anything is read, so a transaction never has to upgrade from
+reading to writing, which is the case SQLite fails at once rather than waiting.
+begin_immediate() also retries a busy database with exponential backoff and full jitter,
+for the cases the busy timeout does not cover.
+"""
+
+from contextlib import contextmanager
+import random
+import sqlite3
+import time
+
+DEFAULT_JOURNAL_MODE = "wal"
+# Seconds a statement waits for another connection's lock before failing with SQLITE_BUSY
+DEFAULT_BUSY_TIMEOUT = 5.0
+
+BUSY_ERROR_NAMES = ("SQLITE_BUSY", "SQLITE_LOCKED")
+
+
+def is_busy(error):
+    """True for "database is locked" errors, which may succeed if retried."""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    name = getattr(error, "sqlite_errorname", None)
+    if name is not None:
+        return name.startswith(BUSY_ERROR_NAMES)
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def configure_connection(conn, journal_mode=DEFAULT_JOURNAL_MODE, busy_timeout=DEFAULT_BUSY_TIMEOUT):
+    """Set a new connection's busy timeout and journal mode; returns the journal mode in effect.
+
+    The journal mode is stored in the database file, so it only changes once; if another
+    process holds the database at that moment, the current mode is kept for now.
+    """
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+    try:
+        mode = conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if not is_busy(e):
+            raise
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if mode == "wal":
+        # Durable across application crashes; only a power loss can undo the last commits
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return mode
+
+
+def begin_immediate(conn, max_retries=5, base_delay=0.05, max_delay=2.0):
+    """Start a write transaction, retrying a busy database with backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == max_retries:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2**attempt)))
+
+
+@contextmanager
+def immediate_transaction(conn):
+    """Yield conn inside BEGIN IMMEDIATE, committing on success and rolling back on error.
+
+    For callers without a ConnectionManager; the application passes its writer() instead.
+    """
+    begin_immediate(conn)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
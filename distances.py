@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+
+METERS_PER_MILE = 1609.344
+
+# The Distance Matrix API accepts at most 25 destinations per request
+MAX_DESTINATIONS_PER_REQUEST = 25
+# Element statuses meaning there is no route, as opposed to a failed request
+NO_ROUTE_STATUSES = {"NOT_FOUND", "ZERO_RESULTS"}
+
+
+def element_to_miles(element):
+    """Convert a single Distance Matrix element to miles, or None if no route was found.
+
+    Uses the element's distance in meters; the display text depends on the unit system.
+    """
+    if element.get("status") != "OK":
+        return None
+    return round(element["distance"]["value"] / METERS_PER_MILE, 1)
+
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+# Statuses and exception types worth retrying; anything else fails the batch immediately
+TRANSIENT_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+TRANSIENT_EXCEPTIONS = {"Timeout", "TransportError", "_OverQueryLimit", "_RetriableRequest"}
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 10
+
+
+class TransientDistanceError(Exception):
+    """A Distance Matrix request failed in a way that may succeed if retried."""
+
+
+def is_transient(error):
+    return (
+        isinstance(error, (TransientDistanceError, TimeoutError, ConnectionError))
+        or type(error).__name__ in TRANSIENT_EXCEPTIONS
+        or getattr(error, "status", None) in TRANSIENT_STATUSES
+    )
+
+
+def request_errors():
+    """Exceptions a failed Distance Matrix request raises, as opposed to a bug in the caller."""
+    # Imported here so importing this module does not load googlemaps
+    from googlemaps import exceptions
+
+    return (
+        TransientDistanceError,
+        OSError,
+        exceptions.ApiError,
+        exceptions.HTTPError,
+        exceptions.Timeout,
+        exceptions.TransportError,
+        exceptions._RetriableRequest,
+    )
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second, bursting to `capacity`."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def resolve_distances_concurrently(
+    gmaps,
+    origin,
+    destinations,
+    mode="driving",
+    batch_size=MAX_DESTINATIONS_PER_REQUEST,
+    max_workers=DEFAULT_MAX_WORKERS,
+    requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+    max_retries=5,
+    base_delay=0.5,
+    max_delay=30.0,
+):
+    """Resolve {name: address} with concurrent, rate-limited, retried requests.
+
+    Batches of up to `batch_size` destinations are sent from a pool of `max_workers`
+    threads (which also bounds the requests in flight), paced by a token bucket of
+    `requests_per_second`. Transient failures such as OVER_QUERY_LIMIT or timeouts are
+    retried with exponential backoff and full jitter. Returns (distances, errors): miles
+    per resolved name, and an error message per name that could not be resolved.
+    """
+    batch_size = max(1, min(batch_size, MAX_DESTINATIONS_PER_REQUEST))
+    bucket = TokenBucket(requests_per_second)
+    distances, errors = {}, {}
+    failures = request_errors()
+
+    def fetch(names):
+        addresses = [destinations[name] for name in names]
+        for attempt in range(max_retries + 1):
+            bucket.acquire()
+            try:
+                distance_result = gmaps.distance_matrix(origin, addresses, mode=mode)
+                status = distance_result.get("status", "OK")
+                if status in TRANSIENT_STATUSES:
+                    raise TransientDistanceError(status)
+                if status != "OK":
+                    return {}, {name: status for name in names}
+                elements = distance_result["rows"][0]["elements"]
+                resolved, failed = {}, {}
+                for name, element in zip(names, elements):
+                    miles = element_to_miles(element)
+                    if miles is None:
+                        failed[name] = element.get("status", "NOT_FOUND")
+                    else:
+                        resolved[name] = miles
+                return resolved, failed
+            except failures as e:
+                if not is_transient(e) or attempt == max_retries:
+                    return {}, {name: f"{type(e).__name__}: {e}" for name in names}
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2**attempt)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for resolved, failed in executor.map(fetch, chunked(destinations, batch_size)):
+            distances.update(resolved)
+            errors.update(failed)
+    return distances, errors
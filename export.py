@@ -0,0 +1,152 @@
+"""Streaming export of the games and sites tables to CSV or NDJSON, optionally gzipped.
+
+Rows flow from the database cursor in fetchmany() batches straight into the writer, so
+memory stays flat however many games are exported; each batch is written with a single
+writerows()/write() call to keep per-row Python work to a minimum. For NDJSON, SQLite's
+json_object() builds each line, which halves the cost of converting rows in Python.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+
+from classes import normalize_date, season_bounds
+
+GAME_COLUMNS = ("id", "date", "site", "league", "assignor", "game_fee", "fee_paid", "is_volunteer", "mileage")
+SITE_COLUMNS = ("name", "mileage", "latitude", "longitude")
+TABLES = {"games": GAME_COLUMNS, "sites": SITE_COLUMNS}
+EXPORT_FORMATS = ("csv", "ndjson")
+
+FETCH_BATCH_SIZE = 5000
+# gzip's default level 9 is several times slower than 6 for a few percent smaller files
+GZIP_LEVEL = 6
+
+
+def games_query(season=None, league=None, assignor=None, paid=None, before=None, select=None):
+    """Return (sql, params) selecting the games matching every given filter, in (date, id) order.
+
+    `select` replaces the column list, e.g. with a json_object() expression.
+    """
+    clauses, params = [], []
+    if season is not None:
+        clauses.append("date >= ? AND date < ?")
+        params.extend(season_bounds(season))
+    if before is not None:
+        clauses.append("date < ?")
+        params.append(normalize_date(before))
+    if league is not None:
+        clauses.append("league_id = (SELECT id FROM leagues WHERE name = ?)")
+        params.append(league.upper())
+    if assignor is not None:
+        clauses.append("assignor_id = (SELECT id FROM assignors WHERE name = ?)")
+        params.append(assignor)
+    if paid is not None:
+        clauses.append("fee_paid = ?")
+        params.append(int(bool(paid)))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"SELECT {select or ', '.join(GAME_COLUMNS)} FROM game_details{where} ORDER BY date, id", params
+
+
+def sites_query(select=None):
+    return f"SELECT {select or ', '.join(SITE_COLUMNS)} FROM sites ORDER BY name", []
+
+
+def json_object_sql(columns):
+    return "json_object(" + ", ".join(f"'{column}', {column}" for column in columns) + ")"
+
+
+def iter_batches(cursor, batch_size=FETCH_BATCH_SIZE):
+    """Yield lists of rows from an executed cursor until it is exhausted."""
+    while batch := cursor.fetchmany(batch_size):
+        yield batch
+
+
+def write_csv(batches, columns, stream):
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    written = 0
+    for batch in batches:
+        writer.writerows(batch)
+        written += len(batch)
+    return written
+
+
+def write_ndjson(batches, columns, stream):
+    encode = json.JSONEncoder(separators=(",", ":"), default=str).encode
+    written = 0
+    for batch in batches:
+        stream.write("".join([encode(dict(zip(columns, row))) + "\n" for row in batch]))
+        written += len(batch)
+    return written
+
+
+def write_json_lines(batches, columns, stream):
+    """Write rows that are already one JSON object each, as selected with json_object()."""
+    written = 0
+    for batch in batches:
+        stream.write("\n".join([row[0] for row in batch]) + "\n")
+        written += len(batch)
+    return written
+
+
+def export_format_for(path, default="csv"):
+    """Infer the export format from a file name such as games.ndjson.gz."""
+    name = os.fspath(path).lower().removesuffix(".gz")
+    for export_format in EXPORT_FORMATS:
+        if name.endswith("." + export_format):
+            return export_format
+    return default
+
+
+def open_output(path, compress=None):
+    """Open a text stream for writing; "-" is stdout, and .gz paths (or compress=True) are gzipped."""
+    compress = os.fspath(path).endswith(".gz") if compress is None else compress
+    if path == "-":
+        sys.stdout.flush()
+        raw = sys.stdout.buffer
+        if compress:
+            raw = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+        return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=GZIP_LEVEL)
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def select_rows(conn, table, select=None, **filters):
+    if table == "games":
+        return conn.execute(*games_query(select=select, **filters))
+    return conn.execute(*sites_query(select))
+
+
+def export_table(conn, table, path, export_format=None, compress=None, **filters):
+    """Stream `table` ("games" or "sites") to `path`; filters apply to games. Returns rows written."""
+    columns = TABLES[table]
+    export_format = export_format or export_format_for(path)
+    writer = write_csv
+    if export_format == "ndjson":
+        try:
+            cursor = select_rows(conn, table, json_object_sql(columns), **filters)
+            writer = write_json_lines
+        except sqlite3.OperationalError:
+            # SQLite built without JSON support; build the objects in Python instead
+            cursor = select_rows(conn, table, **filters)
+            writer = write_ndjson
+    else:
+        cursor = select_rows(conn, table, **filters)
+    stream = open_output(path, compress)
+    try:
+        return writer(iter_batches(cursor), columns, stream)
+    finally:
+        if path == "-":
+            # Finish any gzip stream but leave stdout itself open
+            raw = stream.detach()
+            if isinstance(raw, gzip.GzipFile):
+                raw.close()
+            sys.stdout.buffer.flush()
+        else:
+            stream.close()
+        cursor.close()
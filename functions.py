@@ -1,356 +1,605 @@
 from datetime import datetime
 import sqlite3
 from sqlite3 import Error
-from prettytable import PrettyTable
 import sys
 
-import googlemaps
-
-from classes import DatabaseHandler
+from classes import (
+    ConnectionManager,
+    get_db_handler,
+    get_gmaps_client,
+    get_mileage_rate,
+    lookup_ids,
+    normalize_date,
+    season_bounds,
+)
+import importer
+from metrics import metrics
 import sites
 import leagues
 
+# prettytable and googlemaps are imported only by the functions that need them, so importing
+# this module stays cheap for scripts that never render a report or request a distance.
 db_file = "officiating.db"
-db_handler = DatabaseHandler(db_file)
-CURRENT_YEAR = str(datetime.now().year)[-2:]
+CURRENT_SEASON = datetime.now().year
+
+# Reads the trigger-maintained rollup, so the summary costs O(leagues) rather than a scan;
+# rows are grouped on the integer league_id and the view supplies the league's name
+SEASON_SUMMARY_SQL = """
+    SELECT league,
+        SUM(games) as total_games,
+        SUM(owed) as total_owed,
+        SUM(paid) as total_paid,
+        ROUND(SUM(mileage),1) as total_mileage
+    FROM season_summary_details
+    WHERE season = ?
+    GROUP BY league_id
+    ORDER BY league
+"""
+
+
+def ledger_page_sql(columns, unpaid_only=False, backwards=False):
+    """Keyset-paginated SELECT over one season of games, ordered by (date, id).
+
+    Forward pages take (cursor_date, season_end, cursor_date, cursor_id, limit) and backward
+    pages take (season_start, cursor_date, cursor_date, cursor_id, limit). Bounding `date` by
+    the cursor itself lets the index seek straight to the page, so page N costs the same as
+    page 1 however large the ledger is.
+    """
+    unpaid_filter = "fee_paid = 0 AND " if unpaid_only else ""
+    if backwards:
+        where = "date >= ? AND date <= ? AND (date, id) < (?, ?)"
+        order = "date DESC, id DESC"
+    else:
+        where = "date >= ? AND date < ? AND (date, id) > (?, ?)"
+        order = "date, id"
+    return f"SELECT {columns} FROM game_details WHERE {unpaid_filter}{where} ORDER BY {order} LIMIT ?"
+
+
+LEDGER_COLUMNS = """id, date, league,
+    CASE WHEN fee_paid = 1 then 'Y' else '' end,
+    CASE WHEN mileage = 0 then '' else mileage end"""
+UNPAID_COLUMNS = "id, date, site, game_fee"
+
+LEDGER_PAGE_SQL = ledger_page_sql(LEDGER_COLUMNS)
+UNPAID_PAGE_SQL = ledger_page_sql(UNPAID_COLUMNS, unpaid_only=True)
+LEDGER_PAGE_SIZE = 25
 
 
 def create_connection(db_file):
-    """Create a database connection to a SQLite database"""
+    """Return the pooled database connection to a SQLite database for this thread"""
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
-        # print(f"SQLite DB connected: version {sqlite3.version}")
+        conn = ConnectionManager.for_file(db_file).get()
         return conn
     except Error as e:
         print(e)
     return conn
 
 
+def connection(db_file):
+    """Context manager yielding the pooled connection, committing or rolling back on exit"""
+    return ConnectionManager.for_file(db_file).connection()
+
+
+def writer(db_file):
+    """Like connection(), but inside a write transaction taken up front; use it for every write"""
+    return ConnectionManager.for_file(db_file).writer()
+
+
+def submit_write(db_file, operation, *args):
+    """Run operation(conn, *args) as a write, queued when write-behind is on; returns a Future"""
+    return ConnectionManager.for_file(db_file).submit(operation, *args)
+
+
+def report_write(future, message, error="An error occurred"):
+    """Print message(result) for a committed write, or say it is queued under write-behind.
+
+    A queued write that fails later is reported once the write-behind thread reaches it.
+    """
+    if not future.done():
+        print("Queued; it will be saved with the next group commit.")
+        future.add_done_callback(lambda done: done.exception() and print(f"{error}: {done.exception()}"))
+        return
+    try:
+        print(message(future.result()))
+    except sqlite3.Error as e:
+        print(f"{error}: {e}")
+
+
 def exit_application():
     print("Exiting the application.")
+    # Commits whatever write-behind still has queued before the connections close
+    ConnectionManager.close_all()
     sys.exit()
 
 
 def add_game_to_db(db_file, game):
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
-            if not game.site or game.site not in sites.ballfields:
-                raise ValueError(f"{game.site} not recognized.")
-            if not game.league or game.league not in leagues.game_rates:
-                raise ValueError(f"{game.league} not recognized")
-            # if not game.site or not game.league:
-            #     raise ValueError("Site and League required.")
-
-            sql = """ INSERT INTO games(date, site, league, assignor, game_fee, fee_paid, is_volunteer, mileage)
-                      VALUES(?,?,UPPER(?),?,?,?,?,?) """
-            cur = conn.cursor()
-            cur.execute(
-                sql,
-                (
-                    game.date,
-                    game.site,
-                    game.league,
-                    game.assignor,
-                    game.game_fee,
-                    game.fee_paid,
-                    game.is_volunteer,
-                    game.mileage,
-                ),
-            )
-            conn.commit()
-            print("Game added successfully")
-        except sqlite3.Error as e:
-            print(e)
-        except ValueError as ve:
-            print(ve)
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+    try:
+        if not game.site or game.site not in sites.ballfields:
+            raise ValueError(f"{game.site} not recognized.")
+        if not game.league or game.league not in leagues.game_rates:
+            raise ValueError(f"{game.league} not recognized")
+        # if not game.site or not game.league:
+        #     raise ValueError("Site and League required.")
+
+        report_write(submit_write(db_file, game.insert), lambda game_id: "Game added successfully")
+    except ValueError as ve:
+        print(ve)
+
+
+def import_schedule_file(db_file):
+    """Import games from a CSV or iCalendar schedule export."""
+    path = input("Enter the path of the schedule file: ").strip()
+    try:
+        report = importer.import_schedule(db_file, path)
+        print(f"{report.inserted} games imported.")
+        for line_number, message in report.errors:
+            print(f"Line {line_number}: {message}")
+    except OSError as e:
+        print(f"Could not read {path}: {e}")
+    except sqlite3.Error as e:
+        print(f"An error occurred while importing the schedule: {e}")
 
 
 def delete_game(db_file):
     """Delete a game by its ID."""
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
-            game_id = input("Enter Game ID to remove: ")
-            cursor = conn.cursor()
-            # SQL statement to delete a game by ID
-            cursor.execute("DELETE FROM games WHERE id = ?", (game_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                print(f"Game ID {game_id} deleted successfully.")
-            else:
-                print(f"No game found with ID {game_id}.")
-        except sqlite3.Error as e:
-            print(f"An error occurred while trying to delete the game: {e}")
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+    game_id = input("Enter Game ID to remove: ")
+    report_write(
+        submit_write(db_file, delete_game_by_id, game_id),
+        lambda deleted: f"Game ID {game_id} deleted successfully." if deleted else f"No game found with ID {game_id}.",
+        "An error occurred while trying to delete the game",
+    )
+
+
+def delete_game_by_id(conn, game_id):
+    """Delete one game; returns the number of rows deleted."""
+    return conn.execute("DELETE FROM games WHERE id = ?", (game_id,)).rowcount
 
 
 def display_season_summary(db_file):
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
+    try:
+        with connection(db_file) as conn:
             cur = conn.cursor()
-            sql = f"""
-                SELECT league,
-                    COUNT(1) as total_games,
-                    SUM(CASE WHEN fee_paid = 0 then game_fee else 0 end) as total_owed,
-                    SUM(CASE WHEN fee_paid = 1 then game_fee else 0 end) as total_paid,
-                    ROUND(SUM(mileage),1) as total_mileage
-                FROM games
-                WHERE substr(date, 1, 2) = '{CURRENT_YEAR}'
-                GROUP BY league
-            """
-            cur.execute(sql)
+            cur.execute(SEASON_SUMMARY_SQL, (CURRENT_SEASON,))
             summary = cur.fetchall()
 
-            if summary:
-                table = PrettyTable()
-                table.title = "Season Summary"
-                table.field_names = [
-                    "League",
-                    "Games",
-                    "Owed",
-                    "Paid",
-                    "Mileage",
-                ]
+        if summary:
+            from prettytable import PrettyTable
+
+            table = PrettyTable()
+            table.title = "Season Summary"
+            table.field_names = [
+                "League",
+                "Games",
+                "Owed",
+                "Paid",
+                "Mileage",
+            ]
 
-                for row in summary:
-                    table.add_row(row)
+            for row in summary:
+                table.add_row(row)
 
-                print(table)
-            else:
-                print("No data found.")
+            print(table)
+        else:
+            print("No data found.")
 
-        except sqlite3.Error as e:
-            print(f"An error occurred: {e}")
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
 
 
-def review_all_games(db_file):
-    """Function to review unpaid games, with specific fields"""
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
-            cur = conn.cursor()
-            sql = f""" 
-                SELECT id, date, league,
-                    CASE WHEN fee_paid = 1 then 'Y' else '' end,
-                    CASE WHEN mileage = 0 then '' else mileage end
-                FROM games
-                WHERE substr(date, 1, 2) = '{CURRENT_YEAR}'
-            """
-            cur.execute(sql)
-            all_games = cur.fetchall()
-
-            if all_games:
-                table = PrettyTable()
-                table.title = "Master Ledger"
-                table.field_names = [
-                    "ID",
-                    "Date",
-                    "League",
-                    "Paid",
-                    "Miles",
-                ]
+def display_season_history(db_file):
+    """Show totals by season and league across the database and every archived season."""
+    import partitions
 
-                for game in all_games:
-                    table.add_row(game)
+    try:
+        history = partitions.season_history(create_connection(db_file))
+    except (sqlite3.Error, ValueError, OSError) as e:
+        print(f"An error occurred: {e}")
+        return
 
-                print(table)
-            else:
-                print("No unpaid games found.")
+    if history:
+        from prettytable import PrettyTable
 
-        except sqlite3.Error as e:
-            print(f"An error occurred: {e}")
-        finally:
-            conn.close()
+        table = PrettyTable()
+        table.title = "Season History"
+        table.field_names = ["Season", "League", "Games", "Owed", "Paid", "Mileage"]
+        for row in history:
+            table.add_row(row)
+        print(table)
     else:
-        print("Error! Cannot create database connection.")
+        print("No data found.")
 
 
-def review_unpaid_games(db_file):
-    """Function to review unpaid games, with specific fields"""
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
-            cur = conn.cursor()
-            sql = f""" 
-                SELECT id, date, site, game_fee
-                FROM games
-                WHERE fee_paid = 0
-                AND substr(date, 1, 2) = '{CURRENT_YEAR}'
-            """
-            cur.execute(sql)
-            unpaid_games = cur.fetchall()
-
-            if unpaid_games:
-                table = PrettyTable()
-                table.title = "Unpaid Games"
-                table.field_names = [
-                    "ID",
-                    "Date",
-                    "Site",
-                    "Fee",
-                ]
+def archive_season(db_handler):
+    """Prompt for a closed season and move its games to their own database file."""
+    season = input("Season to archive: ").strip()
+    if not season.isdigit():
+        print("Enter a season such as 2024.")
+        return
+    vacuum = input("Compact the database afterwards? ").lower() in ["yes", "y"]
+    db_handler.archive_season(int(season), vacuum=vacuum)
+
 
-                for game in unpaid_games:
-                    table.add_row(game)
+def display_trip_plans(db_file, season=CURRENT_SEASON):
+    """Show tour mileage for each multi-site game day against separate round trips."""
+    import trips
+
+    try:
+        plans = trips.plan_season(get_db_handler(db_file), season)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return
+
+    multi_site_days = [plan for plan in plans if len(plan.sites) > 1]
+    if not multi_site_days:
+        print("No multi-site game days found.")
+        return
+
+    from prettytable import PrettyTable
+
+    table = PrettyTable()
+    table.title = "Same-Day Trips"
+    table.field_names = ["Date", "Route", "Games", "Separate", "Tour", "Saved"]
+    for plan in multi_site_days:
+        saved = plan.savings
+        table.add_row(
+            [
+                plan.date,
+                " -> ".join(plan.sites),
+                plan.games,
+                plan.separate_miles if plan.separate_miles is not None else "n/a",
+                plan.tour_miles if plan.tour_miles is not None else "n/a",
+                round(saved, 1) if saved is not None else "n/a",
+            ]
+        )
+    print(table)
+    total_saved = sum(plan.savings for plan in multi_site_days if plan.savings is not None)
+    print(f"Chaining same-day sites saves {total_saved:.1f} miles this season.")
 
-                print(table)
-            else:
-                print("No unpaid games found.")
 
+def display_season_analytics(db_file, season=CURRENT_SEASON):
+    """Show revenue and mileage by league and month, and payment lag by assignor."""
+    import analytics
+    from prettytable import PrettyTable
+
+    try:
+        with connection(db_file) as conn:
+            frame = analytics.SeasonFrame.load(conn, season)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return
+    if not len(frame):
+        print("No data found.")
+        return
+
+    mileage_rate = get_mileage_rate()
+    for title, by in (("Revenue by League", "league"), ("Revenue by Month", "month")):
+        table = PrettyTable()
+        table.title = title
+        table.field_names = [by.title(), "Games", "Fees", "Owed", "Mileage", "Reimbursement", "$/Mile"]
+        for row in frame.totals(by, mileage_rate):
+            table.add_row(
+                [
+                    row[by],
+                    row["games"],
+                    row["fees"],
+                    row["owed"],
+                    row["mileage"],
+                    row["reimbursement"],
+                    row["revenue_per_mile"] if row["revenue_per_mile"] is not None else "n/a",
+                ]
+            )
+        print(table)
+
+    table = PrettyTable()
+    table.title = "Payment Lag by Assignor (days)"
+    table.field_names = ["Assignor", "Paid", "Mean", "Median", "Max", "Outstanding", "Owed", "Oldest"]
+    for row in frame.payment_lag("assignor"):
+        table.add_row(
+            [
+                row["assignor"],
+                row["paid_games"],
+                row["mean_lag_days"] if row["mean_lag_days"] is not None else "n/a",
+                row["median_lag_days"] if row["median_lag_days"] is not None else "n/a",
+                row["max_lag_days"] if row["max_lag_days"] is not None else "n/a",
+                row["outstanding"],
+                row["outstanding_fees"],
+                row["oldest_unpaid_days"] if row["oldest_unpaid_days"] is not None else "n/a",
+            ]
+        )
+    print(table)
+    print(f"Reimbursement at ${mileage_rate:.2f} per mile.")
+
+
+def iter_ledger_page(conn, season, cursor=None, backwards=False, page_size=LEDGER_PAGE_SIZE, unpaid_only=False):
+    """Stream one page of a season's games straight from the database cursor.
+
+    `cursor` is the (date, id) of the row to page from: rows after it, or before it when
+    `backwards`. Without a cursor the first page of the season is returned.
+    """
+    season_start, season_end = season_bounds(season)
+    columns = UNPAID_COLUMNS if unpaid_only else LEDGER_COLUMNS
+    sql = ledger_page_sql(columns, unpaid_only, backwards)
+    if backwards:
+        cursor_date, cursor_id = cursor or (season_end, 0)
+        params = (season_start, cursor_date, cursor_date, cursor_id, page_size)
+    else:
+        cursor_date, cursor_id = cursor or (season_start, 0)
+        params = (cursor_date, season_end, cursor_date, cursor_id, page_size)
+    rows = conn.execute(sql, params)
+    # Backward pages arrive newest first; a page is small enough to reverse in memory
+    return reversed(rows.fetchall()) if backwards else rows
+
+
+def render_fixed_width(field_names, widths, rows):
+    """Yield a header and then one fixed-width line per row as the rows arrive."""
+    yield " ".join(name.ljust(width) for name, width in zip(field_names, widths))
+    yield " ".join("-" * width for width in widths)
+    for row in rows:
+        yield " ".join(str(value).ljust(width)[:width] for value, width in zip(row, widths))
+
+
+def print_ledger_page(title, field_names, widths, rows, formatter="text"):
+    """Print a page of rows and return (first row, last row, row count)."""
+    first = last = None
+    count = 0
+
+    def tracked(rows):
+        nonlocal first, last, count
+        for row in rows:
+            first = first or row
+            last = row
+            count += 1
+            yield row
+
+    if formatter == "table":
+        from prettytable import PrettyTable
+
+        table = PrettyTable()
+        table.title = title
+        table.field_names = field_names
+        for row in tracked(rows):
+            table.add_row(row)
+        if count:
+            print(table)
+    else:
+        lines = render_fixed_width(field_names, widths, tracked(rows))
+        header = [next(lines), next(lines)]
+        for line in lines:
+            if header:
+                print(f" {title} ".center(len(header[0]), "*"))
+                print("\n".join(header))
+                header = None
+            print(line)
+    return first, last, count
+
+
+def page_through_games(db_file, title, field_names, widths, unpaid_only=False, formatter="text"):
+    """Interactively page through the current season with keyset pagination.
+
+    The page can be switched between the fixed-width renderer and a PrettyTable in place.
+    """
+    cursor, backwards = None, False
+    first = last = None
+    while True:
+        try:
+            with connection(db_file) as conn:
+                rows = iter_ledger_page(conn, CURRENT_SEASON, cursor, backwards, unpaid_only=unpaid_only)
+                page_first, page_last, count = print_ledger_page(title, field_names, widths, rows, formatter)
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+            return
+
+        if count:
+            first, last = page_first, page_last
+        elif cursor is None:
+            print("No games found.")
+            return
+        else:
+            print("No more games.")
+        view = "[T]able view" if formatter == "text" else "[T]ext view"
+        choice = input(f"[N]ext page, [P]revious page, [D]ate jump, {view}, E[x]it: ").lower()
+        # Rows start with (id, date); the keyset cursor is (date, id)
+        if choice == "n" and last:
+            cursor, backwards = (last[1], last[0]), False
+        elif choice == "p" and first:
+            cursor, backwards = (first[1], first[0]), True
+        elif choice == "d":
+            try:
+                cursor, backwards = (normalize_date(input("Start from date: ")), 0), False
+            except ValueError as ve:
+                print(ve)
+        elif choice == "t":
+            # The cursor is unchanged, so the same page is shown again in the other view
+            formatter = "table" if formatter == "text" else "text"
+        elif choice == "x":
+            return
+
+
+def review_all_games(db_file, formatter="text"):
+    """Page through the current season's games, with specific fields"""
+    page_through_games(
+        db_file, "Master Ledger", ["ID", "Date", "League", "Paid", "Miles"], [7, 10, 10, 4, 7], formatter=formatter
+    )
+
+
+def review_unpaid_games(db_file, formatter="text"):
+    """Page through the current season's unpaid games, with specific fields"""
+    page_through_games(
+        db_file, "Unpaid Games", ["ID", "Date", "Site", "Fee"], [7, 10, 30, 6], unpaid_only=True, formatter=formatter
+    )
 
 
 def update_game_by_id(db_file):
-    conn = create_connection(db_file)
-    if conn is not None:
+    game_id = input("Enter the ID of the game to update: ")
+    print("Which field would you like to update?")
+    print("[D]ate")
+    print("[S]ite")
+    print("[L]eague")
+    print("[A]ssignor")
+    print("[G]ame Fee")
+    print("[F]ee Paid")
+    print("[V]olunteer")
+    print("[M]ileage")
+    field = input("Enter the number of the field: ").lower()
+
+    # Define a dictionary to map user input to database columns
+    fields_map = {
+        "d": "date",
+        "s": "site",
+        "l": "league",
+        "a": "assignor",
+        "g": "game_fee",
+        "f": "fee_paid",
+        "v": "is_volunteer",
+        "m": "mileage",
+    }
+
+    if field not in fields_map:
+        print("Invalid field selection.")
+        return
+
+    new_value = input(f"Enter the new value for {fields_map[field]}: ")
+    if field == "d":  # stored as YYYY-MM-DD
         try:
-            game_id = input("Enter the ID of the game to update: ")
-            print("Which field would you like to update?")
-            print("[D]ate")
-            print("[S]ite")
-            print("[L]eague")
-            print("[A]ssignor")
-            print("[G]ame Fee")
-            print("[F]ee Paid")
-            print("[V]olunteer")
-            print("[M]ileage")
-            field = input("Enter the number of the field: ").lower()
-
-            # Define a dictionary to map user input to database columns
-            fields_map = {
-                "d": "date",
-                "s": "site",
-                "l": "league",
-                "a": "assignor",
-                "g": "game_fee",
-                "f": "fee_paid",
-                "v": "is_volunteer",
-                "m": "mileage",
-            }
-
-            if field in fields_map:
-                new_value = input(f"Enter the new value for {fields_map[field]}: ")
-                if field in ["g", "m"]:  # numeric: game_fee, mileage
-                    new_value = float(new_value)
-                if field in ["f", "v"]:  # boolean: fee_paid, is_volunteer
-                    new_value = new_value.lower() in ["yes", "y", "true", "1"]
-
-                # Prepare the SQL query
-                sql = f"UPDATE games SET {fields_map[field]} = ? WHERE id = ?"
-                cur = conn.cursor()
-                cur.execute(sql, (new_value, game_id))
-                conn.commit()
-                print(f"Game with ID {game_id} has been updated.")
-            else:
-                print("Invalid field selection.")
+            new_value = normalize_date(new_value)
+        except ValueError as ve:
+            print(ve)
+            return
+    if field in ["g", "m"]:  # numeric: game_fee, mileage
+        new_value = float(new_value)
+    if field in ["f", "v"]:  # boolean: fee_paid, is_volunteer
+        new_value = new_value.lower() in ["yes", "y", "true", "1"]
+    if field == "l":  # league names are stored in upper case
+        new_value = new_value.upper()
+    # Sites, leagues and assignors are stored as ids into their lookup tables
+    lookup_tables = {"s": "sites", "l": "leagues", "a": "assignors"}
 
-        except sqlite3.Error as e:
-            print(f"An error occurred: {e}")
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+    column = f"{fields_map[field]}_id" if field in lookup_tables else fields_map[field]
+    sql = f"UPDATE games SET {column} = ? WHERE id = ?"
+
+    def update(conn):
+        value = new_value
+        if field in lookup_tables:
+            value = lookup_ids(conn, lookup_tables[field], [new_value]).get(new_value)
+        return conn.execute(sql, (value, game_id)).rowcount
+
+    report_write(submit_write(db_file, update), lambda updated: f"Game with ID {game_id} has been updated.")
 
 
 def bulk_update_games_paid_status(db_handler):
-    unpaid_game_ids = db_handler.fetch_unpaid_game_ids()
+    unpaid_game_ids = set(db_handler.fetch_unpaid_game_ids())
     if not unpaid_game_ids:
         print("There are no unpaid games to update.")
         return
 
-    print("Game IDs: ", unpaid_game_ids)
-    user_input = input("Enter game IDs to mark as paid (comma-separated): ")
+    print(f"{len(unpaid_game_ids)} unpaid games.")
+    user_input = input("Enter game IDs to mark as paid (comma-separated), or [A]ll matching a filter: ")
+    if user_input.strip().lower() == "a":
+        return bulk_update_games_paid_status_where(db_handler)
 
     # Split the input and convert to integers
     try:
-        game_ids = [int(id.strip()) for id in user_input.split(",")]
+        game_ids = {int(id.strip()) for id in user_input.split(",")}
     except ValueError:
         print("Invalid input. Please enter valid game IDs.")
         return
 
     # Validate that all entered IDs are unpaid game IDs
-    if not all(game_id in unpaid_game_ids for game_id in game_ids):
-        print("Invalid game IDs. Enter only unpaid game IDs.")
+    invalid_ids = game_ids - unpaid_game_ids
+    if invalid_ids:
+        print(f"Invalid game IDs {sorted(invalid_ids)}. Enter only unpaid game IDs.")
         return
 
     # Confirm update
     confirmation = input("Confirm mark as paid? ").lower()
     if confirmation in ["yes", "y", 1]:
-        db_handler.bulk_update_games_paid_status(game_ids, True)
-        print(f"Games {game_ids} marked as paid.")
+        future = db_handler.bulk_update_games_paid_status(game_ids, True, wait=False)
+        report_write(future, lambda updated: f"{updated} games marked as paid.")
+    else:
+        print("Operation canceled.")
+
+
+def bulk_update_games_paid_status_where(db_handler):
+    """Mark every unpaid game matching an assignor, league and/or cut-off date as paid."""
+    assignor = input("Assignor (blank for any): ").strip() or None
+    league = input("League (blank for any): ").strip() or None
+    before = input("Games before date YYYY-MM-DD (blank for any): ").strip() or None
+    try:
+        before = normalize_date(before) if before else None
+    except ValueError as ve:
+        print(ve)
+        return
+
+    confirmation = input("Confirm mark all matching games as paid? ").lower()
+    if confirmation in ["yes", "y"]:
+        db_handler.update_paid_status_where(True, assignor=assignor, league=league, before=before)
     else:
         print("Operation canceled.")
 
 
 def get_all_sites_and_mileage(db_file):
     """Retrieve all sites and their mileage from the database."""
-    conn = create_connection(db_file)
-    if conn is not None:
-        try:
+    try:
+        with connection(db_file) as conn:
             cur = conn.cursor()
             sql = "SELECT name, mileage FROM sites"
             cur.execute(sql)
             sites_mileage = cur.fetchall()
 
-            if sites_mileage:
-                table = PrettyTable()
-                table.title = "Sites and Mileage"
-                table.field_names = ["Site", "Mileage"]
+        if sites_mileage:
+            from prettytable import PrettyTable
 
-                for site, mileage in sites_mileage:
-                    table.add_row([site, mileage])
+            table = PrettyTable()
+            table.title = "Sites and Mileage"
+            table.field_names = ["Site", "Mileage"]
 
-                print(table)
-            else:
-                print("No sites found.")
+            for site, mileage in sites_mileage:
+                table.add_row([site, mileage])
 
-        except sqlite3.Error as e:
-            print(f"An error occurred: {e}")
-        finally:
-            conn.close()
-    else:
-        print("Error! cannot create the database connection.")
+            print(table)
+        else:
+            print("No sites found.")
+
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
 
 
 def database_operations_submenu():
+    db_handler = get_db_handler(db_file)
     db_operations = {
         "x": return_to_main_menu,
         "d": db_handler.drop_tables,
         "c": db_handler.create_games_table,
         "m": db_handler.create_relation_tables,
         "re": db_handler.rebuild_database,
+        "mi": db_handler.migrate,
+        "v": lambda: verify_season_summary(db_handler),
+        "g": db_handler.geocode_sites,
+        "s": display_metrics,
+        "a": lambda: archive_season(db_handler),
     }
+    # Operations that only read, so they run without the "Are you sure??" prompt
+    read_only_operations = {"s"}
 
     while True:
         print(" Database Operations ".center(45, "*"))
         print("E[x]it to Main Menu")
         print("[D]rop tables")
         print("[C]reate games table")
-        print("[M]ake relational tables")
+        print("[M]ake and sync site, league and assignor tables")
+        print("[MI]grate schema in place")
+        print("[V]erify season summary rollup")
+        print("[G]eocode sites for offline mileage estimates")
+        print("[S]tats for queries, connections and API calls")
+        print("[A]rchive a closed season to its own file")
         print("[RE]initialize database\n")
         choice = input("Enter your choice: ").lower()
 
         if choice == "x":
             break
+        elif choice in read_only_operations:
+            db_operations[choice]()
         elif choice in db_operations:
             confirmation = input("Are you sure?? ").lower()
             if confirmation in ["yes", "y"]:
@@ -359,6 +608,75 @@ def database_operations_submenu():
             print("Invalid choice. Please try again.")
 
 
+def verify_season_summary(db_handler):
+    """Check the season summary rollup against the games table, offering to rebuild it."""
+    mismatches = db_handler.verify_season_summary()
+    if not mismatches:
+        print("Season summary rollup matches the games table.")
+        return
+
+    for (season, league, assignor), expected, actual in mismatches:
+        print(f"{season} {league} {assignor}: expected {expected}, found {actual}")
+    confirmation = input("Rebuild the season summary rollup? ").lower()
+    if confirmation in ["yes", "y"]:
+        db_handler.rebuild_season_summary()
+
+
+def display_metrics():
+    """Show recorded SQL, connection and Distance Matrix metrics, optionally exporting them as JSON."""
+    snapshot = metrics.snapshot()
+    if not snapshot["enabled"]:
+        print("Metrics are disabled.")
+    print(f"Sample rate: {snapshot['sample_rate']:.0%}")
+
+    connections = snapshot["connections"]
+    print(f"Connections opened: {connections['opened']} ({connections['open_seconds'] * 1000:.1f} ms)")
+    api_calls = snapshot["api_calls"]
+    print(
+        f"Distance Matrix calls: {api_calls['count']}, elements: {api_calls['elements']}, "
+        f"total {api_calls['total_seconds'] * 1000:.1f} ms, max {api_calls['max_seconds'] * 1000:.1f} ms, "
+        f"statuses: {api_calls['statuses']}"
+    )
+    cache = snapshot["distance_cache"]
+    lookups = cache["hits"] + cache["misses"]
+    print(
+        f"Distance cache: {cache['hits']} hits, {cache['misses']} misses "
+        f"({cache['hits'] / lookups if lookups else 0:.0%} hit rate), "
+        f"{cache['expired']} expired, {cache['evicted']} evicted"
+    )
+
+    queries = sorted(snapshot["queries"].items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+    if queries:
+        from prettytable import PrettyTable
+
+        table = PrettyTable()
+        table.title = "SQL Statements"
+        table.field_names = ["Statement", "Count", "Total ms", "Max ms", "Rows"]
+        table.align["Statement"] = "l"
+        for sql, stats in queries[:20]:
+            table.add_row(
+                [
+                    sql[:60],
+                    stats["count"],
+                    round(stats["total_seconds"] * 1000, 2),
+                    round(stats["max_seconds"] * 1000, 2),
+                    stats["rows"],
+                ]
+            )
+        print(table)
+    else:
+        print("No SQL statements recorded.")
+
+    path = input("Export to JSON file (blank to skip): ").strip()
+    if path:
+        try:
+            with open(path, "w") as f:
+                f.write(metrics.to_json(indent=2))
+            print(f"Metrics written to {path}.")
+        except OSError as e:
+            print(f"Could not write {path}: {e}")
+
+
 def return_to_main_menu():
     # breaks database_operations_submenu loop to return to main
     pass
@@ -366,89 +684,43 @@ def return_to_main_menu():
 
 # Gets distances using Google Maps API for a dictionary of addresses
 def calculate_distances(api_key, default_from, destination_addresses):
-    gmaps = googlemaps.Client(key=api_key)
-    distances = {}
-
-    # Iterate over the destination addresses dictionary
-    for name, address in destination_addresses.items():
-        # Get the distance matrix result
-        distance_result = gmaps.distance_matrix(default_from, address, mode="driving")
-
-        if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-            distance_text = distance_result["rows"][0]["elements"][0]["distance"][
-                "text"
-            ]
-            # Convert from km to miles
-            if "km" in distance_text:
-                distance_km = float(distance_text.split()[0].replace(",", ""))
-                distance_miles = round(distance_km * 0.621371, 1)
-                distances[name] = f"{distance_miles} miles"
-            else:
-                distances[name] = distance_text
-        else:
-            distances[name] = "Distance not found"
-
-    return distances
+    gmaps = get_gmaps_client(api_key)
+    distance_cache = get_db_handler(db_file).distance_cache
+    distances, _errors = distance_cache.resolve(gmaps, default_from, destination_addresses)
+    return {
+        name: f"{distances[name]} miles" if name in distances else "Distance not found"
+        for name in destination_addresses
+    }
 
 
 def update_zero_mileage_entries(api_key, default_from, db_handler):
-    gmaps = googlemaps.Client(key=api_key)
     zero_mileage_sites = db_handler.fetch_sites_with_zero_mileage()
 
     if not zero_mileage_sites:
         print("No sites with zero mileage found.")
         return
 
-    for site_name, address in zero_mileage_sites.items():
-        distance_result = gmaps.distance_matrix(default_from, address, mode="driving")
-        if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-            distance_text = distance_result["rows"][0]["elements"][0]["distance"][
-                "text"
-            ]
-            if "km" in distance_text:
-                distance_km = float(distance_text.split()[0].replace(",", ""))
-                distance_miles = round(distance_km * 0.621371, 1)
-            else:
-                distance_miles = float(
-                    distance_text.split()[0]
-                )  # Assuming miles directly if not km
-
-            db_handler.save_mileage_for_site(site_name, distance_miles)
-            print(f"Updated {site_name} with {distance_miles} miles.")
-        else:
-            print(f"Could not update {site_name}. Distance not found.")
+    distances = db_handler.resolve_site_mileages(default_from, zero_mileage_sites)
+    for site_name, distance_miles in distances.items():
+        print(f"Updated {site_name} with {distance_miles} miles.")
 
 
-def calculate_and_cache_distances(
-    api_key, default_from, ballfields, db_handler=db_handler
-):
-    gmaps = googlemaps.Client(key=api_key)
+def calculate_and_cache_distances(api_key, default_from, ballfields, db_handler=None):
+    db_handler = db_handler or get_db_handler(db_file)
     distances = {}
+    missing = {}
 
     for site_name, address in ballfields.items():
         # Check if mileage is already cached in the database
-        cached_mileage = db_handler.get_mileage_for_site(site_name)
+        cached_mileage = db_handler.get_site_mileage(site_name)
         if cached_mileage is not None:
             distances[site_name] = f"{cached_mileage} miles"
-            continue
-
-        # API call for sites not cached
-        distance_result = gmaps.distance_matrix(default_from, address, mode="driving")
-        if distance_result["rows"][0]["elements"][0]["status"] == "OK":
-            distance_text = distance_result["rows"][0]["elements"][0]["distance"][
-                "text"
-            ]
-            if "km" in distance_text:
-                distance_km = float(distance_text.split()[0].replace(",", ""))
-                distance_miles = round(distance_km * 0.621371, 1)
-            else:
-                distance_miles = float(
-                    distance_text.split()[0]
-                )  # Assuming miles directly if not km
-
-            distances[site_name] = f"{distance_miles} miles"
-            db_handler.save_mileage_for_site(site_name, distance_miles)
         else:
-            distances[site_name] = "Distance not found"
+            missing[site_name] = address
+
+    # One concurrent pass over the sites not cached; results are saved as they are stored
+    resolved = db_handler.resolve_site_mileages(default_from, missing) if missing else {}
+    for site_name in missing:
+        distances[site_name] = f"{resolved[site_name]} miles" if site_name in resolved else "Distance not found"
 
     return distances
@@ -0,0 +1,65 @@
+"""Offline mileage estimates from stored site coordinates.
+
+Great-circle (haversine) distances are computed for every site in one vectorized NumPy
+operation and scaled by a road factor, since driving routes are longer than the straight
+line. The estimates stand in for the Distance Matrix API when it cannot be reached and
+serve as a cheap pre-filter before making real requests. NumPy is imported on first use.
+"""
+
+EARTH_RADIUS_MILES = 3958.7613
+
+# Typical ratio of driving distance to great-circle distance on a road network
+DEFAULT_ROAD_FACTOR = 1.25
+
+
+def geocode(gmaps, address):
+    """Return (latitude, longitude) for an address, or None if it could not be geocoded."""
+    results = gmaps.geocode(address)
+    if not results:
+        return None
+    location = results[0]["geometry"]["location"]
+    return location["lat"], location["lng"]
+
+
+class CoordinateIndex:
+    """Site coordinates held as radian arrays, ready for repeated distance queries."""
+
+    def __init__(self, coordinates):
+        """`coordinates` maps site name to (latitude, longitude) in degrees."""
+        import numpy as np
+
+        self.names = list(coordinates)
+        points = np.array([coordinates[name] for name in self.names], dtype=float).reshape(-1, 2)
+        self._lat = np.radians(points[:, 0])
+        self._lng = np.radians(points[:, 1])
+        self._cos_lat = np.cos(self._lat)
+
+    def __len__(self):
+        return len(self.names)
+
+    def great_circle_miles(self, origin):
+        """Array of straight-line miles from an origin (latitude, longitude) to every site."""
+        import numpy as np
+
+        origin_lat, origin_lng = np.radians(origin[0]), np.radians(origin[1])
+        a = (
+            np.sin((self._lat - origin_lat) / 2) ** 2
+            + np.cos(origin_lat) * self._cos_lat * np.sin((self._lng - origin_lng) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def road_miles(self, origin, road_factor=DEFAULT_ROAD_FACTOR):
+        """Array of estimated driving miles from an origin to every site."""
+        return self.great_circle_miles(origin) * road_factor
+
+    def estimate(self, origin, road_factor=DEFAULT_ROAD_FACTOR):
+        """Return {site: estimated driving miles}, rounded like Distance Matrix results."""
+        miles = self.road_miles(origin, road_factor).round(1)
+        return dict(zip(self.names, miles.tolist()))
+
+    def within(self, origin, max_miles, road_factor=DEFAULT_ROAD_FACTOR):
+        """Names of the sites whose estimated driving distance is at most `max_miles`."""
+        import numpy as np
+
+        nearby = np.flatnonzero(self.road_miles(origin, road_factor) <= max_miles)
+        return [self.names[i] for i in nearby]
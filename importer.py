@@ -0,0 +1,123 @@
+import csv
+from dataclasses import dataclass, field
+import os
+
+from classes import GameBatch, get_db_handler
+import sites
+import leagues
+
+ICS_EXTENSIONS = (".ics", ".ical", ".ifb")
+
+
+@dataclass
+class ImportReport:
+    """Outcome of a schedule import; errors are (line number, message) pairs."""
+
+    inserted: int = 0
+    errors: list = field(default_factory=list)
+
+
+def parse_flag(value):
+    return str(value or "").strip().lower() in ["yes", "y", "true", "1"]
+
+
+def iter_csv_records(lines):
+    """Yield (line number, record) for each row of a CSV with date, site and league columns."""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, {key.strip().lower(): (value or "").strip() for key, value in record.items() if key}
+
+
+def _unescape_ics(value):
+    return value.replace("\\n", " ").replace("\\N", " ").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _unfolded_ics_lines(lines):
+    """Join RFC 5545 folded continuation lines, yielding (line number, content line)."""
+    pending, pending_line = None, 0
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending_line, pending
+        pending, pending_line = line, line_number
+    if pending is not None:
+        yield pending_line, pending
+
+
+def iter_ics_records(lines):
+    """Yield (line number, record) for each VEVENT of an iCalendar file.
+
+    DTSTART gives the date, LOCATION the site, and CATEGORIES (or SUMMARY) the league.
+    """
+    event, event_line = None, 0
+    for line_number, line in _unfolded_ics_lines(lines):
+        if line == "BEGIN:VEVENT":
+            event, event_line = {}, line_number
+        elif line == "END:VEVENT" and event is not None:
+            yield (
+                event_line,
+                {
+                    "date": event.get("DTSTART", "")[:8],
+                    "site": event.get("LOCATION", ""),
+                    "league": event.get("CATEGORIES") or event.get("SUMMARY", ""),
+                },
+            )
+            event = None
+        elif event is not None and ":" in line:
+            name, value = line.split(":", 1)
+            event[name.split(";", 1)[0].upper()] = _unescape_ics(value).strip()
+
+
+def iter_schedule_records(lines, path=""):
+    if path.lower().endswith(ICS_EXTENSIONS):
+        return iter_ics_records(lines)
+    return iter_csv_records(lines)
+
+
+def add_record(batch, record):
+    """Validate a schedule record and append it to a GameBatch."""
+    site = record.get("site", "")
+    league = record.get("league", "")
+    if not site or site not in sites.ballfields:
+        raise ValueError(f"{site} not recognized.")
+    if not league or league not in leagues.game_rates:
+        raise ValueError(f"{league} not recognized")
+    batch.append(
+        site,
+        league,
+        record.get("date", ""),
+        parse_flag(record.get("fee_paid")),
+        parse_flag(record.get("is_volunteer")),
+    )
+
+
+def import_schedule(db_file, path, chunk_size=500, db_handler=None):
+    """Stream a CSV or iCalendar schedule into the games table.
+
+    Valid rows are collected `chunk_size` at a time in a GameBatch, which resolves fees and
+    mileage once per league and site from in-memory lookups and inserts the chunk with
+    executemany, all inside a single transaction. Invalid rows are reported and skipped
+    without stopping the load; only one chunk of rows is held in memory at a time.
+    """
+    db_handler = db_handler or get_db_handler(db_file)
+    report = ImportReport()
+    batch = GameBatch()
+
+    with open(path, newline="", encoding="utf-8-sig") as schedule:
+        records = iter_schedule_records(schedule, os.fspath(path))
+        with db_handler.writer() as conn:
+            for line_number, record in records:
+                try:
+                    add_record(batch, record)
+                except ValueError as ve:
+                    report.errors.append((line_number, str(ve)))
+                    continue
+                if len(batch) >= chunk_size:
+                    report.inserted += batch.resolve(db_handler).insert(conn)
+                    batch.clear()
+            if len(batch):
+                report.inserted += batch.resolve(db_handler).insert(conn)
+    return report
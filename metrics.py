@@ -0,0 +1,253 @@
+"""Lightweight runtime metrics for SQL statements, connections and Distance Matrix calls.
+
+Statements are timed by a sqlite3 connection/cursor factory, and API calls by a thin
+wrapper around the Google Maps client. Recording is sampled (`sample_rate`) and can be
+switched off entirely, in which case new connections use the plain sqlite3 classes and
+nothing is wrapped; both are set under [metrics] in config.ini. The distance cache
+reports its hits and misses here too.
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+
+# Distinct statements tracked; any beyond are totalled together, so dynamically built SQL
+# cannot grow the table without bound
+MAX_STATEMENTS = 500
+OTHER_STATEMENTS = "(other statements)"
+
+
+class Metrics:
+    """Thread-safe accumulator of per-statement, per-connection and per-API-call metrics."""
+
+    def __init__(self, enabled=True, sample_rate=1.0):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._statement_keys = {}
+        self.reset()
+
+    def configure(self, enabled=None, sample_rate=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def reset(self):
+        with self._lock:
+            self.queries = {}
+            self.connections = {"opened": 0, "open_seconds": 0.0, "by_file": {}}
+            self.api_calls = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "elements": 0, "statuses": {}}
+            self.distance_cache = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def sampled(self):
+        """Decide whether the next statement is recorded."""
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def _query_stats(self, sql):
+        key = self._statement_keys.get(sql)
+        if key is None:
+            if len(self._statement_keys) >= MAX_STATEMENTS:
+                # Only a cache of normalized text; start it over rather than let it grow
+                self._statement_keys.clear()
+            key = self._statement_keys[sql] = " ".join(sql.split())
+        stats = self.queries.get(key)
+        if stats is None:
+            if len(self.queries) >= MAX_STATEMENTS:
+                key = OTHER_STATEMENTS
+                stats = self.queries.get(key)
+            if stats is None:
+                stats = self.queries[key] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "rows": 0}
+        return stats
+
+    def record_query(self, sql, seconds, rows=0):
+        with self._lock:
+            stats = self._query_stats(sql)
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["rows"] += max(rows, 0)
+
+    def record_rows(self, sql, rows):
+        """Add rows fetched after the statement itself was timed."""
+        with self._lock:
+            self._query_stats(sql)["rows"] += rows
+
+    def record_connection(self, db_file, seconds):
+        with self._lock:
+            self.connections["opened"] += 1
+            self.connections["open_seconds"] += seconds
+            self.connections["by_file"][db_file] = self.connections["by_file"].get(db_file, 0) + 1
+
+    def record_api_call(self, seconds, elements, status):
+        with self._lock:
+            calls = self.api_calls
+            calls["count"] += 1
+            calls["total_seconds"] += seconds
+            calls["max_seconds"] = max(calls["max_seconds"], seconds)
+            calls["elements"] += elements
+            calls["statuses"][status] = calls["statuses"].get(status, 0) + 1
+
+    def record_distance_cache(self, hits=0, misses=0, expired=0, evicted=0):
+        """Count distance cache lookups; expired entries are also counted as misses."""
+        with self._lock:
+            cache = self.distance_cache
+            cache["hits"] += hits
+            cache["misses"] += misses
+            cache["expired"] += expired
+            cache["evicted"] += evicted
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of everything recorded so far."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "queries": {sql: dict(stats) for sql, stats in self.queries.items()},
+                "connections": {**self.connections, "by_file": dict(self.connections["by_file"])},
+                "api_calls": {**self.api_calls, "statuses": dict(self.api_calls["statuses"])},
+                "distance_cache": dict(self.distance_cache),
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def connection_factory(self):
+        """sqlite3 connection class for newly opened connections."""
+        return InstrumentedConnection if self.enabled else sqlite3.Connection
+
+    def instrument_client(self, client):
+        """Wrap a googlemaps-compatible client so its distance_matrix calls are recorded."""
+        if client is None or not self.enabled or isinstance(client, InstrumentedClient):
+            return client
+        return InstrumentedClient(client, self)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each sampled statement and counts the rows it affects or returns.
+
+    Rows read by iterating are tallied on the cursor and recorded once the statement is
+    exhausted, replaced or the cursor closed, so there is no locking per row.
+    """
+
+    _sql = None
+    _rows = 0
+
+    def _record_rows(self):
+        if self._sql is not None and self._rows:
+            metrics.record_rows(self._sql, self._rows)
+        self._rows = 0
+
+    def execute(self, sql, parameters=()):
+        return self._execute(sql, parameters, metrics.sampled())
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._executemany(sql, seq_of_parameters, metrics.sampled())
+
+    def _execute(self, sql, parameters, sampled):
+        """execute() with the sampling decision already made, so each statement is sampled once."""
+        self._record_rows()
+        if not sampled:
+            self._sql = None
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            metrics.record_query(sql, time.perf_counter() - start, self.rowcount)
+
+    def _executemany(self, sql, seq_of_parameters, sampled):
+        self._record_rows()
+        if not sampled:
+            self._sql = None
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = None
+            metrics.record_query(sql, time.perf_counter() - start, self.rowcount)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if self._sql is not None and row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._sql is not None:
+            metrics.record_rows(self._sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self._sql is not None:
+            metrics.record_rows(self._sql, len(rows))
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._record_rows()
+            raise
+        if self._sql is not None:
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._record_rows()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind conn.execute(), are instrumented.
+
+    conn.execute() only builds an instrumented cursor for sampled statements; the others
+    get a plain sqlite3 cursor and run at full speed.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not metrics.sampled():
+            return super().execute(sql, parameters)
+        return self.cursor()._execute(sql, parameters, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not metrics.sampled():
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor()._executemany(sql, seq_of_parameters, True)
+
+
+class InstrumentedClient:
+    """Proxy for a Google Maps client that records latency, elements and status per call."""
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def distance_matrix(self, origins, destinations, *args, **kwargs):
+        start = time.perf_counter()
+        status, elements = "ERROR", 0
+        try:
+            result = self._client.distance_matrix(origins, destinations, *args, **kwargs)
+            status = result.get("status", "OK")
+            elements = sum(len(row.get("elements", ())) for row in result.get("rows", ()))
+            return result
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self._metrics.record_api_call(time.perf_counter() - start, elements, status)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+metrics = Metrics()
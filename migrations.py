@@ -0,0 +1,539 @@
+"""In-place schema migrations keyed on PRAGMA user_version.
+
+Each migration runs in its own IMMEDIATE transaction together with the user_version bump,
+so a failed step leaves the database exactly as it was. Table rebuilds copy rows with a
+single INSERT ... SELECT and recreate indexes after the copy, which keeps multi-season
+databases migrating in seconds instead of needing an export and re-entry. Processes that
+start at the same time take turns; a step another process applied first is skipped.
+"""
+
+from contextlib import contextmanager
+import functools
+
+import concurrency
+
+# Partial, so marking games paid only removes index entries; replaced version 4's index in version 8
+UNPAID_INDEX = "CREATE INDEX IF NOT EXISTS idx_games_unpaid ON games (date) WHERE fee_paid = 0"
+GAMES_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_games_date ON games (date)",
+    UNPAID_INDEX,
+    "CREATE INDEX IF NOT EXISTS idx_games_league_date ON games (league_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_games_assignor_date ON games (assignor_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_games_site_date ON games (site_id, date)",
+)
+# The indexes version 4 created, when games held site, league and assignor names
+NAME_GAMES_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_games_date ON games (date)",
+    "CREATE INDEX IF NOT EXISTS idx_games_unpaid ON games (fee_paid, date)",
+    "CREATE INDEX IF NOT EXISTS idx_games_league_date ON games (league, date)",
+    "CREATE INDEX IF NOT EXISTS idx_games_assignor_date ON games (assignor, date)",
+)
+
+# games column holding each lookup table's name, before version 11 replaced it with <column>_id
+LOOKUP_COLUMNS = {"sites": "site", "leagues": "league", "assignors": "assignor"}
+
+# Rewrites legacy yymmdd and yyyymmdd game dates as YYYY-MM-DD
+NORMALIZE_DATES_SQL = """
+    UPDATE games SET date = CASE
+        WHEN length(date) = 6 THEN '20' || substr(date, 1, 2) || '-' || substr(date, 3, 2) || '-' || substr(date, 5, 2)
+        ELSE substr(date, 1, 4) || '-' || substr(date, 5, 2) || '-' || substr(date, 7, 2)
+    END
+    WHERE date GLOB '[0-9][0-9][0-9][0-9][0-9][0-9]'
+       OR date GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'
+"""
+
+
+def create_base_tables(conn):
+    """The schema as it existed before migrations; adopts older databases unchanged."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            site TEXT,
+            league TEXT,
+            assignor TEXT,
+            game_fee INTEGER,
+            fee_paid BOOLEAN,
+            is_volunteer BOOLEAN,
+            mileage FLOAT
+        )
+        """
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sites (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, mileage REAL DEFAULT 0)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS leagues (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+    conn.execute("CREATE TABLE IF NOT EXISTS assignors (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+
+
+def rebuild_table(conn, table, create_sql, columns, select_exprs=None):
+    """Rebuild `table` from `create_sql` (which must create `<table>_new`), copying `columns`.
+
+    `select_exprs` optionally maps a column to the SQL expression that fills it, which is
+    how column types are converted during the copy.
+    """
+    select_exprs = select_exprs or {}
+    column_list = ", ".join(columns)
+    select_list = ", ".join(select_exprs.get(column, column) for column in columns)
+    conn.execute(f"DROP TABLE IF EXISTS {table}_new")
+    conn.execute(create_sql)
+    conn.execute(f"INSERT INTO {table}_new ({column_list}) SELECT {select_list} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def rebuild_sites_with_real_mileage(conn):
+    rebuild_table(
+        conn,
+        "sites",
+        "CREATE TABLE sites_new (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, mileage REAL NOT NULL DEFAULT 0)",
+        ("id", "name", "mileage"),
+        {"mileage": "CAST(COALESCE(mileage, 0) AS REAL)"},
+    )
+
+
+def rebuild_games_with_typed_columns(conn):
+    conn.execute(NORMALIZE_DATES_SQL)
+    rebuild_table(
+        conn,
+        "games",
+        """
+        CREATE TABLE games_new (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            site TEXT,
+            league TEXT,
+            assignor TEXT,
+            game_fee INTEGER,
+            fee_paid INTEGER NOT NULL DEFAULT 0,
+            is_volunteer INTEGER NOT NULL DEFAULT 0,
+            mileage REAL NOT NULL DEFAULT 0
+        )
+        """,
+        ("id", "date", "site", "league", "assignor", "game_fee", "fee_paid", "is_volunteer", "mileage"),
+        {
+            "fee_paid": "COALESCE(fee_paid, 0) != 0",
+            "is_volunteer": "COALESCE(is_volunteer, 0) != 0",
+            "mileage": "CAST(COALESCE(NULLIF(mileage, ''), 0) AS REAL)",
+        },
+    )
+
+
+def create_games_indexes(conn, indexes=GAMES_INDEXES):
+    for sql in indexes:
+        conn.execute(sql)
+
+
+def create_name_games_indexes(conn):
+    create_games_indexes(conn, NAME_GAMES_INDEXES)
+
+
+# The season summary rollup holds one row per (season, league, assignor) with the same
+# totals display_season_summary reports, kept current by triggers on games. Its key
+# columns are named like the games columns they come from, mapped to (type, value for
+# games without one): lookup ids since version 11, names before that.
+SUMMARY_KEYS = {"league_id": ("INTEGER", "0"), "assignor_id": ("INTEGER", "0")}
+NAME_SUMMARY_KEYS = {"league": ("TEXT", "''"), "assignor": ("TEXT", "''")}
+
+
+def season_summary_from_games_sql(keys=SUMMARY_KEYS, where="1", table="games"):
+    key_terms = ", ".join(f"COALESCE({column}, {missing})" for column, (_type, missing) in keys.items())
+    return f"""
+        SELECT CAST(substr(date, 1, 4) AS INTEGER), {key_terms},
+            COUNT(1),
+            SUM(CASE WHEN fee_paid = 0 THEN COALESCE(game_fee, 0) ELSE 0 END),
+            SUM(CASE WHEN fee_paid = 1 THEN COALESCE(game_fee, 0) ELSE 0 END),
+            SUM(COALESCE(mileage, 0))
+        FROM {table}
+        WHERE {where}
+        GROUP BY 1, 2, 3
+    """
+
+
+SEASON_SUMMARY_FROM_GAMES_SQL = season_summary_from_games_sql()
+
+
+def _season_summary_terms(row, keys):
+    """SQL expressions for one games row's rollup key and contribution."""
+    return {
+        "season": f"CAST(substr({row}.date, 1, 4) AS INTEGER)",
+        **{column: f"COALESCE({row}.{column}, {missing})" for column, (_type, missing) in keys.items()},
+        "owed": f"CASE WHEN {row}.fee_paid = 0 THEN COALESCE({row}.game_fee, 0) ELSE 0 END",
+        "paid": f"CASE WHEN {row}.fee_paid = 1 THEN COALESCE({row}.game_fee, 0) ELSE 0 END",
+        "mileage": f"COALESCE({row}.mileage, 0)",
+    }
+
+
+def _add_to_season_summary(row, keys):
+    t = _season_summary_terms(row, keys)
+    key_columns = ", ".join(("season", *keys))
+    key_values = ", ".join(t[column] for column in ("season", *keys))
+    return f"""
+        INSERT INTO season_summary ({key_columns}, games, owed, paid, mileage)
+        VALUES ({key_values}, 1, {t["owed"]}, {t["paid"]}, {t["mileage"]})
+        ON CONFLICT ({key_columns}) DO UPDATE SET
+            games = games + excluded.games,
+            owed = owed + excluded.owed,
+            paid = paid + excluded.paid,
+            mileage = mileage + excluded.mileage;
+    """
+
+
+def _remove_from_season_summary(row, keys):
+    t = _season_summary_terms(row, keys)
+    key = " AND ".join(f"{column} = {t[column]}" for column in ("season", *keys))
+    return f"""
+        UPDATE season_summary
+        SET games = games - 1, owed = owed - {t["owed"]}, paid = paid - {t["paid"]}, mileage = mileage - {t["mileage"]}
+        WHERE {key};
+        DELETE FROM season_summary WHERE {key} AND games <= 0;
+    """
+
+
+def create_season_summary(conn, keys=SUMMARY_KEYS):
+    key_columns = "".join(f"{column} {column_type} NOT NULL, " for column, (column_type, _missing) in keys.items())
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS season_summary (
+            season INTEGER NOT NULL, {key_columns}
+            games INTEGER NOT NULL DEFAULT 0,
+            owed NUMERIC NOT NULL DEFAULT 0,
+            paid NUMERIC NOT NULL DEFAULT 0,
+            mileage REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (season, {", ".join(keys)})
+        ) WITHOUT ROWID
+        """
+    )
+    create_season_summary_triggers(conn, keys)
+    rebuild_season_summary(conn, keys)
+
+
+def create_name_season_summary(conn):
+    create_season_summary(conn, NAME_SUMMARY_KEYS)
+
+
+def _unless_suspended(trigger, suspendable=True):
+    """WHEN condition that turns a trigger off while suspend_triggers() names it.
+
+    Triggers created before version 12 have none, as there is no table to consult.
+    """
+    if not suspendable:
+        return "1"
+    return f"NOT EXISTS (SELECT 1 FROM trigger_suspensions WHERE name = '{trigger}')"
+
+
+@contextmanager
+def suspend_triggers(conn, *triggers):
+    """Turn the named per-row triggers off for the statements run inside the block.
+
+    Set-wise statements use this to do the triggers' work in one pass. It writes rows to
+    trigger_suspensions rather than dropping the triggers, so the schema (and every other
+    connection's prepared statements) is untouched; the rows are deleted again before the
+    caller's transaction commits, so no other connection ever sees them.
+    """
+    conn.executemany("INSERT INTO trigger_suspensions (name) VALUES (?)", ((name,) for name in triggers))
+    try:
+        yield
+    finally:
+        conn.executemany("DELETE FROM trigger_suspensions WHERE name = ?", ((name,) for name in triggers))
+
+
+def create_season_summary_triggers(conn, keys=SUMMARY_KEYS, suspendable=False):
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS games_summary_insert AFTER INSERT ON games
+        BEGIN {_add_to_season_summary("NEW", keys)} END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS games_summary_delete AFTER DELETE ON games
+        WHEN {_unless_suspended("games_summary_delete", suspendable)}
+        BEGIN {_remove_from_season_summary("OLD", keys)} END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS games_summary_update
+        AFTER UPDATE OF date, {", ".join(keys)}, game_fee, fee_paid, mileage ON games
+        WHEN {_unless_suspended("games_summary_update", suspendable)}
+        BEGIN {_remove_from_season_summary("OLD", keys)} {_add_to_season_summary("NEW", keys)} END
+        """
+    )
+
+
+def set_fee_paid(conn, paid_status, where, params=()):
+    """Set fee_paid on the games matching `where`, moving their fees in the rollup set-wise.
+
+    The per-row update triggers are suspended for the statement (see suspend_triggers);
+    the season summary is adjusted with one grouped UPDATE and paid_on is stamped by the
+    UPDATE itself, so changing 100k games stays well under a second. Must run inside the
+    caller's transaction; returns the number of games changed.
+    """
+    paid_status = int(bool(paid_status))
+    match = f"fee_paid != {paid_status} AND ({where})"
+    existing = {
+        name
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE name IN ('season_summary', 'games_paid_on')")
+    }
+    assignments = f"fee_paid = {paid_status}"
+    if "games_paid_on" in existing:
+        assignments += f", paid_on = {PAID_ON_EXPR if paid_status else 'NULL'}"
+    update_sql = f"UPDATE games SET {assignments} WHERE {match}"
+    if "season_summary" not in existing:
+        return conn.execute(update_sql, params).rowcount
+    # Fees move from owed to paid when marking paid, and back when marking unpaid
+    sign = 1 if paid_status else -1
+    conn.execute(
+        f"""
+        UPDATE season_summary SET owed = owed - {sign} * moved.amount, paid = paid + {sign} * moved.amount
+        FROM (
+            SELECT CAST(substr(date, 1, 4) AS INTEGER) AS season, COALESCE(league_id, 0) AS league_id,
+                COALESCE(assignor_id, 0) AS assignor_id, SUM(COALESCE(game_fee, 0)) AS amount
+            FROM games WHERE {match}
+            GROUP BY 1, 2, 3
+        ) AS moved
+        WHERE season_summary.season = moved.season
+            AND season_summary.league_id = moved.league_id
+            AND season_summary.assignor_id = moved.assignor_id
+        """,
+        params,
+    )
+    with suspend_triggers(conn, "games_summary_update", "games_paid_on"):
+        return conn.execute(update_sql, params).rowcount
+
+
+def rebuild_season_summary(conn, keys=SUMMARY_KEYS, season=None):
+    """Recompute the rollup from the games table: all of it, or just one season's rows."""
+    if season is None:
+        conn.execute("DELETE FROM season_summary")
+        where, params = "1", ()
+    else:
+        season = int(season)
+        conn.execute("DELETE FROM season_summary WHERE season = ?", (season,))
+        where, params = "date >= ? AND date < ?", (f"{season:04d}-01-01", f"{season + 1:04d}-01-01")
+    conn.execute(
+        f"INSERT INTO season_summary (season, {', '.join(keys)}, games, owed, paid, mileage) "
+        + season_summary_from_games_sql(keys, where),
+        params,
+    )
+
+
+def add_site_coordinates(conn):
+    conn.execute("ALTER TABLE sites ADD COLUMN latitude REAL")
+    conn.execute("ALTER TABLE sites ADD COLUMN longitude REAL")
+
+
+def create_distances(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS distances (
+            origin TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            mode TEXT NOT NULL DEFAULT 'driving',
+            miles REAL NOT NULL,
+            fetched_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (origin, destination, mode)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def use_partial_unpaid_index(conn):
+    conn.execute("DROP INDEX IF EXISTS idx_games_unpaid")
+    conn.execute(UNPAID_INDEX)
+
+
+# The date a game was marked paid, for payment lag reports. Games entered as already paid
+# have no paid_on, since the day they were really paid is unknown.
+PAID_ON_EXPR = "date('now', 'localtime')"
+
+
+def create_paid_on_trigger(conn, suspendable=False):
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS games_paid_on AFTER UPDATE OF fee_paid ON games
+        WHEN NEW.fee_paid != OLD.fee_paid AND {_unless_suspended("games_paid_on", suspendable)}
+        BEGIN UPDATE games SET paid_on = CASE WHEN NEW.fee_paid THEN {PAID_ON_EXPR} END WHERE id = NEW.id; END
+        """
+    )
+
+
+def add_paid_on(conn):
+    conn.execute("ALTER TABLE games ADD COLUMN paid_on TEXT")
+    create_paid_on_trigger(conn)
+
+
+def create_partitions(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS partitions (
+            season INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            games INTEGER NOT NULL,
+            archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+# Reports read names through these views; games and season_summary only hold lookup ids
+GAME_DETAILS_VIEW_SQL = """
+    CREATE VIEW IF NOT EXISTS game_details AS
+    SELECT games.id, games.date, sites.name AS site, leagues.name AS league, assignors.name AS assignor,
+        games.game_fee, games.fee_paid, games.is_volunteer, games.mileage, games.paid_on,
+        games.site_id, games.league_id, games.assignor_id
+    FROM games
+    LEFT JOIN sites ON sites.id = games.site_id
+    LEFT JOIN leagues ON leagues.id = games.league_id
+    LEFT JOIN assignors ON assignors.id = games.assignor_id
+"""
+SEASON_SUMMARY_DETAILS_VIEW_SQL = """
+    CREATE VIEW IF NOT EXISTS season_summary_details AS
+    SELECT season_summary.season, COALESCE(leagues.name, '') AS league, COALESCE(assignors.name, '') AS assignor,
+        season_summary.games, season_summary.owed, season_summary.paid, season_summary.mileage,
+        season_summary.league_id, season_summary.assignor_id
+    FROM season_summary
+    LEFT JOIN leagues ON leagues.id = season_summary.league_id
+    LEFT JOIN assignors ON assignors.id = season_summary.assignor_id
+"""
+
+# Inserting names into game_details adds any the lookup tables lack and stores their ids,
+# so one-off writes can keep naming sites, leagues and assignors. Bulk writers look the
+# ids up once per distinct name instead (see classes.lookup_ids).
+GAME_DETAILS_INSERT_TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS game_details_insert INSTEAD OF INSERT ON game_details
+    BEGIN
+        INSERT OR IGNORE INTO sites (name) SELECT NEW.site WHERE NEW.site != '';
+        INSERT OR IGNORE INTO leagues (name) SELECT NEW.league WHERE NEW.league != '';
+        INSERT OR IGNORE INTO assignors (name) SELECT NEW.assignor WHERE NEW.assignor != '';
+        INSERT INTO games (
+            id, date, site_id, league_id, assignor_id, game_fee, fee_paid, is_volunteer, mileage, paid_on
+        )
+        VALUES (
+            NEW.id, NEW.date,
+            (SELECT id FROM sites WHERE name = NEW.site),
+            (SELECT id FROM leagues WHERE name = NEW.league),
+            (SELECT id FROM assignors WHERE name = NEW.assignor),
+            NEW.game_fee, COALESCE(NEW.fee_paid, 0), COALESCE(NEW.is_volunteer, 0), COALESCE(NEW.mileage, 0),
+            NEW.paid_on
+        );
+    END
+"""
+
+
+def create_game_views(conn):
+    conn.execute(GAME_DETAILS_VIEW_SQL)
+    conn.execute(SEASON_SUMMARY_DETAILS_VIEW_SQL)
+    conn.execute(GAME_DETAILS_INSERT_TRIGGER_SQL)
+
+
+def rebuild_games_with_lookup_ids(conn):
+    """Replace the site, league and assignor names on games with ids into their lookup tables.
+
+    Every name in use is added to its lookup table first. The rollup is re-keyed on the
+    ids too, and the triggers and indexes dropped with the old table are recreated.
+    """
+    for table, column in LOOKUP_COLUMNS.items():
+        conn.execute(f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT {column} FROM games WHERE {column} != ''")
+    conn.execute("DROP TABLE IF EXISTS season_summary")
+    rebuild_table(
+        conn,
+        "games",
+        """
+        CREATE TABLE games_new (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            site_id INTEGER REFERENCES sites (id),
+            league_id INTEGER REFERENCES leagues (id),
+            assignor_id INTEGER REFERENCES assignors (id),
+            game_fee INTEGER,
+            fee_paid INTEGER NOT NULL DEFAULT 0,
+            is_volunteer INTEGER NOT NULL DEFAULT 0,
+            mileage REAL NOT NULL DEFAULT 0,
+            paid_on TEXT
+        )
+        """,
+        (
+            "id",
+            "date",
+            "site_id",
+            "league_id",
+            "assignor_id",
+            "game_fee",
+            "fee_paid",
+            "is_volunteer",
+            "mileage",
+            "paid_on",
+        ),
+        {
+            f"{column}_id": f"(SELECT id FROM {table} WHERE name = games.{column})"
+            for table, column in LOOKUP_COLUMNS.items()
+        },
+    )
+    create_games_indexes(conn)
+    create_paid_on_trigger(conn)
+    create_season_summary(conn)
+    create_game_views(conn)
+
+
+def create_trigger_suspensions(conn):
+    """Let set-wise updates turn the per-row rollup and paid_on triggers off without DDL."""
+    conn.execute("CREATE TABLE IF NOT EXISTS trigger_suspensions (name TEXT PRIMARY KEY) WITHOUT ROWID")
+    for trigger in ("games_summary_update", "games_summary_delete", "games_paid_on"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    create_season_summary_triggers(conn, suspendable=True)
+    create_paid_on_trigger(conn, suspendable=True)
+
+
+def index_distances_by_age(conn):
+    """Let the distance cache count and evict its oldest entries without sorting the table."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_distances_fetched_at ON distances (fetched_at)")
+
+
+# (version, description, step) in the order they must be applied; never renumber or edit a
+# released step, add a new one instead.
+MIGRATIONS = [
+    (1, "base tables", create_base_tables),
+    (2, "sites.mileage as REAL", rebuild_sites_with_real_mileage),
+    (3, "games with ISO dates and typed columns", rebuild_games_with_typed_columns),
+    (4, "games report indexes", create_name_games_indexes),
+    (5, "trigger-maintained season summary rollup", create_name_season_summary),
+    (6, "site latitude and longitude", add_site_coordinates),
+    (7, "distance cache keyed by origin, destination and mode", create_distances),
+    (8, "partial index on unpaid games", use_partial_unpaid_index),
+    (9, "games.paid_on stamped when a game is marked paid", add_paid_on),
+    (10, "registry of seasons archived to their own files", create_partitions),
+    (11, "games reference sites, leagues and assignors by id", rebuild_games_with_lookup_ids),
+    (12, "rollup and paid_on triggers suspended by rows instead of being dropped", create_trigger_suspensions),
+    (13, "distances indexed by fetched_at", index_distances_by_age),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION, transaction=None):
+    """Apply every pending migration up to `target`; return the versions applied.
+
+    Each step runs in `transaction()`, a context manager holding the write lock on conn
+    (ConnectionManager.writer in the application), or concurrency.immediate_transaction.
+    """
+    if transaction is None:
+        transaction = functools.partial(concurrency.immediate_transaction, conn)
+    applied = []
+    for version, _description, step in MIGRATIONS:
+        if version <= schema_version(conn) or version > target:
+            continue
+        with transaction():
+            # Another process may have applied it while this one waited for the write lock
+            if schema_version(conn) >= version:
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version:d}")
+        applied.append(version)
+    return applied
@@ -0,0 +1,244 @@
+"""Per-season partitions: closed seasons archived to their own SQLite files.
+
+The games table holds only seasons that have not been archived, so current-season reads,
+writes and index maintenance never touch history and the main file stops growing with
+every year. archive_season() moves one closed season's games and season summary rows to
+<db>_<season>.db and records the file in the partitions table.
+Cross-season reports attach just the archives they need and read through the temporary
+UNION ALL views all_games and all_season_summary. Archives hold site, league and assignor
+names rather than lookup ids, so each file can be read on its own.
+"""
+
+from contextlib import contextmanager
+from datetime import date
+import functools
+import os
+import sqlite3
+
+from classes import season_bounds
+import concurrency
+import migrations
+
+GAME_COLUMNS = (
+    "id",
+    "date",
+    "site",
+    "league",
+    "assignor",
+    "game_fee",
+    "fee_paid",
+    "is_volunteer",
+    "mileage",
+    "paid_on",
+)
+SUMMARY_COLUMNS = ("season", "league", "assignor", "games", "owed", "paid", "mileage")
+
+# An archive holds one closed season; it is only read after archiving, so it needs no
+# triggers or indexes
+ARCHIVE_TABLES_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.games (
+        id INTEGER PRIMARY KEY,
+        date TEXT,
+        site TEXT,
+        league TEXT,
+        assignor TEXT,
+        game_fee INTEGER,
+        fee_paid INTEGER NOT NULL DEFAULT 0,
+        is_volunteer INTEGER NOT NULL DEFAULT 0,
+        mileage REAL NOT NULL DEFAULT 0,
+        paid_on TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.season_summary (
+        season INTEGER NOT NULL,
+        league TEXT NOT NULL,
+        assignor TEXT NOT NULL,
+        games INTEGER NOT NULL DEFAULT 0,
+        owed NUMERIC NOT NULL DEFAULT 0,
+        paid NUMERIC NOT NULL DEFAULT 0,
+        mileage REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (season, league, assignor)
+    ) WITHOUT ROWID
+    """,
+)
+
+HISTORY_SQL = """
+    SELECT season, league,
+        SUM(games) as total_games,
+        SUM(owed) as total_owed,
+        SUM(paid) as total_paid,
+        ROUND(SUM(mileage),1) as total_mileage
+    FROM all_season_summary
+    {where}
+    GROUP BY season, league
+    ORDER BY season, league
+"""
+
+
+def main_file(conn):
+    """Path of the connection's main database file; empty for an in-memory database."""
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+
+
+def main_directory(conn):
+    """Directory of the connection's main database file; archive paths are relative to it."""
+    path = main_file(conn)
+    return os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+
+
+def default_partition_path(conn, season):
+    """e.g. officiating_2024.db next to officiating.db"""
+    stem, extension = os.path.splitext(os.path.basename(main_file(conn) or "games.db"))
+    return os.path.join(main_directory(conn), f"{stem}_{int(season)}{extension or '.db'}")
+
+
+def archived_seasons(conn):
+    """Return {season: absolute path of its archive file} from the partitions table."""
+    directory = main_directory(conn)
+    return {
+        season: os.path.join(directory, path)
+        for season, path in conn.execute("SELECT season, path FROM partitions ORDER BY season")
+    }
+
+
+def archive_season(conn, season, path=None, transaction=None):
+    """Move a closed season's games and rollup rows out of the main database.
+
+    A WAL database cannot commit to two files atomically, so the move is two commits made
+    while holding the main database's write lock: the games are copied into the archive
+    file (created if needed, merged into if the season was archived before) on a
+    connection of its own and committed there, then deleted from games along with the
+    partitions table update. A crash between the two leaves the games in both files, and
+    archiving the season again finishes the move. `transaction` is as for
+    migrations.migrate. Returns the number of games moved.
+    """
+    season = int(season)
+    if season >= date.today().year:
+        raise ValueError(f"Season {season} is not closed yet.")
+    if conn.in_transaction:
+        raise sqlite3.OperationalError("Cannot archive a season inside an open transaction.")
+    if not main_file(conn):
+        raise ValueError("Only a database file can be archived from.")
+    archived_path = archived_seasons(conn).get(season)
+    path = os.path.abspath(path or archived_path or default_partition_path(conn, season))
+    if archived_path is not None and path != os.path.abspath(archived_path):
+        raise ValueError(f"Season {season} is already archived to {archived_path}.")
+    bounds = season_bounds(season)
+
+    if transaction is None:
+        transaction = functools.partial(concurrency.immediate_transaction, conn)
+
+    # Other writers wait until the games are gone from main, so the copy cannot go stale
+    with transaction():
+        archived = copy_season_to_archive(main_file(conn), path, bounds)
+        # The rollup rows are rebuilt below, so skip the per-row delete trigger
+        with migrations.suspend_triggers(conn, "games_summary_delete"):
+            moved = conn.execute("DELETE FROM games WHERE date >= ? AND date < ?", bounds).rowcount
+        migrations.rebuild_season_summary(conn, season=season)
+        conn.execute(
+            """
+            INSERT INTO partitions (season, path, games, archived_at)
+            VALUES (?, ?, ?, datetime('now'))
+            ON CONFLICT (season) DO UPDATE SET
+                path = excluded.path, games = excluded.games, archived_at = excluded.archived_at
+            """,
+            (season, os.path.relpath(path, main_directory(conn)), archived),
+        )
+    return moved
+
+
+def copy_season_to_archive(source_path, path, bounds):
+    """Copy the games dated within `bounds` from the database at `source_path` into the archive
+    at `path` and rebuild its rollup rows, in one transaction; returns the games it holds.
+
+    Games copied by an interrupted archive are skipped; any other game already in the
+    archive under the same id raises IntegrityError and nothing is written.
+    """
+    columns = ", ".join(GAME_COLUMNS)
+    copied = " AND ".join(f"a.{column} IS g.{column}" for column in GAME_COLUMNS)
+    archive = sqlite3.connect(path)
+    try:
+        # Archives are only read once written, so they keep a rollback journal
+        concurrency.configure_connection(archive, "delete")
+        archive.execute("ATTACH DATABASE ? AS source", (source_path,))
+        # Deferred, as BEGIN IMMEDIATE would also wait for the write lock the caller holds on source
+        archive.execute("BEGIN")
+        try:
+            for sql in ARCHIVE_TABLES_SQL:
+                archive.execute(sql.format(schema="main"))
+            archive.execute(
+                f"INSERT INTO main.games ({columns}) SELECT {columns} FROM source.game_details "
+                "WHERE date >= ? AND date < ? ON CONFLICT (id) DO NOTHING",
+                bounds,
+            )
+            conflicts = archive.execute(
+                "SELECT COUNT(1) FROM source.game_details AS g WHERE date >= ? AND date < ? "
+                f"AND NOT EXISTS (SELECT 1 FROM main.games AS a WHERE a.id = g.id AND {copied})",
+                bounds,
+            ).fetchone()[0]
+            if conflicts:
+                raise sqlite3.IntegrityError(f"{conflicts} games conflict with different games in {path}")
+            archive.execute("DELETE FROM main.season_summary")
+            archive.execute(
+                f"INSERT INTO main.season_summary ({', '.join(SUMMARY_COLUMNS)}) "
+                + migrations.season_summary_from_games_sql(migrations.NAME_SUMMARY_KEYS, table="main.games")
+            )
+            archived = archive.execute("SELECT COUNT(1) FROM main.games").fetchone()[0]
+        except BaseException:
+            archive.rollback()
+            raise
+        archive.commit()
+        archive.execute("DETACH DATABASE source")
+    finally:
+        archive.close()
+    return archived
+
+
+@contextmanager
+def attached(conn, seasons=None):
+    """Attach the archives of `seasons` (default all) and create the all_games and
+    all_season_summary views over them and the main database; both are removed on exit.
+    """
+    archives = archived_seasons(conn)
+    wanted = sorted(archives if seasons is None else set(map(int, seasons)) & archives.keys())
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(wanted) > limit:
+        raise ValueError(f"{len(wanted)} archived seasons requested; SQLite attaches at most {limit} at once.")
+    for season in wanted:
+        if not os.path.exists(archives[season]):
+            raise FileNotFoundError(f"Archive for season {season} not found at {archives[season]}")
+
+    schemas = []
+    try:
+        for season in wanted:
+            schema = f"season_{season}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (archives[season],))
+            schemas.append(schema)
+        # The main database is read through its views, which name what its tables hold as ids
+        for view, main_view, table, columns in (
+            ("all_games", "game_details", "games", GAME_COLUMNS),
+            ("all_season_summary", "season_summary_details", "season_summary", SUMMARY_COLUMNS),
+        ):
+            selects = [
+                f"SELECT {', '.join(columns)} FROM main.{main_view}",
+                *(f"SELECT {', '.join(columns)} FROM {schema}.{table}" for schema in schemas),
+            ]
+            conn.execute(f"CREATE TEMP VIEW {view} AS {' UNION ALL '.join(selects)}")
+        yield conn
+    finally:
+        conn.execute("DROP VIEW IF EXISTS temp.all_games")
+        conn.execute("DROP VIEW IF EXISTS temp.all_season_summary")
+        for schema in schemas:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+
+def season_history(conn, seasons=None):
+    """Totals per (season, league) across the main database and the archives of `seasons`."""
+    seasons = sorted(set(map(int, seasons))) if seasons else None
+    where, params = "", ()
+    if seasons:
+        where, params = f"WHERE season IN ({', '.join('?' * len(seasons))})", seasons
+    with attached(conn, seasons) as attached_conn:
+        return attached_conn.execute(HISTORY_SQL.format(where=where), params).fetchall()
@@ -1,9 +1,54 @@
+import configparser
+import json
+import os
 import pytest
 import sqlite3
-from classes import Game, DatabaseHandler
+import subprocess
+import sys
+import threading
+import time
+from datetime import date
+import tracemalloc
+from classes import (
+    INSERT_GAME_SQL,
+    UPSERT_SITE_MILEAGE_SQL,
+    ConnectionManager,
+    Game,
+    GameBatch,
+    DatabaseHandler,
+    DistanceCache,
+    SiteMileageCache,
+    configure_metrics,
+    season_bounds,
+)
+import benchmarks
+import analytics
+import cli
+import csv
+import export
+import gzip
+from itertools import permutations
+import random
+import numpy as np
+import geodesic
+from distances import TokenBucket, element_to_miles, resolve_distances_concurrently
+import functions
+import importer
+import leagues
+import migrations
+import partitions
+from metrics import MAX_STATEMENTS, OTHER_STATEMENTS, metrics
+import sites
+import trips
+import writebehind
 
 # Configuring a test database
 TEST_DB = "test_officiating.db"
+# Importing the application modules must stay well under this many seconds
+IMPORT_TIME_BUDGET = 0.25
+# Games as stored before version 11 replaced the site, league and assignor names with ids
+LEGACY_INSERT_GAME_SQL = """ INSERT INTO games(date, site, league, assignor, game_fee, fee_paid, is_volunteer, mileage)
+                             VALUES(?,?,?,?,?,?,?,?) """
 
 
 def test_game_creation_with_defaults():
@@ -100,3 +145,1491 @@ def test_add_game(db_handler, setup_test_db):
     conn.close()
     assert game is not None
     assert game[1] == "Test Park"  # Adjust index based on your table structure
+
+
+class FakeDistanceClient:
+    """Offline stand-in for googlemaps.Client that answers distance_matrix from a lookup table."""
+
+    def __init__(self, miles_by_address, latency=0.0, failures=(), coordinates_by_address=None):
+        self.miles_by_address = miles_by_address
+        self.coordinates_by_address = coordinates_by_address or {}
+        self.latency = latency
+        # Exceptions to raise, or top-level statuses to return, on the first calls
+        self.failures = list(failures)
+        self.calls = []
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def distance_matrix(self, origins, destinations, mode="driving"):
+        if isinstance(destinations, str):
+            destinations = [destinations]
+        with self._lock:
+            self.calls.append(list(destinations))
+            failure = self.failures.pop(0) if self.failures else None
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is not None:
+            return {"status": failure, "rows": []}
+        elements = []
+        for address in destinations:
+            # Keys are destination addresses, or (origin, destination) for origin-specific distances
+            miles = self.miles_by_address.get((origins, address), self.miles_by_address.get(address))
+            if miles is None:
+                elements.append({"status": "NOT_FOUND"})
+            else:
+                elements.append({"status": "OK", "distance": {"text": f"{miles} mi", "value": round(miles * 1609.344)}})
+        return {"status": "OK", "rows": [{"elements": elements}]}
+
+    def geocode(self, address):
+        if address not in self.coordinates_by_address:
+            return []
+        lat, lng = self.coordinates_by_address[address]
+        return [{"geometry": {"location": {"lat": lat, "lng": lng}}}]
+
+
+@pytest.fixture
+def make_handler(tmp_path):
+    """Return a factory for initialized DatabaseHandlers on files in tmp_path, answered by a fake client."""
+
+    def make(name, client=None, api_key=None):
+        handler = DatabaseHandler(
+            str(tmp_path / name), api_key=api_key, gmaps=FakeDistanceClient({}) if client is None else client
+        )
+        handler.initialize_database()
+        return handler
+
+    return make
+
+
+@pytest.fixture
+def fake_sites():
+    """Sixty fake ballfields, one of which has no route."""
+    site_dict = {f"Field {n}": f"{n} Diamond Way" for n in range(60)}
+    miles_by_address = {address: float(n) + 0.5 for n, address in enumerate(site_dict.values()) if n != 7}
+    return site_dict, miles_by_address
+
+
+def test_populate_site_distances_batches_requests(make_handler, fake_sites):
+    """Sites are resolved 25 destinations per request and stored together."""
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address)
+    handler = make_handler("batch.db", client)
+
+    handler.populate_site_distances(default_from="Home Plate", site_dict=site_dict)
+
+    assert sorted((len(call) for call in client.calls), reverse=True) == [25, 25, 10]
+    assert handler.get_site_mileage("Field 42") == 42.5
+    assert handler.get_site_mileage("Field 7") is None
+    assert len(handler.fetch_existing_sites()) == 59
+
+
+def test_add_new_sites_mileages_only_requests_new_sites(make_handler, fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address)
+    handler = make_handler("new_sites.db", client)
+    handler.update_or_add_site("Field 0", 0.5)
+
+    handler.add_new_sites_mileages(site_dict, "Home Plate")
+
+    assert sum(len(call) for call in client.calls) == 59
+    assert all(site_dict["Field 0"] not in call for call in client.calls)
+    assert handler.get_site_mileage("Field 59") == 59.5
+
+
+def test_concurrent_resolution_overlaps_requests_within_limits(fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address, latency=0.05)
+
+    distances, errors = resolve_distances_concurrently(
+        client, "Home Plate", site_dict, batch_size=1, max_workers=6, requests_per_second=500
+    )
+
+    assert len(client.calls) == 60
+    # Requests overlap, but never more than max_workers at once
+    assert 1 < client.max_in_flight <= 6
+    assert distances["Field 42"] == 42.5
+    assert set(errors) == {"Field 7"}
+
+
+def test_concurrent_resolution_retries_transient_failures(fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(
+        miles_by_address, failures=[TimeoutError("read timed out"), "OVER_QUERY_LIMIT", ConnectionError("reset")]
+    )
+
+    distances, errors = resolve_distances_concurrently(
+        client, "Home Plate", site_dict, max_workers=1, requests_per_second=1000, base_delay=0.001
+    )
+
+    assert len(client.calls) == 3 + 3
+    assert len(distances) == 59
+    assert set(errors) == {"Field 7"}
+
+
+def test_concurrent_resolution_captures_errors_per_site(fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address, failures=["REQUEST_DENIED"] + ["OVER_QUERY_LIMIT"] * 3)
+
+    distances, errors = resolve_distances_concurrently(
+        client, "Home Plate", site_dict, max_workers=1, requests_per_second=1000, max_retries=2, base_delay=0.001
+    )
+
+    # The first batch is rejected outright; the second gives up after two retries
+    assert errors["Field 0"] == "REQUEST_DENIED"
+    assert errors["Field 25"].endswith("OVER_QUERY_LIMIT")
+    assert len(errors) == 50 and "Field 7" in errors
+    assert sorted(distances) == sorted(f"Field {n}" for n in range(50, 60))
+
+
+def test_concurrent_resolution_does_not_swallow_programming_errors(fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address, failures=[TypeError("bad argument")])
+
+    with pytest.raises(TypeError):
+        resolve_distances_concurrently(client, "Home Plate", site_dict, max_workers=1, requests_per_second=1000)
+
+
+def test_token_bucket_paces_acquisitions():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, capacity=1, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        bucket.acquire()
+    assert now[0] == pytest.approx(2.0)
+
+
+def test_coordinate_index_matches_known_great_circle_distance():
+    index = geodesic.CoordinateIndex({"Memphis": (35.1495, -90.0490), "Nashville": (36.1627, -86.7816)})
+    miles = dict(zip(index.names, index.great_circle_miles((36.1627, -86.7816))))
+    assert miles["Memphis"] == pytest.approx(196.5, rel=0.01)
+    assert miles["Nashville"] == pytest.approx(0.0, abs=1e-6)
+    assert index.within((36.1627, -86.7816), 50) == ["Nashville"]
+    assert index.estimate((36.1627, -86.7816), road_factor=1.0)["Memphis"] == round(miles["Memphis"], 1)
+
+
+def test_coordinate_index_estimates_thousands_of_sites():
+    coordinates = {f"Field {n}": (35 + (n % 100) / 50, -88 + (n // 100) / 20) for n in range(5000)}
+    index = geodesic.CoordinateIndex(coordinates)
+
+    estimates = index.estimate((36.0, -87.0), road_factor=1.3)
+
+    assert len(estimates) == 5000
+    # Field 2050 sits on the origin
+    assert estimates["Field 2050"] == 0.0
+    assert all(miles > 0 for name, miles in estimates.items() if name != "Field 2050")
+
+
+def test_offline_mileage_falls_back_to_coordinates(make_handler):
+    site_dict = {"North Field": "1 North Rd"}
+    client = FakeDistanceClient(
+        {"1 North Rd": 12.0},
+        failures=[ConnectionError("network unreachable")],
+        coordinates_by_address={"Home Plate": (36.0, -87.0), "1 North Rd": (36.1, -87.0)},
+    )
+    handler = make_handler("offline.db", client)
+    assert handler.geocode_sites(site_dict) == 1
+    assert handler.geocode_sites(site_dict) == 0
+
+    mileage = Game.calculate_distance_for_site(None, "Home Plate", "North Field", site_dict, handler)
+
+    # 0.1 degree of latitude is about 6.9 miles in a straight line
+    assert mileage == pytest.approx(6.9 * geodesic.DEFAULT_ROAD_FACTOR, abs=0.1)
+    assert Game.calculate_distance_for_site(None, "Home Plate", "North Field", site_dict, handler) == 12.0
+
+
+def test_estimated_mileage_is_used_for_the_game_only(make_handler, fake_leagues, monkeypatch):
+    monkeypatch.setattr("classes.get_default_from", lambda: "Home Plate")
+    client = FakeDistanceClient(
+        {"1 North Rd": 12.0},
+        failures=[ConnectionError("network unreachable")],
+        coordinates_by_address={"Home Plate": (36.0, -87.0), "1 North Rd": (36.1, -87.0)},
+    )
+    handler = make_handler("estimate.db", client, api_key="test")
+    handler.geocode_sites()
+
+    offline = Game(site="North Field", league="NSA", db_handler=handler, date="2026-05-01")
+
+    assert offline.mileage == pytest.approx(6.9 * geodesic.DEFAULT_ROAD_FACTOR, abs=0.1)
+    # Not stored as the site's mileage, so the next game fetches the real distance
+    assert "North Field" in handler.fetch_sites_with_zero_mileage()
+    online = Game(site="North Field", league="NSA", db_handler=handler, date="2026-05-02")
+    assert online.mileage == handler.get_site_mileage("North Field") == 12.0
+
+
+def test_site_without_address_is_not_stored(make_handler, fake_leagues, monkeypatch):
+    monkeypatch.setattr("classes.get_default_from", lambda: "Home Plate")
+    client = FakeDistanceClient({})
+    handler = make_handler("no_address.db", client, api_key="test")
+
+    assert Game.calculate_distance_for_site(None, "Home Plate", "Nowhere Park", {}, handler) is None
+    game = Game(site="Nowhere Park", league="NSA", db_handler=handler, date="2026-05-01")
+
+    assert game.mileage == 0.0
+    assert handler.get_site_mileage("Nowhere Park") is None
+    assert client.calls == []
+
+
+def test_distance_cache_fetches_only_missing_pairs(make_handler, fake_sites):
+    site_dict, miles_by_address = fake_sites
+    client = FakeDistanceClient(miles_by_address)
+    handler = make_handler("distance_cache.db", client)
+    first_ten = dict(list(site_dict.items())[:10])
+
+    assert handler.site_mileages_from("Home", first_ten)["Field 3"] == 3.5
+    assert sum(len(call) for call in client.calls) == 10
+    # Cached pairs are reused; the 50 new sites and the unroutable Field 7 are requested
+    handler.site_mileages_from("Home", site_dict)
+    assert sum(len(call) for call in client.calls) == 10 + 51
+    client.calls.clear()
+    assert len(handler.site_mileages_from("Home", site_dict)) == 59
+    assert client.calls == [[site_dict["Field 7"]]]
+    # A new origin has its own entries
+    client.calls.clear()
+    handler.site_mileages_from("Work", first_ten)
+    assert sum(len(call) for call in client.calls) == 10
+
+    with handler.connection() as conn:
+        rows = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT destination, miles FROM distances "
+            "WHERE origin = ? AND mode = ? AND destination IN (?, ?)",
+            ("Home", "driving", "a", "b"),
+        ).fetchall()
+    plan = " ".join(row[-1] for row in rows)
+    assert "USING PRIMARY KEY" in plan
+
+
+def test_element_to_miles_reads_meters():
+    # The text is in the request's unit system; the value is always meters
+    element = {"status": "OK", "distance": {"text": "16.1 km", "value": 16093}}
+    assert element_to_miles(element) == 10.0
+    assert element_to_miles({"status": "ZERO_RESULTS"}) is None
+
+
+def test_distance_cache_expires_and_evicts_entries(make_handler, fresh_metrics):
+    client = FakeDistanceClient({f"{n} Diamond Way": float(n) for n in range(10)})
+    handler = make_handler("ttl.db", client)
+    handler.distance_cache = DistanceCache(handler.pool, ttl=3600, max_entries=8)
+    site_dict = {f"Field {n}": f"{n} Diamond Way" for n in range(5)}
+
+    statements = []
+    with handler.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    handler.site_mileages_from("Home", site_dict)
+    handler.site_mileages_from("Home", site_dict)
+    assert sum(len(call) for call in client.calls) == 5
+    # Under max_entries a put only counts, on the fetched_at index, and evicts nothing
+    assert any("COUNT(1) FROM distances" in sql for sql in statements)
+    assert not [sql for sql in statements if sql.lstrip().startswith("DELETE")]
+    with handler.connection() as conn:
+        conn.set_trace_callback(None)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT origin FROM distances ORDER BY fetched_at LIMIT 1").fetchall()
+    assert "idx_distances_fetched_at" in plan[-1][-1]
+    # An entry past the TTL is fetched again
+    with handler.connection() as conn:
+        stale = "UPDATE distances SET fetched_at = datetime('now', ?) WHERE destination = '0 Diamond Way'"
+        conn.execute(stale, ("-2 hours",))
+    client.calls.clear()
+    assert handler.site_mileages_from("Home", site_dict)["Field 0"] == 0.0
+    assert client.calls == [["0 Diamond Way"]]
+    assert metrics.snapshot()["distance_cache"] == {"hits": 9, "misses": 6, "expired": 1, "evicted": 0}
+
+    # Past max_entries the oldest measurements go first
+    with handler.connection() as conn:
+        older = "UPDATE distances SET fetched_at = datetime('now', ?) WHERE destination != '0 Diamond Way'"
+        conn.execute(older, ("-1 hour",))
+    handler.site_mileages_from("Work", {f"Field {n}": f"{n} Diamond Way" for n in range(5, 9)})
+    with handler.connection() as conn:
+        kept = conn.execute("SELECT origin, destination FROM distances WHERE origin = 'Home' ORDER BY 2").fetchall()
+        assert conn.execute("SELECT COUNT(1) FROM distances").fetchone() == (8,)
+    assert ("Home", "0 Diamond Way") in kept and len(kept) == 4
+    assert metrics.snapshot()["distance_cache"]["evicted"] == 1
+
+
+def test_game_with_origin_uses_distance_cache(make_handler, fake_leagues):
+    client = FakeDistanceClient({"1 North Rd": 8.0})
+    handler = make_handler("origin.db", client)
+
+    game = Game(site="North Field", league="NSA", db_handler=handler, date="2026-05-01", origin="Office")
+    again = Game(site="North Field", league="NSA", db_handler=handler, date="2026-05-02", origin="Office")
+
+    assert game.mileage == again.mileage == 8.0
+    assert len(client.calls) == 1
+    # The default-origin mileage in the sites table is left alone
+    assert handler.get_site_mileage("North Field") is None
+
+
+def test_connection_manager_reuses_connection_per_thread(tmp_path):
+    manager = ConnectionManager.for_file(str(tmp_path / "pool.db"))
+    assert ConnectionManager.for_file(str(tmp_path / "pool.db")) is manager
+    assert manager.get() is manager.get()
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(manager.get()))
+    thread.start()
+    thread.join()
+    assert other[0] is not manager.get()
+    manager.close()
+
+
+def test_connection_manager_commits_outermost_block_only(tmp_path):
+    manager = ConnectionManager.for_file(str(tmp_path / "tx.db"))
+    with manager.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+
+    with pytest.raises(RuntimeError), manager.connection() as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+        with manager.connection() as inner:
+            inner.execute("INSERT INTO t VALUES (2)")
+        raise RuntimeError("abort the outer unit of work")
+
+    with manager.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    manager.close()
+
+
+def test_site_mileage_lookups_are_served_from_cache(make_handler, fake_sites):
+    site_dict, miles_by_address = fake_sites
+    handler = make_handler("cache.db", FakeDistanceClient(miles_by_address))
+    handler.populate_site_distances(default_from="Home Plate", site_dict=site_dict)
+    assert handler.get_site_mileage("Field 1") == 1.5
+
+    statements = []
+    handler.pool.get().set_trace_callback(statements.append)
+    for n in range(60):
+        handler.get_site_mileage(f"Field {n}")
+    handler.pool.get().set_trace_callback(None)
+    assert not any("FROM sites" in sql for sql in statements)
+
+    handler.update_or_add_site("Field 1", 99.0)
+    assert handler.get_site_mileage("Field 1") == 99.0
+
+
+def test_site_mileage_cache_sees_other_connections_writes(make_handler):
+    handler = make_handler("shared.db")
+    db_path = handler.db_file
+    handler.update_or_add_site("Field 1", 5.0)
+    cache = SiteMileageCache.for_file(db_path)
+    cache.check_interval = 0
+    assert handler.get_site_mileage("Field 1") == 5.0
+
+    other = sqlite3.connect(db_path)
+    other.execute("UPDATE sites SET mileage = 6.5 WHERE name = 'Field 1'")
+    other.commit()
+    other.close()
+    assert handler.get_site_mileage("Field 1") == 6.5
+
+
+def test_site_mileage_cache_get_survives_concurrent_invalidate(make_handler, monkeypatch):
+    handler = make_handler("invalidate.db")
+    handler.update_or_add_site("Field 1", 5.0)
+    cache = SiteMileageCache(handler.pool, check_interval=0)
+    cache.load()
+    data_version = cache._data_version
+
+    def invalidated_meanwhile(conn):
+        # Another thread invalidates between the staleness check and the read
+        cache.invalidate()
+        return data_version(conn)
+
+    monkeypatch.setattr(cache, "_data_version", invalidated_meanwhile)
+    assert cache.get("Field 1") == 5.0
+
+
+def test_import_is_lazy_and_within_budget(tmp_path):
+    """Importing the app reads no config, opens no database and loads no API/report libraries."""
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import classes, functions\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(elapsed, 'googlemaps' in sys.modules, 'prettytable' in sys.modules, 'numpy' in sys.modules)\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    )
+    elapsed, loaded_googlemaps, loaded_prettytable, loaded_numpy = result.stdout.split()
+    assert float(elapsed) < IMPORT_TIME_BUDGET
+    assert loaded_googlemaps == loaded_prettytable == loaded_numpy == "False"
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.fixture
+def fake_leagues(monkeypatch):
+    """Replace the local site and league tables with a small known set."""
+    monkeypatch.setattr(sites, "ballfields", {"North Field": "1 North Rd", "South Field": "2 South Rd"})
+    monkeypatch.setattr(leagues, "game_rates", {"NSA": 45, "HS": 80})
+    monkeypatch.setattr(leagues, "game_assignors", {"NSA": "Smith", "HS": "Brown"})
+
+
+def test_import_schedule_csv_reports_bad_rows(make_handler, tmp_path, fake_leagues):
+    handler = make_handler("import.db")
+    handler.update_or_add_site("North Field", 12.5)
+    schedule = tmp_path / "schedule.csv"
+    schedule.write_text(
+        "date,site,league,fee_paid\n"
+        "2026-05-01,North Field,NSA,yes\n"
+        "2026-05-02,Nowhere Park,NSA,\n"
+        "05/03/2026,South Field,HS,\n"
+        "2026-05-04,North Field,Pickup,\n"
+    )
+
+    report = importer.import_schedule(handler.db_file, schedule, chunk_size=1, db_handler=handler)
+
+    assert report.inserted == 2
+    assert [line for line, _ in report.errors] == [3, 5]
+    with handler.connection() as conn:
+        sql = "SELECT date, site, assignor, game_fee, fee_paid, mileage FROM game_details ORDER BY id"
+        rows = conn.execute(sql).fetchall()
+    assert rows == [
+        ("2026-05-01", "North Field", "Smith", 45, 1, 12.5),
+        ("2026-05-03", "South Field", "Brown", 80, 0, 0),
+    ]
+
+
+def test_import_schedule_ics(make_handler, tmp_path, fake_leagues):
+    handler = make_handler("import_ics.db")
+    schedule = tmp_path / "schedule.ics"
+    schedule.write_text(
+        "BEGIN:VCALENDAR\r\n"
+        "BEGIN:VEVENT\r\n"
+        "DTSTART;TZID=America/Chicago:20260601T180000\r\n"
+        "LOCATION:South\r\n"
+        "  Field\r\n"
+        "CATEGORIES:HS\r\n"
+        "END:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+
+    report = importer.import_schedule(handler.db_file, schedule, db_handler=handler)
+
+    assert report.inserted == 1 and not report.errors
+    with handler.connection() as conn:
+        row = conn.execute("SELECT date, site, league FROM game_details").fetchone()
+        assert row == ("2026-06-01", "South Field", "HS")
+
+
+def test_game_without_handler_does_no_io(fake_leagues):
+    game = Game("North Field", "NSA", date="2026-05-01")
+
+    assert not hasattr(game, "__dict__")
+    assert (game.assignor, game.game_fee, game.mileage) == ("Smith", 45, 0.0)
+    assert Game("North Field", "NSA", mileage=12.0).as_row()[-1] == 12.0
+
+
+def test_game_batch_resolves_each_site_once(make_handler, fake_leagues, monkeypatch):
+    handler = make_handler("batch_games.db", FakeDistanceClient({"2 South Rd": 7.5}))
+    handler.update_or_add_site("North Field", 12.5)
+    lookups = []
+    get_site_mileage = handler.get_site_mileage
+    monkeypatch.setattr(handler, "get_site_mileage", lambda site: lookups.append(site) or get_site_mileage(site))
+    batch = GameBatch()
+    for n in range(100_000):
+        batch.append(("North Field", "South Field")[n % 2], ("NSA", "HS")[n % 3 == 0], f"2026-05-{n % 28 + 1:02d}")
+    with pytest.raises(ValueError):
+        next(batch.rows())
+
+    monkeypatch.setattr("classes.get_default_from", lambda: "1 Home St")
+    batch.resolve(handler, fetch_missing=True)
+    with handler.connection() as conn:
+        assert batch.insert(conn) == 100_000
+        totals = conn.execute(
+            "SELECT site, league, assignor, game_fee, mileage, COUNT(1) FROM game_details GROUP BY 1, 2 ORDER BY 1, 2"
+        ).fetchall()
+
+    assert sorted(lookups) == ["North Field", "South Field"]
+    assert len(handler.gmaps.calls) == 1
+    assert totals == [
+        ("North Field", "HS", "Brown", 80, 12.5, 16667),
+        ("North Field", "NSA", "Smith", 45, 12.5, 33333),
+        ("South Field", "HS", "Brown", 80, 7.5, 16667),
+        ("South Field", "NSA", "Smith", 45, 7.5, 33333),
+    ]
+    first = next(batch.games())
+    assert (first.site, first.league, first.date, first.mileage) == ("North Field", "HS", "2026-05-01", 12.5)
+
+
+def test_game_batch_from_origin_leaves_sites_untouched(make_handler, fake_leagues):
+    client = FakeDistanceClient({("Office", "1 North Rd"): 100.0, ("Office", "2 South Rd"): 70.0})
+    handler = make_handler("batch_origin.db", client)
+    handler.update_or_add_site("North Field", 12.5)
+    with handler.connection() as conn:
+        stored = conn.execute("SELECT name, mileage FROM sites ORDER BY name").fetchall()
+    batch = GameBatch()
+    for n in range(10):
+        batch.append(("North Field", "South Field")[n % 2], "NSA", "2026-05-01")
+
+    batch.resolve(handler, fetch_missing=True, origin="Office")
+
+    assert [game.mileage for game in batch.games()] == [100.0, 70.0] * 5
+    with handler.connection() as conn:
+        assert conn.execute("SELECT name, mileage FROM sites ORDER BY name").fetchall() == stored
+
+
+def test_legacy_game_dates_are_normalized(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / "dates.db"), gmaps=FakeDistanceClient({}))
+    handler.create_games_table()
+    with handler.connection() as conn:
+        conn.executemany("INSERT INTO games (date) VALUES (?)", [("260501",), ("20260502",), ("2026-05-03",)])
+
+    handler.initialize_database()
+
+    with handler.connection() as conn:
+        dates = [row[0] for row in conn.execute("SELECT date FROM games ORDER BY id")]
+    assert dates == ["2026-05-01", "2026-05-02", "2026-05-03"]
+
+
+@pytest.mark.parametrize("sql", [functions.LEDGER_PAGE_SQL, functions.UNPAID_PAGE_SQL])
+def test_season_reports_use_index_range_scans(make_handler, sql):
+    handler = make_handler("plans.db")
+    season_start, season_end = season_bounds(2026)
+    params = (season_start, season_end, season_start, 0, functions.LEDGER_PAGE_SIZE)
+    with handler.connection() as conn:
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+    assert "SEARCH games USING" in plan
+    assert "SCAN games" not in plan
+
+
+def test_migrate_legacy_database_in_place(tmp_path):
+    """A pre-migration database keeps its data and ends up at the latest schema."""
+    db_path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(db_path)
+    legacy.executescript(
+        """
+        CREATE TABLE games (id INTEGER PRIMARY KEY, date TEXT, site TEXT, league TEXT, assignor TEXT,
+            game_fee INTEGER, fee_paid BOOLEAN, is_volunteer BOOLEAN, mileage FLOAT);
+        CREATE TABLE sites (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, mileage INTEGER DEFAULT 0.0);
+        """
+    )
+    legacy.executemany(
+        LEGACY_INSERT_GAME_SQL,
+        ((f"2{n % 5}0{n % 9 + 1}1{n % 10}", "North Field", "NSA", "Smith", 45, n % 2, 0, 12.5) for n in range(200_000)),
+    )
+    legacy.execute("INSERT INTO sites (name, mileage) VALUES ('North Field', '12.5')")
+    legacy.commit()
+    legacy.close()
+
+    handler = DatabaseHandler(db_path, gmaps=FakeDistanceClient({}))
+    assert handler.migrate() == [version for version, _, _ in migrations.MIGRATIONS]
+
+    assert handler.schema_version() == migrations.LATEST_VERSION
+    with handler.connection() as conn:
+        assert conn.execute("SELECT COUNT(*), SUM(fee_paid) FROM games").fetchone() == (200_000, 100_000)
+        assert conn.execute("SELECT date FROM games WHERE id = 1").fetchone() == ("2020-01-10",)
+        assert conn.execute("SELECT typeof(mileage) FROM sites").fetchone() == ("real",)
+        names = conn.execute("SELECT site, league, assignor FROM game_details WHERE id = 1").fetchone()
+        assert names == ("North Field", "NSA", "Smith")
+        assert conn.execute("SELECT COUNT(1), MIN(site_id), MAX(site_id) FROM games").fetchone() == (200_000, 1, 1)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_games_date", "idx_games_unpaid"} <= indexes
+    assert handler.migrate() == []
+
+
+def test_unpaid_index_becomes_partial_in_version_8(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / "unpaid.db"), gmaps=FakeDistanceClient({}))
+    unpaid_sql = "SELECT sql FROM sqlite_master WHERE name = 'idx_games_unpaid'"
+
+    handler.migrate(target=7)
+    with handler.connection() as conn:
+        assert conn.execute(unpaid_sql).fetchone()[0].endswith("ON games (fee_paid, date)")
+    handler.migrate(target=8)
+    with handler.connection() as conn:
+        assert conn.execute(unpaid_sql).fetchone()[0].endswith("ON games (date) WHERE fee_paid = 0")
+
+
+def test_cli_upgrades_an_older_database_before_running(tmp_path, capsys):
+    db = str(tmp_path / "older.db")
+    DatabaseHandler(db, gmaps=FakeDistanceClient({})).migrate(target=10)
+    capsys.readouterr()
+
+    assert cli.main(["--db", db, "--format", "json", "summary", "--season", "2026"]) == 0
+    assert json.loads(capsys.readouterr().out)["rows"] == []
+    assert DatabaseHandler(db).schema_version() == migrations.LATEST_VERSION
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    handler = DatabaseHandler(str(tmp_path / "broken.db"), gmaps=FakeDistanceClient({}))
+    handler.migrate(target=1)
+
+    def broken_step(conn):
+        conn.execute("CREATE TABLE half_done (x INTEGER)")
+        raise sqlite3.OperationalError("step failed")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [migrations.MIGRATIONS[0], (2, "broken", broken_step)])
+    assert handler.migrate(target=2) == []
+    assert handler.schema_version() == 1
+    with handler.connection() as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+
+
+def test_season_summary_rollup_tracks_every_write(make_handler):
+    handler = make_handler("rollup.db")
+    games = [
+        ("2026-04-01", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+        ("2026-04-02", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+        ("2026-04-03", "South Field", "HS", "Brown", 80, 0, 0, 4.5),
+        ("2025-04-03", "South Field", "HS", "Brown", 80, 1, 0, 4.5),
+    ]
+    with handler.connection() as conn:
+        conn.executemany(INSERT_GAME_SQL, games)
+    handler.bulk_update_games_paid_status([1, 3], True)
+    with handler.connection() as conn:
+        conn.execute(
+            "UPDATE games SET league_id = (SELECT id FROM leagues WHERE name = 'HS'), "
+            "assignor_id = (SELECT id FROM assignors WHERE name = 'Brown'), game_fee = 80 WHERE id = 2"
+        )
+        conn.execute("DELETE FROM games WHERE id = 4")
+
+    assert handler.verify_season_summary() == []
+    with handler.connection() as conn:
+        summary = conn.execute(functions.SEASON_SUMMARY_SQL, (2026,)).fetchall()
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + functions.SEASON_SUMMARY_SQL, (2026,)))
+    assert summary == [("HS", 2, 80, 80, 14.5), ("NSA", 1, 0, 45, 10.0)]
+    assert "SEARCH season_summary" in plan
+
+
+def test_bulk_paid_status_handles_100k_ids_quickly(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / "bulk_paid.db"), gmaps=FakeDistanceClient({}))
+    # Load the games before the rollup exists; its migration then builds it in one pass
+    handler.migrate(4)
+    with handler.connection() as conn:
+        conn.executemany(
+            LEGACY_INSERT_GAME_SQL,
+            (
+                (f"{2024 + n % 3}-{1 + n % 12:02d}-{1 + n % 28:02d}", "North Field", "NSA", "Smith", 45, 0, 0, 9.5)
+                for n in range(150_000)
+            ),
+        )
+    handler.migrate()
+    # Far more IDs than SQLite will bind in one statement
+    game_ids = range(1, 100_001)
+
+    assert handler.bulk_update_games_paid_status(game_ids, True) == 100_000
+    assert len(handler.fetch_unpaid_game_ids()) == 50_000
+    assert handler.bulk_update_games_paid_status(game_ids, True) == 0
+    assert handler.verify_season_summary() == []
+
+
+def test_mark_games_paid_menu_reports_once(make_handler, monkeypatch, capsys):
+    handler = make_handler("paid_menu.db")
+    handler.pool.write_behind = False
+    seed_seasons(handler)
+    answers = iter(["2, 4", "y"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    capsys.readouterr()
+
+    functions.bulk_update_games_paid_status(handler)
+
+    assert capsys.readouterr().out.splitlines() == ["3 unpaid games.", "2 games marked as paid."]
+    assert handler.fetch_unpaid_game_ids() == [5]
+
+
+def test_update_paid_status_where_filters(make_handler):
+    handler = make_handler("paid_where.db")
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [
+                ("2026-04-01", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+                ("2026-06-01", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+                ("2026-04-01", "South Field", "HS", "Brown", 80, 0, 0, 4.5),
+            ],
+        )
+
+    with handler.connection() as conn:
+        schema = conn.execute("PRAGMA schema_version").fetchone()
+
+    assert handler.update_paid_status_where(True, assignor="Smith", before="2026-06-01") == 1
+    assert handler.fetch_unpaid_game_ids() == [2, 3]
+    assert handler.update_paid_status_where(True, league="hs", season=2026) == 1
+    assert handler.update_paid_status_where(False) == 2
+    assert handler.verify_season_summary() == []
+    with handler.connection() as conn:
+        # The triggers are suspended rather than dropped, so the schema never changes
+        assert conn.execute("PRAGMA schema_version").fetchone() == schema
+        assert conn.execute("SELECT COUNT(1) FROM trigger_suspensions").fetchone() == (0,)
+        # One game at a time, the triggers still keep the rollup and paid_on current
+        conn.execute("UPDATE games SET fee_paid = 1 WHERE id = 1")
+        assert conn.execute("SELECT paid_on IS NOT NULL FROM games WHERE id = 1").fetchone() == (1,)
+    assert handler.verify_season_summary() == []
+
+
+def test_games_reference_lookup_tables_by_id(make_handler, fake_leagues, capsys):
+    handler = make_handler("lookups.db")
+    db = handler.db_file
+    assert handler.sync_lookup_tables() == 6
+    assert handler.sync_lookup_tables() == 0
+    with handler.connection() as conn:
+        game_id = Game("South Field", "HS", date="2026-04-01", mileage=4.5).insert(conn)
+        # Names not in the lookup tables yet are added, whichever way a game is written
+        conn.execute(INSERT_GAME_SQL, ("2026-04-02", "West Field", "nsa", "Jones", 45, 0, 0, 7.0))
+        stored = conn.execute("SELECT typeof(site_id), typeof(league_id), typeof(assignor_id) FROM games").fetchall()
+        details = conn.execute("SELECT id, site, league, assignor FROM game_details ORDER BY id").fetchall()
+        sql, params = export.games_query(assignor="Jones")
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+    assert stored == [("integer", "integer", "integer")] * 2
+    assert details == [(game_id, "South Field", "HS", "Brown"), (game_id + 1, "West Field", "NSA", "Jones")]
+    assert "idx_games_assignor_date (assignor_id=?)" in plan
+    assert handler.update_paid_status_where(True, assignor="Jones") == 1
+    assert handler.verify_season_summary() == []
+    capsys.readouterr()
+    assert cli.main(["--db", db, "--format", "json", "summary", "--season", "2026"]) == 0
+    assert [(row["league"], row["games"]) for row in json.loads(capsys.readouterr().out)["rows"]] == [
+        ("HS", 1),
+        ("NSA", 1),
+    ]
+
+
+def test_verify_season_summary_reports_drift(make_handler):
+    handler = make_handler("drift.db")
+    with handler.connection() as conn:
+        conn.execute(INSERT_GAME_SQL, ("2026-04-01", "North Field", "NSA", "Smith", 45, 0, 0, 10.0))
+        conn.execute("UPDATE season_summary SET owed = 0")
+
+    assert handler.verify_season_summary() == [((2026, "NSA", "Smith"), (1, 45, 0, 10.0), (1, 0, 0, 10.0))]
+    handler.rebuild_season_summary()
+    assert handler.verify_season_summary() == []
+
+
+def test_ledger_keyset_pages(make_handler):
+    handler = make_handler("ledger.db")
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            ((f"2026-{n % 12 + 1:02d}-01", "North Field", "NSA", "Smith", 45, n % 3 == 0, 0, 0) for n in range(60)),
+        )
+        first_page = list(functions.iter_ledger_page(conn, 2026, page_size=25))
+        last = first_page[-1]
+        second_page = list(functions.iter_ledger_page(conn, 2026, (last[1], last[0]), page_size=25))
+        back_page = list(functions.iter_ledger_page(conn, 2026, (second_page[0][1], second_page[0][0]), True, 25))
+        unpaid = list(functions.iter_ledger_page(conn, 2026, page_size=100, unpaid_only=True))
+
+    assert len(first_page) == len(second_page) == 25
+    keys = [(row[1], row[0]) for row in first_page + second_page]
+    assert keys == sorted(keys) and len(set(keys)) == 50
+    assert back_page == first_page
+    assert len(unpaid) == 40
+
+
+def test_render_fixed_width_streams_rows():
+    rows = iter([(1, "2026-05-01", "NSA"), (22, "2026-05-02", "HS")])
+    lines = functions.render_fixed_width(["ID", "Date", "League"], [3, 10, 6], rows)
+    assert next(lines) == "ID  Date       League"
+    assert next(lines) == "--- ---------- ------"
+    assert list(lines) == ["1   2026-05-01 NSA   ", "22  2026-05-02 HS    "]
+
+
+def test_ledger_menu_switches_to_table_view(make_handler, monkeypatch, capsys):
+    handler = make_handler("ledger_menu.db")
+    season = functions.CURRENT_SEASON
+    with handler.connection() as conn:
+        conn.execute(INSERT_GAME_SQL, (f"{season}-05-01", "North Field", "NSA", "Smith", 45, 0, 0, 10.0))
+    answers = iter(["t", "x"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    capsys.readouterr()
+
+    functions.review_all_games(handler.db_file)
+
+    out = capsys.readouterr().out
+    assert "ID      Date       League     Paid Miles  " in out
+    # The same page again, now as a PrettyTable
+    assert f"| 1  | {season}-05-01 |" in out and out.count(f"{season}-05-01") == 2
+
+
+def test_benchmark_suite_and_regression_check(tmp_path, fake_leagues):
+    report = benchmarks.run_suite([200], repeat=1, workdir=tmp_path)
+
+    results = report["results"]["200"]
+    assert {"add_game_to_db_x100", "display_season_summary", "fetch_unpaid_game_ids"} <= results.keys()
+    assert all(seconds >= 0 for seconds in results.values())
+
+    slower = {"meta": {}, "results": {"200": {name: seconds * 2 + 1 for name, seconds in results.items()}}}
+    assert benchmarks.compare(report, report) == []
+    assert {name for _, name, _, _ in benchmarks.compare(report, slower)} == results.keys()
+
+
+@pytest.fixture
+def fresh_metrics():
+    metrics.reset()
+    yield metrics
+    metrics.configure(enabled=True, sample_rate=1.0)
+    metrics.reset()
+
+
+def test_metrics_record_queries_connections_and_api_calls(make_handler, fake_sites, fresh_metrics):
+    site_dict, miles_by_address = fake_sites
+    handler = make_handler("metrics.db", FakeDistanceClient(miles_by_address))
+    handler.populate_site_distances(default_from="Home Plate", site_dict=site_dict)
+    with handler.connection() as conn:
+        assert len(list(conn.execute("SELECT name FROM sites"))) == 59
+
+    snapshot = fresh_metrics.snapshot()
+    assert snapshot["connections"]["by_file"][handler.db_file] == 1
+    select_stats = snapshot["queries"]["SELECT name FROM sites"]
+    assert select_stats["count"] == 1 and select_stats["rows"] == 59 and select_stats["total_seconds"] > 0
+    assert snapshot["queries"][UPSERT_SITE_MILEAGE_SQL]["rows"] == 59
+    assert snapshot["api_calls"]["count"] == 3
+    assert snapshot["api_calls"]["elements"] == 60
+    assert snapshot["api_calls"]["statuses"] == {"OK": 3}
+    assert json.loads(fresh_metrics.to_json())["api_calls"]["count"] == 3
+
+
+def test_metrics_noop_mode_uses_plain_connections(make_handler, fresh_metrics):
+    fresh_metrics.configure(enabled=False)
+    handler = make_handler("noop.db")
+
+    assert type(handler.pool.get()) is sqlite3.Connection
+    assert isinstance(handler.gmaps, FakeDistanceClient)
+    assert fresh_metrics.snapshot()["queries"] == {}
+
+
+def test_metrics_config_sampling_and_bounded_statements(make_handler, fresh_metrics, monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_string("[metrics]\nsample_rate = 0\n")
+    monkeypatch.setattr("classes.get_config", lambda: config)
+    configure_metrics.cache_clear()
+    try:
+        handler = make_handler("sampled.db")
+    finally:
+        configure_metrics.cache_clear()
+    conn = handler.pool.get()
+
+    # Statements that are not sampled run on plain cursors
+    assert fresh_metrics.sample_rate == 0
+    assert type(conn.execute("SELECT 1")) is sqlite3.Cursor
+    assert fresh_metrics.snapshot()["queries"] == {}
+
+    fresh_metrics.configure(sample_rate=1.0)
+    for n in range(MAX_STATEMENTS + 50):
+        conn.execute(f"SELECT {n}").fetchall()
+    queries = fresh_metrics.snapshot()["queries"]
+    assert len(queries) == MAX_STATEMENTS + 1
+    assert queries[OTHER_STATEMENTS]["count"] == 50
+
+
+def test_metrics_sample_each_statement_once(make_handler, fresh_metrics):
+    conn = make_handler("sample_rate.db").pool.get()
+    fresh_metrics.configure(sample_rate=0.5)
+    fresh_metrics.reset()
+    random.seed(11)
+    for _ in range(10_000):
+        conn.execute("SELECT 1")
+        conn.cursor().execute("SELECT 2")
+
+    queries = fresh_metrics.snapshot()["queries"]
+    # Sampling twice would record about a quarter of the connection's statements
+    assert 4_700 < queries["SELECT 1"]["count"] < 5_300
+    assert 4_700 < queries["SELECT 2"]["count"] < 5_300
+
+
+def test_held_karp_matches_brute_force():
+    rng = random.Random(3)
+    for n in range(1, 8):
+        dist = [[0 if i == j else rng.randint(1, 50) for j in range(n + 1)] for i in range(n + 1)]
+        length, order = trips.held_karp(dist)
+        brute = min(trips.tour_length(p, dist) for p in permutations(range(1, n + 1)))
+        assert length == brute == trips.tour_length(order, dist)
+        assert sorted(order) == list(range(1, n + 1))
+
+
+def test_large_tours_use_two_opt_heuristic():
+    rng = random.Random(5)
+    points = [(rng.uniform(0, 30), rng.uniform(0, 30)) for _ in range(16)]
+    dist = [[((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5 for bx, by in points] for ax, ay in points]
+
+    length, order = trips.plan_tour(dist)
+
+    assert sorted(order) == list(range(1, 16))
+    assert length == pytest.approx(trips.tour_length(order, dist))
+    assert length <= trips.tour_length(trips.nearest_neighbor_tour(dist), dist)
+
+
+def test_plan_season_chains_same_day_sites(make_handler, fake_leagues):
+    client = FakeDistanceClient(
+        {
+            ("Home", "1 North Rd"): 10.0,
+            ("1 North Rd", "Home"): 10.0,
+            ("Home", "2 South Rd"): 12.0,
+            ("2 South Rd", "Home"): 12.0,
+            ("1 North Rd", "2 South Rd"): 3.0,
+            ("2 South Rd", "1 North Rd"): 3.0,
+        }
+    )
+    handler = make_handler("trips.db", client)
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [
+                ("2026-05-02", "South Field", "NSA", "Smith", 45, 0, 0, 12.0),
+                ("2026-05-02", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+                ("2026-05-02", "North Field", "HS", "Brown", 80, 0, 0, 10.0),
+                ("2026-05-09", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+                ("2025-05-02", "South Field", "NSA", "Smith", 45, 0, 0, 12.0),
+            ],
+        )
+
+    doubleheader, single = trips.plan_season(handler, 2026, origin="Home")
+
+    assert (doubleheader.games, doubleheader.recorded_miles) == (3, 32.0)
+    assert doubleheader.tour_miles == 25.0 and doubleheader.separate_miles == 44.0
+    assert doubleheader.savings == 19.0
+    assert single.tour_miles is single.separate_miles is None
+    assert len(client.calls) == 3
+    # A second pass is served entirely from the distance cache
+    client.calls.clear()
+    trips.plan_season(handler, 2026, origin="Home")
+    assert client.calls == []
+
+
+def test_plan_season_of_single_site_days_makes_no_matrix_calls(make_handler, fake_leagues):
+    client = FakeDistanceClient({"1 North Rd": 10.0, "2 South Rd": 12.0})
+    handler = make_handler("single_trips.db", client)
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [
+                ("2026-05-02", "North Field", "NSA", "Smith", 45, 0, 0, 10.0),
+                ("2026-05-02", "North Field", "HS", "Brown", 80, 0, 0, 10.0),
+                ("2026-05-09", "South Field", "NSA", "Smith", 45, 0, 0, 12.0),
+            ],
+        )
+
+    plans = trips.plan_season(handler, 2026, origin="Home")
+
+    assert [plan.games for plan in plans] == [2, 1]
+    assert client.calls == []
+
+
+def test_cli_batch_runs_commands_in_one_process(tmp_path, fake_leagues, fresh_metrics, capsys):
+    db = str(tmp_path / "cli.db")
+    schedule = tmp_path / "schedule.csv"
+    schedule.write_text(
+        "date,site,league\n2026-04-01,North Field,NSA\n2026-04-02,South Field,HS\n2026-04-03,Nowhere,NSA\n"
+    )
+    commands = tmp_path / "nightly.txt"
+    commands.write_text(
+        "migrate\n"
+        f"import {schedule}  # nightly schedule export\n"
+        "mark-paid --assignor Smith --before 2026-05-01\n"
+        "--format ndjson ledger --season 2026 --unpaid\n"
+        "summary --season 2026\n"
+    )
+
+    assert cli.main(["--db", db, "--format", "json", "batch", str(commands)]) == 0
+
+    lines = capsys.readouterr().out.splitlines()
+    results = [json.loads(line) for line in lines]
+    assert results[0]["command"] == "migrate" and results[0]["version"] == migrations.LATEST_VERSION
+    assert results[1]["inserted"] == 2 and results[1]["rows"] == [{"line": 4, "error": "Nowhere not recognized."}]
+    assert results[2] == {"command": "mark-paid", "paid": True, "updated": 1}
+    # NDJSON streams one game per line
+    assert results[3]["id"] == 2 and results[3]["fee_paid"] == 0
+    assert results[4]["rows"] == [
+        {"league": "HS", "games": 1, "owed": 80, "paid": 0, "mileage": 0.0},
+        {"league": "NSA", "games": 1, "owed": 0, "paid": 45, "mileage": 0.0},
+    ]
+    # Every command shared one pooled connection
+    assert fresh_metrics.snapshot()["connections"]["by_file"][db] == 1
+
+
+def test_cli_reports_failures_on_stderr(tmp_path, fake_leagues, capsys):
+    db = str(tmp_path / "cli_errors.db")
+
+    assert cli.main(["--db", db, "mark-paid"]) == 1
+    assert cli.main(["--db", db, "add", "--site", "Nowhere", "--league", "NSA"]) == 1
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "Nowhere not recognized." in captured.err
+
+
+def test_cli_reports_missing_config_and_clean_exits(tmp_path, fake_leagues, monkeypatch, capsys):
+    db = str(tmp_path / "cli_config.db")
+    monkeypatch.setattr("classes.get_config", configparser.ConfigParser)
+    commands = tmp_path / "help.txt"
+    commands.write_text("sites --help\nsites\n")
+
+    assert cli.main(["--db", db, "add", "--site", "North Field", "--league", "NSA"]) == 1
+    assert cli.main(["--db", db, "batch", str(commands)]) == 0
+
+    captured = capsys.readouterr()
+    assert "add: config.ini: No section: 'credentials'" in captured.err
+    assert "usage:" in captured.out
+
+
+def test_cli_write_commands_fail_on_a_locked_database(tmp_path, fake_leagues, monkeypatch, capsys):
+    db = str(tmp_path / "cli_locked.db")
+    monkeypatch.setattr("classes.get_busy_timeout", lambda: 0)
+    assert cli.main(["--db", db, "sites"]) == 0
+    other = sqlite3.connect(db, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    capsys.readouterr()
+
+    assert cli.main(["--db", db, "--format", "json", "mark-paid", "1", "2"]) == 1
+    assert cli.main(["--db", db, "--format", "json", "mark-paid", "--season", "2026"]) == 1
+    assert cli.main(["--db", db, "--format", "json", "sync"]) == 1
+
+    other.execute("ROLLBACK")
+    other.close()
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err.count("database is locked") == 3
+
+
+def seed_export_games(handler, count):
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            (
+                (
+                    f"2026-{1 + n % 12:02d}-{1 + n % 28:02d}",
+                    "North Field",
+                    ("NSA", "HS")[n % 2],
+                    "Smith",
+                    45,
+                    n % 3 == 0,
+                    0,
+                    9.5,
+                )
+                for n in range(count)
+            ),
+        )
+
+
+def test_export_games_to_csv_and_gzipped_ndjson(make_handler, tmp_path):
+    handler = make_handler("export.db")
+    seed_export_games(handler, 300)
+    conn = handler.create_connection()
+
+    csv_path = tmp_path / "games.csv"
+    assert export.export_table(conn, "games", csv_path, season=2026, league="hs", paid=False) == 100
+    with open(csv_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == list(export.GAME_COLUMNS)
+    assert len(rows) == 100
+    assert {(row["league"], row["fee_paid"]) for row in rows} == {("HS", "0")}
+    assert [row["date"] for row in rows] == sorted(row["date"] for row in rows)
+
+    ndjson_path = tmp_path / "games.ndjson.gz"
+    assert export.export_table(conn, "games", ndjson_path) == 300
+    with gzip.open(ndjson_path, "rt") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 300
+    assert set(records[0]) == set(export.GAME_COLUMNS)
+    assert sum(record["fee_paid"] for record in records) == 100
+    assert records[0]["mileage"] == 9.5
+
+
+def test_export_memory_stays_bounded(make_handler, tmp_path):
+    handler = make_handler("export_memory.db")
+    seed_export_games(handler, 50_000)
+    conn = handler.create_connection()
+
+    for name in ("games.csv", "games.ndjson"):
+        tracemalloc.start()
+        try:
+            assert export.export_table(conn, "games", tmp_path / name) == 50_000
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # A few fetch batches at most, never the whole table
+        assert peak < 8 * 1024 * 1024, name
+
+
+def test_cli_export_writes_to_stdout(make_handler, capfdbinary):
+    handler = make_handler("cli_export.db")
+    db = handler.db_file
+    seed_export_games(handler, 10)
+    capfdbinary.readouterr()
+
+    assert cli.main(["--db", db, "export", "games", "-", "--as", "ndjson", "--paid"]) == 0
+
+    captured = capfdbinary.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert len(records) == 4 and all(record["fee_paid"] == 1 for record in records)
+    assert b"4 rows exported from games." in captured.err
+
+
+def test_season_frame_totals_match_season_summary(make_handler, capsys):
+    handler = make_handler("analytics.db")
+    db = handler.db_file
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [
+                ("2026-04-04", "North Field", "NSA", "Smith", 45, 1, 0, 10.0),
+                ("2026-04-18", "South Field", "NSA", "Smith", 45, 0, 0, 20.0),
+                ("2026-05-02", "North Field", "HS", "Brown", 80, 0, 1, 10.0),
+                ("2026-05-09", "South Field", "HS", None, 80, 1, 0, 0.0),
+                ("2025-05-09", "South Field", "HS", "Brown", 80, 1, 0, 30.0),
+            ],
+        )
+        frame = analytics.SeasonFrame.load(conn, 2026)
+        summary = conn.execute(functions.SEASON_SUMMARY_SQL, (2026,)).fetchall()
+
+    totals = frame.totals("league", mileage_rate=0.5)
+    assert [(row["league"], row["games"], row["owed"], row["paid"], row["mileage"]) for row in totals] == summary
+    assert totals[0]["reimbursement"] == 5.0 and totals[0]["revenue_per_mile"] == 16.0
+    assert totals[0]["volunteer"] == 1
+    by_month = frame.totals(("month", "assignor"))
+    assert [(row["month"], row["assignor"], row["games"]) for row in by_month] == [
+        ("2026-04", "Smith", 2),
+        ("2026-05", "", 1),
+        ("2026-05", "Brown", 1),
+    ]
+    assert frame.totals(())[0]["fees"] == 250.0
+
+    capsys.readouterr()
+    assert cli.main(["--db", db, "--format", "json", "report", "totals", "--by", "site", "--season", "2026"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["games"] == 4
+    assert [(row["site"], row["games"]) for row in report["rows"]] == [("North Field", 2), ("South Field", 2)]
+
+
+def test_payment_lag_from_paid_on_dates(make_handler):
+    handler = make_handler("lag.db")
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [(f"2026-04-{day:02d}", "North Field", "NSA", "Smith", 45, 0, 0, 9.5) for day in (1, 2, 3, 4)]
+            + [("2026-04-01", "North Field", "HS", "Brown", 80, 0, 0, 9.5)],
+        )
+
+    # Marking games paid stamps today's date, set-wise or one game at a time
+    assert handler.bulk_update_games_paid_status([1, 2], True) == 2
+    with handler.connection() as conn:
+        conn.execute("UPDATE games SET fee_paid = 1 WHERE id = 3")
+        stamped = conn.execute("SELECT paid_on FROM games WHERE id <= 3").fetchall()
+        assert stamped == [(date.today().isoformat(),)] * 3
+        conn.execute("UPDATE games SET fee_paid = 0 WHERE id = 3")
+        assert conn.execute("SELECT paid_on FROM games WHERE id = 3").fetchone() == (None,)
+
+        conn.execute("UPDATE games SET paid_on = '2026-04-11' WHERE id = 1")
+        conn.execute("UPDATE games SET paid_on = '2026-04-22' WHERE id = 2")
+        frame = analytics.SeasonFrame.load(conn, 2026)
+
+    lag = frame.payment_lag("assignor", as_of="2026-04-30")
+    assert lag == [
+        {
+            "assignor": "Brown",
+            "paid_games": 0,
+            "mean_lag_days": None,
+            "median_lag_days": None,
+            "max_lag_days": None,
+            "outstanding": 1,
+            "outstanding_fees": 80.0,
+            "oldest_unpaid_days": 29,
+        },
+        {
+            "assignor": "Smith",
+            "paid_games": 2,
+            "mean_lag_days": 15.0,
+            "median_lag_days": 15.0,
+            "max_lag_days": 20,
+            "outstanding": 2,
+            "outstanding_fees": 90.0,
+            "oldest_unpaid_days": 27,
+        },
+    ]
+
+
+def test_season_frame_group_bys_scale_to_millions_of_games():
+    rng = np.random.default_rng(0)
+    n = 2_000_000
+    dates = np.datetime64("2026-01-01") + rng.integers(0, 365, n).astype("timedelta64[D]")
+    paid = rng.random(n) < 0.6
+    paid_on = np.where(paid, dates + rng.integers(0, 60, n).astype("timedelta64[D]"), np.datetime64("NaT"))
+    frame = analytics.SeasonFrame(
+        dates=dates,
+        fees=rng.choice([45.0, 80.0], n),
+        mileage=rng.uniform(1, 60, n),
+        paid=paid,
+        volunteer=rng.random(n) < 0.05,
+        paid_on=paid_on.astype("datetime64[D]"),
+        codes={
+            "league": rng.integers(0, 5, n).astype(np.int32),
+            "assignor": rng.integers(0, 20, n).astype(np.int32),
+            "site": rng.integers(0, 200, n).astype(np.int32),
+        },
+        labels={
+            "league": [f"L{i}" for i in range(5)],
+            "assignor": [f"A{i:02d}" for i in range(20)],
+            "site": [f"S{i:03d}" for i in range(200)],
+        },
+    )
+
+    by_site_month = frame.totals(("site", "month"))
+    by_assignor = frame.payment_lag("assignor", as_of="2027-01-01")
+
+    assert len(by_site_month) == 200 * 12
+    assert sum(row["games"] for row in by_site_month) == n
+    assert sum(row["paid_games"] + row["outstanding"] for row in by_assignor) == n
+    assert all(0 <= row["median_lag_days"] <= 59 for row in by_assignor)
+
+
+def seed_seasons(handler):
+    with handler.connection() as conn:
+        conn.executemany(
+            INSERT_GAME_SQL,
+            [
+                ("2024-05-01", "North Field", "NSA", "Smith", 45, 1, 0, 9.5),
+                ("2024-06-01", "South Field", "NSA", "Smith", 45, 0, 0, 12.0),
+                ("2024-07-01", "North Field", "HS", "Brown", 80, 1, 0, 9.5),
+                ("2025-05-01", "North Field", "NSA", "Smith", 45, 0, 0, 9.5),
+                ("2026-05-01", "North Field", "HS", "Brown", 80, 0, 0, 9.5),
+            ],
+        )
+
+
+def test_migrate_and_archive_write_through_the_writer(tmp_path, monkeypatch):
+    handler = DatabaseHandler(str(tmp_path / "single_writer.db"), gmaps=FakeDistanceClient({}))
+    writes = []
+    writer = handler.pool.writer
+
+    def counted_writer():
+        writes.append(threading.get_ident())
+        return writer()
+
+    monkeypatch.setattr(handler.pool, "writer", counted_writer)
+    assert handler.migrate() == [version for version, _, _ in migrations.MIGRATIONS]
+    assert len(writes) == migrations.LATEST_VERSION
+    seed_seasons(handler)
+    writes.clear()
+
+    assert handler.archive_season(2024) == 3
+    assert len(writes) == 1
+    assert not handler.pool._write_lock.locked()
+
+
+def test_archive_season_moves_games_to_partition_file(make_handler, tmp_path, capsys):
+    handler = make_handler("seasons.db")
+    db = handler.db_file
+    seed_seasons(handler)
+    conn = handler.create_connection()
+    history = partitions.season_history(conn)
+
+    assert partitions.archive_season(conn, 2024) == 3
+
+    assert partitions.archived_seasons(conn) == {2024: str(tmp_path / "seasons_2024.db")}
+    assert conn.execute("SELECT COUNT(1) FROM games WHERE date < '2025-01-01'").fetchone() == (0,)
+    assert conn.execute("SELECT COUNT(1) FROM season_summary WHERE season = 2024").fetchone() == (0,)
+    assert handler.verify_season_summary() == []
+    # Cross-season reports read the archive through the UNION ALL views, then detach it
+    assert partitions.season_history(conn) == history
+    assert "season_2024" not in [row[1] for row in conn.execute("PRAGMA database_list")]
+    with partitions.attached(conn, [2024]):
+        assert conn.execute("SELECT COUNT(1) FROM all_games").fetchone() == (5,)
+
+    # A game entered late for the archived season still counts, and archiving again merges it
+    with handler.connection():
+        conn.execute(INSERT_GAME_SQL, ("2024-08-01", "North Field", "HS", "Brown", 80, 0, 0, 9.5))
+    late_history = partitions.season_history(conn, [2024])
+    assert late_history[0][:3] == (2024, "HS", 2)
+    assert partitions.archive_season(conn, 2024) == 1
+    assert partitions.season_history(conn, [2024]) == late_history
+
+    with pytest.raises(ValueError):
+        partitions.archive_season(conn, date.today().year)
+
+    capsys.readouterr()
+    assert cli.main(["--db", db, "--format", "json", "summary", "--season", "2024"]) == 0
+    assert json.loads(capsys.readouterr().out)["rows"] == [
+        {"league": "HS", "games": 2, "owed": 80, "paid": 80, "mileage": 19.0},
+        {"league": "NSA", "games": 2, "owed": 45, "paid": 45, "mileage": 21.5},
+    ]
+
+
+def test_archive_season_rolls_back_both_files_on_error(make_handler, tmp_path):
+    handler = make_handler("atomic.db")
+    seed_seasons(handler)
+    conn = handler.create_connection()
+    archive_path = tmp_path / "atomic_2024.db"
+    # An archive already holding game 3 makes the copy fail part way through
+    with sqlite3.connect(archive_path) as archive:
+        for sql in partitions.ARCHIVE_TABLES_SQL:
+            archive.execute(sql.format(schema="main"))
+        archive.execute("INSERT INTO games (id, date) VALUES (3, '2024-12-31')")
+    archive.close()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        partitions.archive_season(conn, 2024, archive_path)
+
+    assert conn.execute("SELECT COUNT(1) FROM games WHERE date < '2025-01-01'").fetchone() == (3,)
+    assert conn.execute("SELECT COUNT(1) FROM partitions").fetchone() == (0,)
+    assert handler.verify_season_summary() == []
+    with sqlite3.connect(archive_path) as archive:
+        assert archive.execute("SELECT COUNT(1) FROM games").fetchone() == (1,)
+        assert archive.execute("SELECT COUNT(1) FROM season_summary").fetchone() == (0,)
+    archive.close()
+
+
+def stress_writer(db, writes):
+    """Add one to game 1's fee and insert a game, `writes` times, each in its own transaction."""
+    handler = DatabaseHandler(db, gmaps=FakeDistanceClient({}))
+    for _ in range(writes):
+        with handler.writer() as conn:
+            (fee,) = conn.execute("SELECT game_fee FROM games WHERE id = 1").fetchone()
+            conn.execute("UPDATE games SET game_fee = ? WHERE id = 1", (fee + 1,))
+            conn.execute(INSERT_GAME_SQL, ("2024-06-01", "South Field", "NSA", "Smith", 45, 0, 0, 12.0))
+    handler.pool.close()
+
+
+def stress_reader(db, reads):
+    """Return the reads that saw the games table and its rollup disagree."""
+    handler = DatabaseHandler(db, gmaps=FakeDistanceClient({}))
+    torn = []
+    for _ in range(reads):
+        with handler.connection() as conn:
+            # One statement reads one snapshot
+            row = conn.execute(
+                "SELECT (SELECT COUNT(1) FROM games), (SELECT SUM(games) FROM season_summary)"
+            ).fetchone()
+        if row[0] != row[1]:
+            torn.append(row)
+    handler.pool.close()
+    return torn
+
+
+def test_concurrent_processes_lose_no_updates(make_handler):
+    import multiprocessing
+
+    handler = make_handler("shared.db")
+    db = handler.db_file
+    seed_seasons(handler)
+    writers, readers, writes = 4, 2, 50
+
+    with multiprocessing.get_context("spawn").Pool(writers + readers) as pool:
+        reads = [pool.apply_async(stress_reader, (db, 200)) for _ in range(readers)]
+        for result in [pool.apply_async(stress_writer, (db, writes)) for _ in range(writers)]:
+            result.get(timeout=300)
+        assert [result.get(timeout=300) for result in reads] == [[]] * readers
+
+    conn = handler.create_connection()
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert conn.execute("SELECT game_fee FROM games WHERE id = 1").fetchone() == (45 + writers * writes,)
+    assert conn.execute("SELECT COUNT(1) FROM games").fetchone() == (5 + writers * writes,)
+    assert handler.verify_season_summary() == []
+
+
+def test_open_reader_does_not_block_writer(make_handler):
+    handler = make_handler("wal.db")
+    db = handler.db_file
+    seed_seasons(handler)
+    reader = sqlite3.connect(db, isolation_level=None)
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT COUNT(1) FROM games").fetchone() == (5,)
+
+    # No waiting for locks: if the reader blocked the writer, it would fail at once
+    handler.pool.busy_timeout = 0
+    errors = []
+
+    # Runs on another thread, so it has a connection of its own
+    def write():
+        try:
+            with handler.writer() as conn:
+                conn.execute(INSERT_GAME_SQL, ("2025-06-01", "North Field", "HS", "Brown", 80, 0, 0, 9.5))
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join()
+    assert errors == []
+    # The reader keeps its snapshot until it ends its transaction
+    assert reader.execute("SELECT COUNT(1) FROM games").fetchone() == (5,)
+    reader.execute("COMMIT")
+    assert reader.execute("SELECT COUNT(1) FROM games").fetchone() == (6,)
+    reader.close()
+
+
+def test_write_behind_group_commits_and_flushes(make_handler, monkeypatch):
+    handler = make_handler("write_behind.db")
+    db = handler.db_file
+    seed_seasons(handler)
+    batches = []
+    commit = writebehind.WriteBehindQueue._commit
+
+    def counted_commit(queue, batch):
+        commit(queue, batch)
+        batches.append(len(batch))
+
+    monkeypatch.setattr(writebehind.WriteBehindQueue, "_commit", counted_commit)
+    pool = ConnectionManager(db, write_behind=True)
+    reader = sqlite3.connect(db)
+
+    def insert(conn, fee):
+        game = ("2025-06-01", "North Field", "HS", "Brown", fee, 0, 0, 9.5)
+        conn.execute(INSERT_GAME_SQL, game)
+        return fee
+
+    def fail(conn):
+        raise sqlite3.IntegrityError("rejected")
+
+    futures = [pool.submit(insert, fee) for fee in range(100)]
+    failed = pool.submit(fail)
+    futures += [pool.submit(insert, fee) for fee in range(100, 200)]
+    pool.flush()
+
+    assert [future.result(timeout=0) for future in futures] == list(range(200))
+    # The failing write is rolled back alone; the writes around it are kept
+    with pytest.raises(sqlite3.IntegrityError):
+        failed.result()
+    assert reader.execute("SELECT COUNT(1), SUM(game_fee) FROM games WHERE date = '2025-06-01'").fetchone() == (
+        200,
+        sum(range(200)),
+    )
+    # Writes share commits: far fewer transactions than writes
+    assert sum(batches) == 202 and len(batches) < 20
+
+    # close() commits what is still queued before the connections go
+    late = [pool.submit(insert, 0) for _ in range(10)]
+    pool.close()
+    assert [future.result(timeout=0) for future in late] == [0] * 10
+    assert reader.execute("SELECT COUNT(1) FROM games WHERE date = '2025-06-01'").fetchone() == (210,)
+    assert handler.verify_season_summary() == []
+    reader.close()
+
+
+def test_write_behind_bug_fails_its_group_and_stops_the_thread(tmp_path, monkeypatch):
+    reported = []
+    monkeypatch.setattr(threading, "excepthook", reported.append)
+    pool = ConnectionManager(str(tmp_path / "write_behind_bug.db"), write_behind=True)
+
+    def broken(conn):
+        raise TypeError("not a database error")
+
+    future = pool.submit(broken)
+    with pytest.raises(TypeError):
+        future.result(timeout=10)
+    pool._write_behind_queue._thread.join(timeout=10)
+
+    assert [type(args.exc_value) for args in reported] == [TypeError]
+    with pytest.raises(RuntimeError):
+        pool.submit(broken)
+    pool.close()
+
+
+def test_writer_nested_in_connection_holds_the_lock_until_commit(tmp_path):
+    pool = ConnectionManager(str(tmp_path / "nested.db"))
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE t (n INTEGER)")
+
+    with pool.connection() as conn:
+        with pool.writer() as inner:
+            inner.execute("INSERT INTO t VALUES (1)")
+        assert conn.in_transaction and pool._write_lock.locked()
+    assert not pool._write_lock.locked()
+    with pool.writer() as conn:
+        assert conn.execute("SELECT n FROM t").fetchall() == [(1,)]
+    pool.close()
@@ -0,0 +1,183 @@
+"""Same-day trip chaining: tour mileage for game days at more than one site.
+
+Every game records the mileage of its own trip, so a doubleheader at two fields counts
+two round trips. The planner groups a season's games by date in a single pass, orders
+each day's sites into one tour (home -> A -> B -> home) and reports the tour mileage
+next to the separate round trips. Pairwise distances come from the distance cache, and
+only pairs missing from it are requested from the Distance Matrix API, all up front.
+
+Tours of up to HELD_KARP_MAX_SITES sites are solved exactly with Held-Karp; longer ones
+use a nearest-neighbor tour improved with 2-opt.
+"""
+
+from dataclasses import dataclass, field
+from itertools import combinations, groupby
+import math
+
+from classes import get_default_from, season_bounds
+import sites
+
+# Held-Karp is O(n^2 * 2^n); beyond this many sites in a day the heuristic is used
+HELD_KARP_MAX_SITES = 10
+
+HOME = 0
+
+
+def tour_length(order, dist):
+    """Length of the closed tour home -> order... -> home over the matrix `dist`."""
+    length, previous = 0.0, HOME
+    for node in order:
+        length += dist[previous][node]
+        previous = node
+    return length + dist[previous][HOME]
+
+
+def held_karp(dist):
+    """Exact shortest tour from home (node 0) through every other node and back.
+
+    Returns (length, order of the non-home nodes).
+    """
+    n = len(dist) - 1
+    if n == 0:
+        return 0.0, []
+    # best[(subset, last)] = (cost of visiting subset ending at last, previous node)
+    best = {(1 << (k - 1), k): (dist[HOME][k], HOME) for k in range(1, n + 1)}
+    for size in range(2, n + 1):
+        for subset_nodes in combinations(range(1, n + 1), size):
+            subset = sum(1 << (k - 1) for k in subset_nodes)
+            for last in subset_nodes:
+                without_last = subset & ~(1 << (last - 1))
+                best[(subset, last)] = min(
+                    (best[(without_last, k)][0] + dist[k][last], k) for k in subset_nodes if k != last
+                )
+    full = (1 << n) - 1
+    length, last = min((best[(full, k)][0] + dist[k][HOME], k) for k in range(1, n + 1))
+    order, subset = [], full
+    while last != HOME:
+        order.append(last)
+        subset, last = subset & ~(1 << (last - 1)), best[(subset, last)][1]
+    return length, order[::-1]
+
+
+def nearest_neighbor_tour(dist):
+    """Greedy tour from home, always driving to the closest unvisited site."""
+    unvisited = set(range(1, len(dist)))
+    order, current = [], HOME
+    while unvisited:
+        current = min(unvisited, key=lambda node: dist[current][node])
+        unvisited.remove(current)
+        order.append(current)
+    return order
+
+
+def two_opt(order, dist):
+    """Improve a tour by reversing segments until no reversal shortens it."""
+    best, best_length = list(order), tour_length(order, dist)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(best) - 1):
+            for j in range(i + 1, len(best)):
+                candidate = best[:i] + best[i : j + 1][::-1] + best[j + 1 :]
+                length = tour_length(candidate, dist)
+                if length < best_length - 1e-9:
+                    best, best_length, improved = candidate, length, True
+    return best_length, best
+
+
+def plan_tour(dist):
+    """Return (length, order) of the shortest tour found for a distance matrix with home at 0."""
+    if len(dist) - 1 <= HELD_KARP_MAX_SITES:
+        return held_karp(dist)
+    return two_opt(nearest_neighbor_tour(dist), dist)
+
+
+@dataclass
+class DayPlan:
+    """One game day: sites in tour order, the tour mileage and the separate round trips.
+
+    `tour_miles` and `separate_miles` are None for a single-site day, which has nothing to
+    plan, and when a needed distance is unknown.
+    """
+
+    date: str
+    sites: list = field(default_factory=list)
+    games: int = 0
+    recorded_miles: float = 0.0
+    tour_miles: float | None = None
+    separate_miles: float | None = None
+
+    @property
+    def savings(self):
+        if self.tour_miles is None or self.separate_miles is None:
+            return None
+        return self.separate_miles - self.tour_miles
+
+
+def iter_game_days(conn, season):
+    """Yield (date, [site per game], recorded mileage) for each game day of a season, in one query."""
+    season_start, season_end = season_bounds(season)
+    rows = conn.execute(
+        "SELECT date, site, mileage FROM game_details WHERE date >= ? AND date < ? ORDER BY date",
+        (season_start, season_end),
+    )
+    for game_date, day_rows in groupby(rows, key=lambda row: row[0]):
+        day_rows = list(day_rows)
+        yield game_date, [row[1] for row in day_rows], sum(row[2] or 0 for row in day_rows)
+
+
+def fetch_pair_distances(db_handler, pairs, mode="driving"):
+    """Resolve {(origin address, destination address)} to {pair: miles}, fetching only uncached pairs."""
+    by_origin = {}
+    for origin, destination in pairs:
+        by_origin.setdefault(origin, set()).add(destination)
+    distances = {}
+    for origin, destinations in by_origin.items():
+        resolved, errors = db_handler.distance_cache.resolve(
+            db_handler.gmaps, origin, {address: address for address in destinations}, mode=mode
+        )
+        for destination, error in errors.items():
+            print(f"Distance not found from {origin} to {destination} ({error})")
+        distances.update(((origin, destination), miles) for destination, miles in resolved.items())
+    return distances
+
+
+def plan_season(db_handler, season, origin=None, mode="driving", site_dict=None):
+    """Plan every game day of a season, returning a DayPlan per date in date order.
+
+    Games are read once; the distance pairs every multi-site day needs are collected and
+    resolved together before any tour is solved.
+    """
+    origin = origin or get_default_from()
+    site_dict = sites.ballfields if site_dict is None else site_dict
+    with db_handler.connection() as conn:
+        days = list(iter_game_days(conn, season))
+
+    plans, pairs = [], set()
+    for game_date, day_sites, recorded in days:
+        visits = list(dict.fromkeys(day_sites))
+        plans.append(DayPlan(game_date, visits, len(day_sites), recorded))
+        if len(visits) < 2:
+            continue
+        addresses = [site_dict.get(site) for site in visits]
+        if None in addresses:
+            continue
+        nodes = [origin, *addresses]
+        pairs.update((a, b) for a in nodes for b in nodes if a != b)
+
+    distances = fetch_pair_distances(db_handler, pairs, mode)
+
+    for plan in plans:
+        addresses = [site_dict.get(site) for site in plan.sites]
+        if len(addresses) < 2 or None in addresses:
+            continue
+        nodes = [origin, *addresses]
+        dist = [[0.0 if a == b else distances.get((a, b), math.inf) for b in nodes] for a in nodes]
+        separate = sum(dist[HOME][k] + dist[k][HOME] for k in range(1, len(nodes)))
+        length, order = plan_tour(dist)
+        if math.isinf(length) or math.isinf(separate):
+            continue
+        plan.sites = [plan.sites[k - 1] for k in order]
+        plan.tour_miles = round(length, 1)
+        plan.separate_miles = round(separate, 1)
+    return plans
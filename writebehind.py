@@ -0,0 +1,136 @@
+"""Write-behind: writes queued and committed in groups by a background thread.
+
+With write-behind on ([database] write_behind in config.ini), ConnectionManager.submit()
+queues each write instead of committing it on the spot. One thread per database drains
+the queue and commits up to `max_batch` writes in one transaction, or whatever arrived
+within `max_delay` seconds of the first, so a burst of writes pays for one fsync instead
+of one each. Every submission returns a concurrent.futures.Future that resolves once its
+transaction has committed, to the write's return value or its exception; each write runs
+under its own savepoint so one failing with a database error does not undo the rest of its
+group. Any other exception is a bug in the write: its whole group fails with it, and it
+stops the writer thread so it is reported rather than lost in the loop.
+"""
+
+import atexit
+from concurrent.futures import Future
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BATCH = 500
+# Seconds a write may wait for others to share its commit
+DEFAULT_MAX_DELAY = 0.05
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+
+def _barrier(conn):
+    """No-op write; once it commits, everything queued before it has too."""
+
+
+class WriteBehindQueue:
+    """Queue of writes for one ConnectionManager, committed in groups by a daemon thread."""
+
+    def __init__(self, pool, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"write-behind {pool.db_file}", daemon=True)
+        self._thread.start()
+        # Scripts that never call close() still get their queued writes committed
+        atexit.register(self.close)
+
+    def submit(self, operation, *args):
+        """Queue operation(conn, *args); returns a Future of its result once committed."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"The write-behind queue for {self.pool.db_file} is closed.")
+            self._queue.put((future, operation, args))
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until every write submitted so far has been committed or has failed."""
+        self.submit(_barrier).result(timeout)
+
+    def close(self):
+        """Commit the writes still queued and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _next_batch(self):
+        """Block for the next write, then take what follows it within max_delay; returns (batch, stop)."""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, batch):
+        """Run a batch of writes in one transaction, then resolve their futures."""
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with self.pool.writer() as conn:
+                for future, operation, args in batch:
+                    conn.execute("SAVEPOINT write_behind")
+                    try:
+                        outcomes.append((future.set_result, operation(conn, *args)))
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO write_behind")
+                        outcomes.append((future.set_exception, e))
+                    conn.execute("RELEASE write_behind")
+        except sqlite3.Error as e:
+            # Nothing in the batch was committed
+            for future, _operation, _args in batch:
+                future.set_exception(e)
+            return
+        except BaseException as e:
+            for future, _operation, _args in batch:
+                future.set_exception(e)
+            raise
+        for resolve, value in outcomes:
+            resolve(value)
+
+    def _abandon(self):
+        """Refuse new writes and fail the queued ones after the writer thread died."""
+        with self._lock:
+            self._closed = True
+        error = RuntimeError(f"The write-behind thread for {self.pool.db_file} stopped.")
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[0].set_running_or_notify_cancel():
+                item[0].set_exception(error)
+
+    def _run(self):
+        stop = False
+        try:
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._commit(batch)
+        finally:
+            if not stop:
+                self._abandon()